@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+K1 Directory Browsing
+
+Backs /api/browse with cached, paginated directory listings so the folder
+browser stays instant on large network shares:
+
+- Listings are built once with os.scandir (no extra stat per entry) and cached
+- A cached listing is reused as long as the directory's mtime is unchanged
+  (entries added, removed or renamed change it); one stat per request
+- Pages are addressed by a name cursor, so paging stays consistent while the
+  folder changes
+- Optional filtering to folders only, files only or image files only
+
+Used by both server.py and server_production.py through create_browse_blueprint().
+"""
+
+import bisect
+import collections
+import logging
+import os
+import stat
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from flask import Blueprint, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.bmp'}
+
+# Listings built this soon after the directory changed are not trusted: a further
+# change within the filesystem's timestamp granularity would keep the same mtime
+MTIME_GRANULARITY_NS = 2 * 1000 * 1000 * 1000
+
+class DirectoryListing:
+    """Sorted snapshot of a directory's folders and files."""
+
+    def __init__(self, folders: List[str], files: List[str], mtime_ns: int, built_ns: int):
+        self.folders = folders
+        self.files = files
+        self.images = [name for name in files if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+        self.mtime_ns = mtime_ns
+        self.built_ns = built_ns
+
+    def is_current(self, mtime_ns: int) -> bool:
+        """True if the directory has not changed since the listing was built."""
+        return mtime_ns == self.mtime_ns and self.built_ns - self.mtime_ns > MTIME_GRANULARITY_NS
+
+class DirectoryListingCache:
+    """LRU cache of directory listings, invalidated by directory mtime."""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._listings = collections.OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _scan(self, folder_path: str, mtime_ns: int) -> DirectoryListing:
+        built_ns = time.time_ns()
+        folders = []
+        files = []
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                try:
+                    # d_type from the directory read; only symlinks need a stat
+                    if entry.is_dir():
+                        folders.append(entry.name)
+                    else:
+                        files.append(entry.name)
+                except OSError:
+                    continue
+        folders.sort()
+        files.sort()
+        return DirectoryListing(folders, files, mtime_ns, built_ns)
+
+    def get(self, folder_path: str, folder_stat: Optional[os.stat_result] = None) -> Tuple[DirectoryListing, bool]:
+        """
+        Return the listing of a directory and whether it came from the cache.
+
+        Concurrent requests for the same uncached directory share one scan.
+
+        Args:
+            folder_path: Directory to list
+            folder_stat: os.stat() of the directory if the caller already has it
+
+        Raises:
+            OSError: If the directory cannot be read
+        """
+        requested_ns = time.time_ns()
+        mtime_ns = (folder_stat or os.stat(folder_path)).st_mtime_ns
+        with self._lock:
+            listing = self._listings.get(folder_path)
+            if listing is not None and listing.is_current(mtime_ns):
+                self._listings.move_to_end(folder_path)
+                self.hits += 1
+                return listing, True
+            self.misses += 1
+            build_lock = self._building.setdefault(folder_path, threading.Lock())
+
+        with build_lock:
+            try:
+                # A scan started after this request arrived is recent enough
+                with self._lock:
+                    listing = self._listings.get(folder_path)
+                if listing is not None and listing.built_ns >= requested_ns:
+                    return listing, True
+                listing = self._scan(folder_path, mtime_ns)
+                with self._lock:
+                    self._listings[folder_path] = listing
+                    self._listings.move_to_end(folder_path)
+                    while len(self._listings) > self.max_entries:
+                        self._listings.popitem(last=False)
+            finally:
+                # Also after a failed scan, so the next request scans again
+                with self._lock:
+                    self._building.pop(folder_path, None)
+        return listing, False
+
+def list_directory(listing: DirectoryListing, kind: str = 'all', images_only: bool = False,
+                   cursor: Optional[str] = None, limit: int = 500) -> Dict[str, object]:
+    """
+    Return one page of a listing.
+
+    Folders come first, then files. The cursor is 'd:<name>' or 'f:<name>' of
+    the last entry returned, so pages stay consistent when entries are added
+    or removed in between.
+
+    Args:
+        listing: Directory listing
+        kind: 'all', 'folders' or 'files'
+        images_only: Only return image files
+        cursor: next_cursor of the previous page
+        limit: Maximum number of entries in the page
+
+    Returns:
+        Dict[str, object]: folders, files and next_cursor (None on the last page)
+    """
+    files = listing.images if images_only else listing.files
+    section, after = 'd', None
+    if cursor:
+        section, _, after = cursor.partition(':')
+        if section not in ('d', 'f'):
+            raise ValueError(f"Invalid cursor: {cursor}")
+
+    folders_page, files_page = [], []
+    next_cursor = None
+    if kind != 'files' and section == 'd':
+        start = bisect.bisect_right(listing.folders, after) if after is not None else 0
+        folders_page = listing.folders[start:start + limit]
+        if start + len(folders_page) < len(listing.folders):
+            next_cursor = f"d:{folders_page[-1]}"
+        after = None
+
+    remaining = limit - len(folders_page)
+    if kind != 'folders' and next_cursor is None:
+        if remaining == 0:
+            # Page filled with folders: files start on the next page
+            next_cursor = 'f:' if files else None
+        else:
+            start = bisect.bisect_right(files, after) if after is not None else 0
+            files_page = files[start:start + remaining]
+            if start + len(files_page) < len(files):
+                next_cursor = f"f:{files_page[-1]}"
+
+    return {'folders': folders_page, 'files': files_page, 'next_cursor': next_cursor}
+
+def create_browse_blueprint(cache: Optional[DirectoryListingCache] = None) -> Blueprint:
+    """Create the /api/browse endpoint backed by a directory listing cache."""
+    browse_api = Blueprint('browse', __name__)
+    cache = cache or DirectoryListingCache()
+
+    @browse_api.route('/api/browse', methods=['POST'])
+    def browse_directory():
+        """Browse a directory: one page of folders and files."""
+        data = request.json or {}
+        folder_path = data.get('folder_path', '')
+        kind = data.get('kind', 'all')
+        if kind not in ('all', 'folders', 'files'):
+            return jsonify({'error': f"Invalid kind: {kind}"}), 400
+        try:
+            limit = max(1, min(int(data.get('limit', 500)), 5000))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        # If no path provided, start from current directory
+        if not folder_path:
+            folder_path = os.getcwd()
+
+        # Normalize the path
+        folder_path = os.path.normpath(folder_path)
+
+        # Check if path exists and is a directory (one stat, reused by the cache)
+        try:
+            folder_stat = os.stat(folder_path)
+        except (OSError, ValueError):
+            return jsonify({'error': 'Path does not exist'}), 400
+
+        if not stat.S_ISDIR(folder_stat.st_mode):
+            return jsonify({'error': 'Path is not a directory'}), 400
+
+        try:
+            listing, cached = cache.get(folder_path, folder_stat)
+            page = list_directory(listing, kind, bool(data.get('images_only')), data.get('cursor'), limit)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except PermissionError as e:
+            return jsonify({'error': f'Permission denied: {str(e)}'}), 403
+        except Exception as e:
+            logger.error(f"Error listing directory: {e}")
+            return jsonify({'error': str(e)}), 500
+
+        # Get parent directory
+        parent_dir = os.path.dirname(folder_path) if folder_path != os.path.dirname(folder_path) else None
+
+        # Get folder name
+        folder_name = os.path.basename(folder_path) if folder_path != os.path.dirname(folder_path) else folder_path
+
+        return jsonify({
+            'folder_name': folder_name,
+            'full_path': folder_path,
+            'parent_dir': parent_dir,
+            'folders': page['folders'],
+            'files': page['files'],
+            'folder_count': len(listing.folders),
+            'file_count': len(listing.files),
+            'image_count': len(listing.images),
+            'next_cursor': page['next_cursor'],
+            'cached': cached,
+        })
+
+    return browse_api
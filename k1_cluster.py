@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+"""
+K1 Multi-Node Processing - Coordinator and Workers
+
+Spreads a K1 multi-folder job over several machines. The coordinator publishes
+image-level work items (see K1MultiFolderProcessor.collect_work_items) to a
+SQLite queue file on a shared mount; workers on any machine pull items, process
+them and acknowledge them.
+
+Each pulled item is leased for a limited time and the lease is renewed while the
+worker is busy. If a worker dies, its lease expires and the item goes back to the
+queue for another worker. Items failing more than --max-attempts deliveries are
+marked failed. Workers take the lease duration and attempt limit from the published
+job. If no worker holds a live lease or finishes an item for --idle-timeout seconds,
+the coordinator marks the remaining items failed instead of waiting forever.
+
+NOTE: Put the queue file on a share with working file locks (SMB, NFS with lockd).
+The queue uses SQLite's rollback journal because WAL mode does not work over
+network file systems.
+
+USAGE:
+  # On the coordinator machine (enqueue, then wait and report)
+  py k1_cluster.py coordinator --queue "//nas/k1/queue.db" --base-input "//nas/k1/input" --base-output "//nas/k1/output" --config "final_v2"
+
+  # On every worker machine
+  py k1_cluster.py worker --queue "//nas/k1/queue.db"
+
+  # Everything on one machine with 4 local worker processes
+  py k1_cluster.py coordinator --queue queue.db --base-input "k1_test_input" --base-output "k1_output" --config "batch" --batch-configs "final_v2,final_v3" --fan-out --local-workers 4
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Optional
+
+from k1_multi_folder import K1MultiFolderProcessor, WorkItem
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS job (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    image TEXT NOT NULL,
+    configs TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    results TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS items_state ON items (state, cost);
+"""
+
+class WorkQueue:
+    """SQLite-backed work queue with leases and re-delivery."""
+
+    def __init__(self, path: str, lease_seconds: float = 60.0, max_attempts: int = 3):
+        """
+        Open (and create if needed) the queue file.
+
+        Args:
+            path: SQLite queue file, on a shared mount for multi-node runs
+            lease_seconds: How long a pulled item stays reserved without renewal
+            max_attempts: Deliveries before an item is marked failed
+        """
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """Close the queue file."""
+        self.db.close()
+
+    def _transaction(self, statements) -> list:
+        """Run statements in one write transaction; returns the fetched rows."""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = statements(self.db)
+                self.db.execute("COMMIT")
+                return rows
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def publish(self, meta: Dict[str, object], items: List[WorkItem], base_input: str) -> None:
+        """Replace the queue contents with a new job."""
+        def statements(db):
+            db.execute("DELETE FROM job")
+            db.execute("DELETE FROM items")
+            db.executemany("INSERT INTO job (key, value) VALUES (?, ?)",
+                           [(key, json.dumps(value)) for key, value in meta.items()])
+            db.executemany(
+                "INSERT INTO items (folder, image, configs, cost) VALUES (?, ?, ?, ?)",
+                [(item.folder, os.path.relpath(item.input_path, base_input),
+                  json.dumps(list(item.config_names)), item.cost) for item in items]
+            )
+        self._transaction(statements)
+
+    def get_meta(self) -> Dict[str, object]:
+        """Return the job description published by the coordinator."""
+        with self._lock:
+            rows = self.db.execute("SELECT key, value FROM job").fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def _expire(self, db: sqlite3.Connection, now: float) -> None:
+        """
+        End expired leases (their worker died or lost the share).
+
+        Items whose leases expired too often (worker keeps dying on them) are
+        failed, the others go back to pending for the next worker. Only live
+        leases stay 'leased', so they alone count as work in progress.
+        """
+        db.execute(
+            "UPDATE items SET state = 'failed', error = 'too many delivery attempts' "
+            "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+            (now, self.max_attempts)
+        )
+        db.execute(
+            "UPDATE items SET state = 'pending', lease_expires = NULL "
+            "WHERE state = 'leased' AND lease_expires < ?",
+            (now,)
+        )
+
+    def expire(self) -> None:
+        """End expired leases: re-queue their items or fail them after max_attempts."""
+        self._transaction(lambda db: self._expire(db, time.time()))
+
+    def claim(self, worker_id: str) -> Optional[dict]:
+        """
+        Lease the next item (largest first), re-delivering expired leases.
+
+        Returns:
+            Optional[dict]: The leased item, or None if nothing is available
+        """
+        def statements(db):
+            now = time.time()
+            self._expire(db, now)
+            row = db.execute(
+                "SELECT id, folder, image, configs, attempts FROM items "
+                "WHERE state = 'pending' ORDER BY cost DESC LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE items SET state = 'leased', worker = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (worker_id, now + self.lease_seconds, row[0])
+            )
+            return {'id': row[0], 'folder': row[1], 'image': row[2],
+                    'configs': json.loads(row[3]), 'attempt': row[4] + 1}
+        return self._transaction(statements)
+
+    def renew(self, item_id: int, worker_id: str) -> bool:
+        """Extend a lease; returns False if the lease was lost."""
+        def statements(db):
+            cursor = db.execute(
+                "UPDATE items SET lease_expires = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+                (time.time() + self.lease_seconds, item_id, worker_id)
+            )
+            return cursor.rowcount == 1
+        return self._transaction(statements)
+
+    def ack(self, item_id: int, worker_id: str, results: Dict[str, bool]) -> bool:
+        """Acknowledge a processed item; returns False if another worker leased it meanwhile."""
+        def statements(db):
+            # A late result still counts while the expired item waits for a new lease
+            cursor = db.execute(
+                "UPDATE items SET state = 'done', results = ?, lease_expires = NULL "
+                "WHERE id = ? AND worker = ? AND state IN ('leased', 'pending')",
+                (json.dumps(results), item_id, worker_id)
+            )
+            return cursor.rowcount == 1
+        return self._transaction(statements)
+
+    def fail_pending(self, error: str) -> int:
+        """Mark all items not yet leased as failed; returns their number."""
+        def statements(db):
+            cursor = db.execute("UPDATE items SET state = 'failed', error = ? WHERE state = 'pending'",
+                                (error,))
+            return cursor.rowcount
+        return self._transaction(statements)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of items per state."""
+        with self._lock:
+            rows = self.db.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+        return dict(rows)
+
+    def results(self) -> Dict[str, Dict[str, bool]]:
+        """Per configuration, success per subfolder (same shape as K1 batch results)."""
+        with self._lock:
+            rows = self.db.execute("SELECT folder, configs, state, results FROM items").fetchall()
+
+        batch_results = {}
+        for folder, configs, state, results in rows:
+            results = json.loads(results) if results else {}
+            for config_name in json.loads(configs):
+                success = state == 'done' and results.get(config_name, False)
+                folder_results = batch_results.setdefault(config_name, {})
+                folder_results[folder] = folder_results.get(folder, True) and success
+        return batch_results
+
+def run_worker(queue_path: str, worker_id: Optional[str] = None,
+               base_input: Optional[str] = None, base_output: Optional[str] = None,
+               lease_seconds: Optional[float] = None, poll_interval: float = 2.0) -> int:
+    """
+    Pull, process and acknowledge work items until the queue is drained.
+
+    Args:
+        queue_path: SQLite queue file
+        worker_id: Unique worker name (default: host-pid)
+        base_input: Local path of the input share (default: as published)
+        base_output: Local path of the output share (default: as published)
+        lease_seconds: Lease duration, renewed every third of it while busy
+            (default: as published)
+        poll_interval: Wait between polls while other workers hold the last items
+
+    Returns:
+        int: Number of items processed by this worker
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    queue = WorkQueue(queue_path)
+    meta = queue.get_meta()
+    if not meta:
+        logger.error(f"No job published in {queue_path}")
+        return 0
+
+    # Leases are expired by the workers too, so they use the coordinator's limits
+    lease_seconds = lease_seconds or meta.get('lease_seconds', queue.lease_seconds)
+    queue.lease_seconds = lease_seconds
+    queue.max_attempts = meta.get('max_attempts', queue.max_attempts)
+
+    base_input = base_input or meta['base_input']
+    base_output = base_output or meta['base_output']
+
+    processor = K1MultiFolderProcessor()
+    processors = processor.build_processors(meta['config_names'], meta.get('custom_settings'))
+    logger.info(f"Worker {worker_id} started on {queue_path}")
+
+    processed = 0
+    while True:
+        leased = queue.claim(worker_id)
+        if leased is None:
+            counts = queue.counts()
+            if not counts.get('pending') and not counts.get('leased'):
+                break
+            # Other workers hold the remaining items; wait for a lease to expire
+            time.sleep(poll_interval)
+            continue
+
+        item = WorkItem(leased['folder'], os.path.join(base_input, leased['image']),
+                        tuple(leased['configs']), 0)
+
+        # Keep the lease alive while the image is being processed
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(lease_seconds / 3):
+                if not queue.renew(leased['id'], worker_id):
+                    logger.warning(f"Lost lease on {leased['image']}")
+                    return
+
+        renewer = threading.Thread(target=heartbeat, daemon=True)
+        renewer.start()
+        try:
+            results = processor.run_work_item(item, base_output, processors)
+        except Exception as e:
+            logger.error(f"Exception processing {item.input_path}: {e}")
+            results = {config_name: False for config_name in item.config_names}
+        finally:
+            done.set()
+            renewer.join()
+
+        if queue.ack(leased['id'], worker_id, results):
+            processed += 1
+        else:
+            logger.warning(f"Lease on {leased['image']} expired before acknowledgement")
+
+    queue.close()
+    logger.info(f"Worker {worker_id} finished: {processed} items processed")
+    return processed
+
+def run_coordinator(queue_path: str, base_input: str, base_output: str,
+                    config_names: List[str], custom_settings: Optional[Dict[str, str]] = None,
+                    fan_out: bool = True, lease_seconds: float = 60.0, max_attempts: int = 3,
+                    local_workers: int = 0, poll_interval: float = 2.0,
+                    idle_timeout: Optional[float] = 600.0) -> Dict[str, Dict[str, bool]]:
+    """
+    Publish a job to the queue and wait until all items are done or failed.
+
+    Args:
+        local_workers: Also start this many worker processes on this machine
+        idle_timeout: Seconds without any item in progress or finished after
+            which the pending items are marked failed (None: wait forever)
+
+    Returns:
+        Dict[str, Dict[str, bool]]: Per configuration, success per subfolder
+    """
+    processor = K1MultiFolderProcessor()
+    config_names = [name for name in config_names if name == "custom" or processor.validate_configuration(name)]
+    if not config_names:
+        return {}
+
+    items = processor.collect_work_items(base_input, config_names, fan_out)
+    queue = WorkQueue(queue_path, lease_seconds, max_attempts)
+    queue.publish({
+        'base_input': os.path.abspath(base_input),
+        'base_output': os.path.abspath(base_output),
+        'config_names': config_names,
+        'custom_settings': custom_settings or {},
+        'lease_seconds': lease_seconds,
+        'max_attempts': max_attempts,
+    }, items, base_input)
+    logger.info(f"Published {len(items)} work items to {queue_path}")
+
+    workers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker",
+                          "--queue", queue_path, "--worker-id", f"local-{i + 1}"])
+        for i in range(local_workers)
+    ]
+
+    try:
+        last_activity = time.time()
+        last_finished = 0
+        while True:
+            queue.expire()
+            counts = queue.counts()
+            finished = counts.get('done', 0) + counts.get('failed', 0)
+            logger.info(f"Progress: {finished}/{len(items)} items "
+                        f"({counts.get('leased', 0)} in progress, {counts.get('failed', 0)} failed)")
+            if finished >= len(items):
+                break
+            if counts.get('leased') or finished != last_finished:
+                last_activity = time.time()
+                last_finished = finished
+            elif idle_timeout and time.time() - last_activity > idle_timeout:
+                failed = queue.fail_pending('no worker claimed the item')
+                logger.error(f"No worker active for {idle_timeout:g} seconds, "
+                             f"giving up on {failed} unclaimed items")
+                break
+            time.sleep(poll_interval)
+    finally:
+        for worker in workers:
+            worker.wait()
+
+    results = queue.results()
+    queue.close()
+    return results
+
+def main():
+    """Main function for multi-node K1 processing."""
+    parser = argparse.ArgumentParser(
+        description="K1 multi-node watermark processing (coordinator and workers)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Publish a job and process it with 4 local workers
+  py k1_cluster.py coordinator --queue queue.db --base-input "k1_test_input" --base-output "k1_output" --config "final_v2" --local-workers 4
+
+  # Join from another machine (paths as mounted there)
+  py k1_cluster.py worker --queue "//nas/k1/queue.db" --base-input "//nas/k1/input" --base-output "//nas/k1/output"
+        """
+    )
+    subparsers = parser.add_subparsers(dest='role', required=True)
+
+    coordinator = subparsers.add_parser('coordinator', help='Publish a job and wait for completion')
+    coordinator.add_argument('--queue', required=True, help='SQLite queue file (on a shared mount)')
+    coordinator.add_argument('--base-input', required=True, help='Parent input folder containing subfolders')
+    coordinator.add_argument('--base-output', required=True, help='Base output folder')
+    coordinator.add_argument('--config', required=True, help='Configuration name, "custom" or "batch"')
+    coordinator.add_argument('--batch-configs', help='Comma-separated list of configurations for batch processing')
+    coordinator.add_argument('--custom-settings',
+                             help='JSON object of configuration overrides, e.g. \'{"margin": "150"}\'')
+    coordinator.add_argument('--fan-out', action='store_true',
+                             help='One work item per image carrying all configurations (decode once)')
+    coordinator.add_argument('--local-workers', type=int, default=0,
+                             help='Worker processes to start on this machine (default: 0)')
+    coordinator.add_argument('--lease-seconds', type=float, default=60.0,
+                             help='Lease duration before an item is re-delivered (default: 60)')
+    coordinator.add_argument('--max-attempts', type=int, default=3,
+                             help='Deliveries before an item is marked failed (default: 3)')
+    coordinator.add_argument('--idle-timeout', type=float, default=600.0,
+                             help='Seconds without any worker activity before the remaining items are '
+                                  'marked failed (0: wait forever, default: 600)')
+
+    worker = subparsers.add_parser('worker', help='Process items from a queue')
+    worker.add_argument('--queue', required=True, help='SQLite queue file (on a shared mount)')
+    worker.add_argument('--worker-id', help='Unique worker name (default: host-pid)')
+    worker.add_argument('--base-input', help='Local path of the input folder if mounted elsewhere')
+    worker.add_argument('--base-output', help='Local path of the output folder if mounted elsewhere')
+    worker.add_argument('--lease-seconds', type=float, default=None,
+                        help='Lease duration, renewed while processing (default: as published by the coordinator)')
+
+    args = parser.parse_args()
+
+    if args.role == 'worker':
+        run_worker(args.queue, args.worker_id, args.base_input, args.base_output, args.lease_seconds)
+        return
+
+    if args.batch_configs:
+        config_names = [name.strip() for name in args.batch_configs.split(',')]
+    else:
+        config_names = [args.config]
+
+    start_time = time.time()
+    custom_settings = json.loads(args.custom_settings) if args.custom_settings else None
+    results = run_coordinator(args.queue, args.base_input, args.base_output, config_names,
+                              custom_settings, fan_out=args.fan_out, lease_seconds=args.lease_seconds,
+                              max_attempts=args.max_attempts, local_workers=args.local_workers,
+                              idle_timeout=args.idle_timeout)
+
+    logger.info("\n" + "=" * 50)
+    logger.info("CLUSTER PROCESSING SUMMARY")
+    logger.info("=" * 50)
+    total_failed = 0
+    for config_name, config_results in results.items():
+        config_success = sum(1 for success in config_results.values() if success)
+        config_failed = len(config_results) - config_success
+        total_failed += config_failed
+        logger.info(f"\n{config_name}:")
+        logger.info(f"  Success: {config_success}")
+        logger.info(f"  Failed: {config_failed}")
+
+    logger.info(f"\nTotal processing time: {time.time() - start_time:.2f} seconds")
+    if total_failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+K1 Job Download Endpoint
+
+Streams the outputs of a job as a ZIP archive, so operators on the LAN can
+fetch results without a file share:
+
+- GET /api/jobs/<id>/download returns <job>.zip with one folder per output
+  folder of the job (<subfolder>_<config>/<image>)
+- The archive is written straight into the response while it is built: no
+  temporary file, memory use bounded by one read chunk whatever the job size
+- JPEG, PNG and WEBP outputs are stored without compression (they are already
+  compressed), other formats are deflated
+- While the job is still running, finished outputs are sent as they appear
+  (outputs are renamed into place when complete, so partial files are never
+  included) until the job has finished
+- Only files written since the job was created are included: outputs of
+  earlier runs into the same folders are left out, also those a new job
+  resuming an earlier run skips (outputs taken from the output cache count
+  as written, linking them refreshes their time)
+- Downloads are limited by a concurrency cap (503 when saturated)
+
+Used by both server.py and server_production.py through create_download_blueprint().
+"""
+
+import logging
+import os
+import threading
+import time
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+from flask import Blueprint, Response, jsonify, stream_with_context
+
+from k1_jobs import job_output_folders
+from watermark_script import PARTIAL_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Formats that gain nothing from deflate
+STORED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Seconds between scans for new outputs of a running job
+RUNNING_SCAN_INTERVAL = 1.0
+
+# Outputs this much older than the job still belong to it (coarse file system timestamps, e.g. FAT)
+MTIME_SLACK = 2.0
+
+class _ZipStream:
+    """Write-only sink for ZipFile whose data is taken out chunk by chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def finished_outputs(job, cwd: Optional[str] = None) -> List[Tuple[str, str]]:
+    """(archive name, path) of the complete outputs a job has written so far."""
+    written_after = job.created_at - MTIME_SLACK
+    outputs = []
+    for archive_folder, folder in job_output_folders(job, cwd):
+        try:
+            entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+        except OSError:
+            continue
+        for entry in entries:
+            # Partial files and hidden files (e.g. journals) are not outputs
+            if entry.name.startswith('.') or entry.name.endswith(PARTIAL_SUFFIX):
+                continue
+            try:
+                if not entry.is_file() or entry.stat().st_mtime < written_after:
+                    # Left by an earlier run
+                    continue
+            except OSError:
+                continue
+            outputs.append((f"{archive_folder}/{entry.name}", entry.path))
+    return outputs
+
+def stream_job_zip(job, scan_interval: float = RUNNING_SCAN_INTERVAL,
+                   cwd: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Generate a ZIP archive of a job's outputs chunk by chunk.
+
+    Outputs are added as they are found; for a running job the output folders
+    are scanned again every scan_interval seconds until the job has finished.
+    """
+    stream = _ZipStream()
+    sent = set()
+    # Unseekable output: entries are written with data descriptors
+    with zipfile.ZipFile(stream, 'w', allowZip64=True) as archive:
+        while True:
+            finished = job.finished
+            for name, path in finished_outputs(job, cwd):
+                if name in sent:
+                    continue
+                try:
+                    info = zipfile.ZipInfo.from_file(path, name)
+                    source = open(path, 'rb')
+                except OSError as e:
+                    # Replaced since the scan; a later scan finds it again
+                    logger.debug(f"Cannot add {path} to the download of job {job.id}: {e}")
+                    continue
+                sent.add(name)
+                info.compress_type = (zipfile.ZIP_STORED if os.path.splitext(name)[1].lower()
+                                      in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED)
+                with source, archive.open(info, 'w') as target:
+                    for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b''):
+                        target.write(chunk)
+                        data = stream.drain()
+                        if data:
+                            yield data
+                data = stream.drain()
+                if data:
+                    yield data
+            if finished:
+                break
+            time.sleep(scan_interval)
+    # Central directory
+    yield stream.drain()
+    logger.info(f"Download of job {job.id} complete: {len(sent)} files")
+
+def create_download_blueprint(manager, max_downloads: int = 2, cwd: Optional[str] = None) -> Blueprint:
+    """
+    Create the /api/jobs/<id>/download endpoint.
+
+    Args:
+        manager: k1_jobs.JobManager the jobs are looked up in
+        max_downloads: Concurrent downloads; each holds a server thread,
+            further requests get 503
+        cwd: Folder relative job paths are resolved against, as by the job
+            runner (default: the working directory)
+    """
+    download_api = Blueprint('download', __name__)
+    slots = threading.BoundedSemaphore(max_downloads)
+
+    @download_api.route('/api/jobs/<job_id>/download', methods=['GET'])
+    def download_job(job_id):
+        """Stream the job's outputs as a ZIP archive (also while the job is running)."""
+        job = manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if not slots.acquire(blocking=False):
+            return jsonify({'error': 'Too many downloads in progress, try again later'}), 503
+
+        response = Response(stream_with_context(stream_job_zip(job, cwd=cwd)), mimetype='application/zip',
+                            headers={'Content-Disposition': f'attachment; filename="k1_job_{job.id}.zip"',
+                                     'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # Released when the server closes the response, also if the client disconnects early
+        response.call_on_close(slots.release)
+        return response
+
+    return download_api
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+K1 Folder Statistics Index
+
+Backs /api/validate with per-subfolder statistics so a job can be sized before
+it starts:
+
+- Image count, total bytes and megapixels per subfolder (images in nested
+  folders included, as processed by k1_multi_folder.py)
+- Histograms of formats and resolutions, read from the image headers only
+  (no pixel data is decoded)
+- Indexes are built and refreshed on a background thread and cached per input
+  folder; a request never waits longer than it asks to, and at most
+  MAX_VALIDATE_WAIT seconds
+- Refreshes are incremental: folders whose mtime is unchanged are not listed
+  again and unchanged files (same size and mtime) keep their header data
+
+Used by both server.py and server_production.py through create_validate_blueprint().
+"""
+
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Blueprint, jsonify, request
+from PIL import Image
+
+from k1_browse import IMAGE_EXTENSIONS, MTIME_GRANULARITY_NS
+
+logger = logging.getLogger(__name__)
+
+# Images per worker below which more parallel workers do not pay off
+IMAGES_PER_WORKER = 20
+# Resolutions reported in the totals (most frequent first)
+TOP_RESOLUTIONS = 20
+# Longest a request thread waits for a first index; clients poll after that
+MAX_VALIDATE_WAIT = 2.0
+
+# Per image: (size, mtime_ns, format, width, height)
+FileInfo = Tuple[int, int, Optional[str], int, int]
+
+class DirectoryNode:
+    """Cached state of one indexed directory."""
+
+    __slots__ = ('mtime_ns', 'scanned_ns', 'files', 'subdirs')
+
+    def __init__(self, mtime_ns: int, scanned_ns: int, files: Dict[str, FileInfo], subdirs: List[str]):
+        self.mtime_ns = mtime_ns
+        self.scanned_ns = scanned_ns
+        self.files = files
+        self.subdirs = subdirs
+
+def read_header(path: str) -> Tuple[Optional[str], int, int]:
+    """Return (format, width, height) from an image header; (None, 0, 0) if unreadable."""
+    try:
+        with Image.open(path) as img:
+            return img.format, img.width, img.height
+    except Exception:
+        return None, 0, 0
+
+def summarize(files: Iterator[FileInfo]) -> Dict[str, object]:
+    """Aggregate file infos into folder statistics."""
+    stats = {
+        'image_count': 0,
+        'total_bytes': 0,
+        'total_megapixels': 0.0,
+        'unreadable': 0,
+        'formats': collections.Counter(),
+        'resolutions': collections.Counter(),
+    }
+    for size, _mtime_ns, image_format, width, height in files:
+        stats['image_count'] += 1
+        stats['total_bytes'] += size
+        if image_format is None:
+            stats['unreadable'] += 1
+            continue
+        stats['total_megapixels'] += width * height / 1_000_000
+        stats['formats'][image_format] += 1
+        stats['resolutions'][f"{width}x{height}"] += 1
+    return stats
+
+def merge_stats(folder_stats: List[Dict[str, object]]) -> Dict[str, object]:
+    """Sum the statistics of several folders."""
+    totals = {
+        'image_count': 0,
+        'total_bytes': 0,
+        'total_megapixels': 0.0,
+        'unreadable': 0,
+        'formats': collections.Counter(),
+        'resolutions': collections.Counter(),
+    }
+    for stats in folder_stats:
+        for key in ('image_count', 'total_bytes', 'total_megapixels', 'unreadable'):
+            totals[key] += stats[key]
+        totals['formats'].update(stats['formats'])
+        totals['resolutions'].update(stats['resolutions'])
+    return totals
+
+def stats_to_json(stats: Dict[str, object], top_resolutions: Optional[int] = None) -> Dict[str, object]:
+    """
+    JSON-friendly copy of folder statistics.
+
+    Histograms are [value, count] lists, most frequent first (JSON objects
+    would lose the order).
+    """
+    return {
+        'image_count': stats['image_count'],
+        'total_bytes': stats['total_bytes'],
+        'total_megapixels': round(stats['total_megapixels'], 1),
+        'unreadable': stats['unreadable'],
+        'formats': stats['formats'].most_common(),
+        'resolutions': stats['resolutions'].most_common(top_resolutions),
+    }
+
+def suggest_parallel(image_count: int, cpu_count: Optional[int] = None) -> int:
+    """Number of parallel workers worth starting for a job of this size."""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, min(cpu_count, image_count // IMAGES_PER_WORKER))
+
+class FolderIndex:
+    """Statistics of the subfolders of one input folder."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.nodes = {}
+        self.subfolders = {}
+        self.status = 'pending'
+        self.error = None
+        self.updated_at = None
+        self.scan_seconds = None
+        self.headers_read = 0
+        self.ready = threading.Event()
+
+class FolderStatsIndex:
+    """Cache of folder indexes, refreshed incrementally on a background thread."""
+
+    def __init__(self, max_roots: int = 8, max_age: float = 30.0):
+        """
+        Initialize the index.
+
+        Args:
+            max_roots: Number of input folders kept indexed
+            max_age: Seconds after which a request triggers a background refresh
+        """
+        self.max_roots = max_roots
+        self.max_age = max_age
+        self._indexes = collections.OrderedDict()
+        self._scheduled = set()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='folder-index', daemon=True)
+        self._thread.start()
+
+    def get(self, root: str, wait: float = 0.0) -> Dict[str, object]:
+        """
+        Return the statistics of an input folder, scheduling a refresh if needed.
+
+        Args:
+            root: Input folder containing subfolders
+            wait: Seconds to wait for a first index to complete
+
+        Returns:
+            Dict[str, object]: Snapshot of the index (status 'building' until complete)
+        """
+        root = os.path.abspath(root)
+        with self._lock:
+            index = self._indexes.get(root)
+            if index is None:
+                index = FolderIndex(root)
+                self._indexes[root] = index
+                while len(self._indexes) > self.max_roots:
+                    self._indexes.popitem(last=False)
+            self._indexes.move_to_end(root)
+            stale = index.updated_at is None or time.time() - index.updated_at > self.max_age
+            if stale and root not in self._scheduled:
+                self._scheduled.add(root)
+                self._queue.put(index)
+
+        if wait > 0:
+            index.ready.wait(wait)
+        return self.snapshot(index)
+
+    def snapshot(self, index: FolderIndex) -> Dict[str, object]:
+        """JSON-friendly view of an index."""
+        with self._lock:
+            subfolders = dict(index.subfolders)
+            status = index.status
+        totals = merge_stats(list(subfolders.values()))
+        return {
+            'status': status,
+            'error': index.error,
+            'updated_at': index.updated_at,
+            'scan_seconds': index.scan_seconds,
+            'subfolders': {name: stats_to_json(stats) for name, stats in sorted(subfolders.items())},
+            'totals': stats_to_json(totals, TOP_RESOLUTIONS),
+            'suggested_parallel': suggest_parallel(totals['image_count']),
+        }
+
+    def _run(self) -> None:
+        while True:
+            index = self._queue.get()
+            if index is None:
+                return
+            try:
+                self.refresh(index)
+            except Exception as e:
+                logger.error(f"Failed to index {index.root}: {e}")
+                with self._lock:
+                    index.status = 'error'
+                    index.error = str(e)
+                    index.updated_at = time.time()
+            finally:
+                with self._lock:
+                    self._scheduled.discard(index.root)
+                index.ready.set()
+
+    def refresh(self, index: FolderIndex) -> None:
+        """Bring an index up to date (incrementally); subfolders are published as they complete."""
+        started = time.time()
+        with self._lock:
+            index.status = 'building' if index.updated_at is None else 'refreshing'
+        index.headers_read = 0
+
+        with os.scandir(index.root) as entries:
+            names = sorted(entry.name for entry in entries if entry.is_dir())
+
+        nodes = {}
+        for name in names:
+            files = self._walk(index, os.path.join(index.root, name), nodes)
+            stats = summarize(files)
+            with self._lock:
+                index.subfolders[name] = stats
+
+        with self._lock:
+            for name in list(index.subfolders):
+                if name not in names:
+                    del index.subfolders[name]
+            # Nodes of removed folders are dropped
+            index.nodes = nodes
+            index.status = 'ready'
+            index.error = None
+            index.updated_at = time.time()
+            index.scan_seconds = round(index.updated_at - started, 3)
+        logger.info(f"Indexed {index.root}: {len(names)} subfolders, "
+                    f"{index.headers_read} headers read in {index.scan_seconds:.2f}s")
+
+    def _walk(self, index: FolderIndex, directory: str, nodes: Dict[str, DirectoryNode]) -> Iterator[FileInfo]:
+        """Yield the file infos of a folder tree, reusing unchanged cached folders."""
+        stack = [directory]
+        while stack:
+            path = stack.pop()
+            try:
+                node = self._scan_directory(index, path)
+            except OSError as e:
+                logger.debug(f"Cannot index {path}: {e}")
+                continue
+            nodes[path] = node
+            yield from node.files.values()
+            stack.extend(os.path.join(path, name) for name in node.subdirs)
+
+    def _scan_directory(self, index: FolderIndex, path: str) -> DirectoryNode:
+        mtime_ns = os.stat(path).st_mtime_ns
+        previous = index.nodes.get(path)
+        # Unchanged entries: reuse without listing or stat'ing the files again
+        if (previous is not None and previous.mtime_ns == mtime_ns
+                and previous.scanned_ns - mtime_ns > MTIME_GRANULARITY_NS):
+            return previous
+
+        scanned_ns = time.time_ns()
+        old_files = previous.files if previous is not None else {}
+        files = {}
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                        continue
+                    if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                old = old_files.get(entry.name)
+                if old is not None and old[0] == stat.st_size and old[1] == stat.st_mtime_ns:
+                    files[entry.name] = old
+                else:
+                    index.headers_read += 1
+                    files[entry.name] = (stat.st_size, stat.st_mtime_ns) + read_header(entry.path)
+        return DirectoryNode(mtime_ns, scanned_ns, files, sorted(subdirs))
+
+    def shutdown(self) -> None:
+        """Stop the background thread."""
+        self._queue.put(None)
+
+def create_validate_blueprint(index: Optional[FolderStatsIndex] = None) -> Blueprint:
+    """Create the /api/validate endpoint backed by a folder statistics index."""
+    validate_api = Blueprint('validate', __name__)
+    index = index or FolderStatsIndex()
+
+    @validate_api.route('/api/validate', methods=['POST'])
+    def validate_paths():
+        """Validate input and output paths and report the input folder statistics."""
+        try:
+            data = request.json
+            base_input = data.get('base_input', '')
+            base_output = data.get('base_output', '')
+            wait = max(0.0, min(float(data.get('wait', MAX_VALIDATE_WAIT)), MAX_VALIDATE_WAIT))
+
+            results = {
+                'base_input': {
+                    'exists': os.path.exists(base_input) if base_input else False,
+                    'is_dir': os.path.isdir(base_input) if base_input and os.path.exists(base_input) else False
+                },
+                'base_output': {
+                    'exists': os.path.exists(base_output) if base_output else False,
+                    'is_dir': os.path.isdir(base_output) if base_output and os.path.exists(base_output) else False,
+                    'can_create': True  # We can always try to create
+                }
+            }
+
+            # Check if input folder has subfolders
+            if results['base_input']['is_dir']:
+                try:
+                    subfolders = [f for f in os.listdir(base_input) if os.path.isdir(os.path.join(base_input, f))]
+                    results['base_input']['subfolders'] = subfolders
+                    results['base_input']['subfolder_count'] = len(subfolders)
+                    # Image counts, sizes and resolutions (may still be building)
+                    results['base_input']['stats'] = index.get(base_input, wait=wait)
+                except Exception as e:
+                    results['base_input']['error'] = str(e)
+
+            return jsonify(results)
+
+        except Exception as e:
+            logger.error(f"Error validating paths: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    return validate_api
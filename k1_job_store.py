@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+K1 Job Store
+
+Keeps the web server's jobs in a local SQLite database (WAL mode) so they
+survive restarts:
+
+- Jobs with their parameters, status, progress counters and log tail
+- The outcome of every image and configuration (success and worker seconds),
+  taken from the workers' 'metrics' progress events
+- Writes are queued and committed in batches by a background thread, never on
+  the image or request path; a job's state is written at most once per batch
+
+After a restart JobManager restores the stored jobs: finished jobs stay
+queryable and queued or interrupted jobs are queued again (see
+k1_jobs.JobManager). The image history gives per-configuration throughput for
+capacity planning (throughput()).
+
+Used by both server.py and server_production.py through JobManager(store=...).
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    command TEXT NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    return_code INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    deadline REAL,
+    worker_slots INTEGER NOT NULL DEFAULT 0,
+    counters TEXT,
+    progress TEXT,
+    log_lines INTEGER NOT NULL DEFAULT 0,
+    log_tail TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+CREATE TABLE IF NOT EXISTS image_results (
+    job_id TEXT NOT NULL,
+    config TEXT NOT NULL,
+    image TEXT NOT NULL,
+    success INTEGER NOT NULL,
+    seconds REAL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS image_results_job ON image_results (job_id);
+CREATE INDEX IF NOT EXISTS image_results_config ON image_results (config, finished_at);
+"""
+
+JOB_COLUMNS = ('id', 'command', 'request', 'status', 'return_code', 'error', 'created_at',
+               'started_at', 'finished_at', 'deadline', 'worker_slots', 'counters', 'progress',
+               'log_lines', 'log_tail')
+# Columns stored as JSON
+JSON_COLUMNS = ('command', 'request', 'counters', 'progress', 'log_tail')
+
+class JobStore:
+    """SQLite job database with batched writes from a background thread."""
+
+    def __init__(self, path: str, flush_interval: float = 1.0):
+        """
+        Open (and create if needed) the job database.
+
+        Args:
+            path: SQLite database file (on a local disk: WAL mode needs shared memory)
+            flush_interval: Seconds between batched writes
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Durable at checkpoints; a power loss can only drop the last batch
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._dirty = {}
+        self._outcomes = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='job-store', daemon=True)
+        self._thread.start()
+
+    def save(self, job) -> None:
+        """Queue a job's current state for the next batch (cheap, never blocks on the database)."""
+        with self._lock:
+            self._dirty[job.id] = job
+
+    def add_outcomes(self, job_id: str, outcomes: List[list]) -> None:
+        """Queue image outcomes ([image, config, success, seconds]) of a job."""
+        if not outcomes:
+            return
+        now = time.time()
+        rows = [(job_id, config, image, int(bool(success)), seconds, now)
+                for image, config, success, seconds in outcomes]
+        with self._lock:
+            self._outcomes.extend(rows)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Cannot write job store {self.path}: {e}")
+
+    def flush(self) -> None:
+        """Write the queued job states and image outcomes in one transaction."""
+        with self._lock:
+            jobs = list(self._dirty.values())
+            outcomes = self._outcomes
+            self._dirty = {}
+            self._outcomes = []
+        if not jobs and not outcomes:
+            return
+        # Snapshots are taken outside the database lock
+        records = [job.to_record() for job in jobs]
+        rows = [tuple(json.dumps(record[column]) if column in JSON_COLUMNS else record[column]
+                      for column in JOB_COLUMNS) for record in records]
+        placeholders = ', '.join('?' for _ in JOB_COLUMNS)
+        with self._db_lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                self.db.executemany(f"INSERT OR REPLACE INTO jobs ({', '.join(JOB_COLUMNS)}) "
+                                    f"VALUES ({placeholders})", rows)
+                self.db.executemany("INSERT INTO image_results (job_id, config, image, success, seconds, "
+                                    "finished_at) VALUES (?, ?, ?, ?, ?, ?)", outcomes)
+                self.db.execute("COMMIT")
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def load_jobs(self, finished_limit: int) -> List[Dict[str, object]]:
+        """Stored jobs, oldest first: all unfinished jobs and the newest `finished_limit` finished ones."""
+        columns = ', '.join(JOB_COLUMNS)
+        with self._db_lock:
+            rows = self.db.execute(
+                f"SELECT {columns} FROM jobs WHERE finished_at IS NULL UNION ALL "
+                f"SELECT * FROM (SELECT {columns} FROM jobs WHERE finished_at IS NOT NULL "
+                f"ORDER BY finished_at DESC LIMIT ?) ORDER BY created_at", (finished_limit,)
+            ).fetchall()
+        return [self._record(row) for row in rows]
+
+    def load_job(self, job_id: str) -> Optional[Dict[str, object]]:
+        """Stored job by ID, or None if unknown."""
+        with self._db_lock:
+            row = self.db.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?",
+                                  (job_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def _record(self, row: tuple) -> Dict[str, object]:
+        record = dict(zip(JOB_COLUMNS, row))
+        for column in JSON_COLUMNS:
+            if record[column] is not None:
+                record[column] = json.loads(record[column])
+        return record
+
+    def image_results(self, job_id: str, failed_only: bool = False) -> List[Dict[str, object]]:
+        """Outcomes of a job's images."""
+        query = "SELECT image, config, success, seconds, finished_at FROM image_results WHERE job_id = ?"
+        if failed_only:
+            query += " AND success = 0"
+        with self._db_lock:
+            rows = self.db.execute(query + " ORDER BY rowid", (job_id,)).fetchall()
+        return [{'image': image, 'config': config, 'success': bool(success), 'seconds': seconds,
+                 'finished_at': finished_at} for image, config, success, seconds, finished_at in rows]
+
+    def throughput(self, since: float = 0.0) -> Dict[str, Dict[str, object]]:
+        """
+        Per-configuration throughput of the jobs finished since a time.
+
+        Returns:
+            Dict[str, Dict[str, object]]: Per configuration: jobs, images, failed,
+            worker_seconds_per_image (CPU time one worker needs per image),
+            images_per_second (per job, wall clock) and images_per_hour_per_worker
+        """
+        with self._db_lock:
+            images = self.db.execute(
+                "SELECT config, COUNT(*), SUM(1 - success), SUM(seconds), COUNT(seconds) "
+                "FROM image_results WHERE finished_at >= ? GROUP BY config", (since,)
+            ).fetchall()
+            jobs = self.db.execute(
+                "SELECT r.config, COUNT(*), SUM(r.images), SUM(j.finished_at - j.started_at) "
+                "FROM jobs j JOIN (SELECT job_id, config, COUNT(*) AS images FROM image_results "
+                "GROUP BY job_id, config) r ON r.job_id = j.id "
+                "WHERE j.status = 'succeeded' AND j.finished_at >= ? GROUP BY r.config", (since,)
+            ).fetchall()
+        wall = {config: (job_count, job_images, seconds) for config, job_count, job_images, seconds in jobs}
+
+        results = {}
+        for config, count, failed, busy, timed in images:
+            per_image = busy / timed if timed else None
+            job_count, job_images, seconds = wall.get(config, (0, 0, 0.0))
+            results[config] = {
+                'jobs': job_count,
+                'images': count,
+                'failed': failed,
+                'worker_seconds_per_image': round(per_image, 4) if per_image else None,
+                'images_per_hour_per_worker': round(3600 / per_image) if per_image else None,
+                'images_per_second': round(job_images / seconds, 2) if seconds else None,
+            }
+        return results
+
+    def close(self) -> None:
+        """Write the pending batch and close the database."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        try:
+            self.flush()
+        finally:
+            with self._db_lock:
+                self.db.close()
@@ -0,0 +1,1143 @@
+#!/usr/bin/env python3
+"""
+K1 Job Manager
+
+Runs K1 multi-folder processing requests from the web frontend as background
+jobs. /api/execute queues a job and returns its ID right away; a bounded pool
+of runner threads executes the jobs, and GET /api/jobs/<id> reports status,
+progress counters and the tail of the log. The request threads of the web
+server are never blocked by a running batch.
+
+K1 runs with --progress-events; its structured progress events are kept per
+job (bounded) and streamed to the frontend as Server-Sent Events by
+GET /api/jobs/<id>/events. 'metrics' events carry the workers' own
+measurements of the processed images and go to the /metrics counters
+(k1_metrics.py) instead.
+
+Jobs are executed by a runner: SubprocessRunner starts the K1 command line,
+WarmPoolRunner (server_production.py) dispatches the images directly to a
+pre-started pool of worker processes that keep fonts, decoded watermark assets
+and overlay caches loaded between jobs.
+
+All jobs draw their worker processes from one server-wide WorkerBudget (by
+default the CPU count). A job waits in the queue until workers are free and is
+granted at most the free workers, so concurrent jobs never oversubscribe the
+machine whatever `parallel` each caller asks for.
+
+Warm-pool jobs run concurrently and share the pool image by image through a
+FairShareScheduler (watermark_pool.py): each user (or job) gets a fair share of
+the workers, weighted by the job's priority, so a small job finishes in seconds
+while a large batch is running.
+
+POST /api/jobs/<id>/cancel (or an optional per-job deadline) stops a job: no
+further images are started, the job's images in progress on the warm pool are
+stopped with their worker processes, subprocesses that do not stop within a
+second are killed and the job's partially written outputs are removed.
+
+With a JobStore (k1_job_store.py) jobs and the outcome of every image are kept
+in a local SQLite database: after a restart finished jobs stay queryable,
+queued jobs run and jobs interrupted by the restart resume where they stopped.
+GET /api/jobs/throughput reports per-configuration throughput from the history.
+
+Used by both server.py and server_production.py through create_jobs_blueprint().
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import json
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+
+import k1_metrics
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# Prefix of K1 progress event lines (k1_multi_folder.PROGRESS_EVENT_PREFIX)
+PROGRESS_EVENT_PREFIX = 'K1_EVENT '
+
+# Configurations loaded into the warm worker pool
+WARM_CONFIGS = ('final_v2', 'final_v3', 'glow_effect', 'dramatic_shadow')
+
+# Same format as the K1 log output
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# Share of the warm pool's workers per job priority
+PRIORITY_WEIGHTS = {'low': 0.5, 'normal': 1.0, 'high': 4.0}
+
+# Seconds between keep-alive comments on idle event streams
+EVENT_STREAM_KEEPALIVE = 15.0
+
+# Progress counters derived from the K1 log output
+LOG_COUNTERS = {
+    'outputs_written': re.compile(r'Successfully processed: '),
+    'folders_completed': re.compile(r'\bCompleted(?::| folder) '),
+    'errors': re.compile(r' - ERROR - '),
+}
+
+# Progress counters derived from K1 progress events
+EVENT_COUNTERS = {
+    'quarantined': 'quarantine',
+}
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be queued."""
+
+class WorkerBudget:
+    """
+    Server-wide number of worker processes shared by all jobs.
+
+    Jobs acquire workers in arrival order: the first waiting job is granted
+    as many of its requested workers as are free (at least one), so a large
+    job does not hold up the queue waiting for the whole machine.
+    """
+
+    def __init__(self, total: Optional[int] = None):
+        """
+        Initialize the budget.
+
+        Args:
+            total: Worker processes for all jobs together (default: CPU count)
+        """
+        self.total = max(1, total or os.cpu_count() or 1)
+        self.in_use = 0
+        self._waiting = collections.deque()
+        self._changed = threading.Condition()
+
+    def acquire(self, requested: int, cancel: Optional[threading.Event] = None) -> int:
+        """
+        Wait for free workers; returns the number granted (1 to requested).
+
+        Returns 0 without workers if cancel is set while waiting (see wake()).
+        """
+        requested = max(1, min(requested, self.total))
+        ticket = object()
+        with self._changed:
+            self._waiting.append(ticket)
+            try:
+                self._changed.wait_for(lambda: (cancel is not None and cancel.is_set())
+                                       or (self._waiting[0] is ticket and self.in_use < self.total))
+                if cancel is not None and cancel.is_set():
+                    return 0
+                granted = min(requested, self.total - self.in_use)
+                self.in_use += granted
+                return granted
+            finally:
+                self._waiting.remove(ticket)
+                self._changed.notify_all()
+
+    def try_acquire(self, workers: int = 1) -> bool:
+        """Take workers only if they are free and no job is waiting for them."""
+        with self._changed:
+            if self._waiting or self.in_use + workers > self.total:
+                return False
+            self.in_use += workers
+            return True
+
+    def release(self, workers: int) -> None:
+        """Return workers to the budget."""
+        with self._changed:
+            self.in_use = max(0, self.in_use - workers)
+            self._changed.notify_all()
+
+    def wake(self) -> None:
+        """Make waiting jobs check their cancel events."""
+        with self._changed:
+            self._changed.notify_all()
+
+    @property
+    def waiting(self) -> int:
+        """Number of jobs waiting for workers."""
+        with self._changed:
+            return len(self._waiting)
+
+class Job:
+    """A K1 processing run and its progress."""
+
+    def __init__(self, job_id: str, command: List[str], request: Optional[Dict] = None,
+                 log_lines: int = 200, max_events: int = 500):
+        """
+        Initialize a job.
+
+        Args:
+            job_id: Unique job identifier
+            command: Command line to run
+            request: The execute request the command was built from
+            log_lines: Number of log lines to keep (older lines are dropped)
+            max_events: Number of progress events to keep for event streams
+        """
+        self.id = job_id
+        self.command = command
+        self.request = request or {}
+        self.status = QUEUED
+        self.return_code = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.lines = 0
+        self.counters = {name: 0 for name in [*LOG_COUNTERS, *EVENT_COUNTERS]}
+        self.log = collections.deque(maxlen=log_lines)
+        self.progress = None
+        # Worker processes granted to the job by the worker budget
+        self.worker_slots = 0
+        # Absolute time after which the job is cancelled (None: no deadline)
+        self.deadline = None
+        self.cancelled = threading.Event()
+        self._cancel_callbacks = []
+        # Progress events as (sequence number, event) for event streams
+        self.events = collections.deque(maxlen=max_events)
+        self._event_seq = 0
+        # JobStore the job's state is saved to (None: not persisted)
+        self.store = None
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (SUCCEEDED, FAILED, CANCELLED)
+
+    def _add_event_locked(self, event: dict) -> None:
+        self._event_seq += 1
+        self.events.append((self._event_seq, event))
+        if event.get('event') == 'progress':
+            self.progress = event
+        for name, event_name in EVENT_COUNTERS.items():
+            if event.get('event') == event_name:
+                self.counters[name] += 1
+        self._changed.notify_all()
+        if self.store is not None:
+            self.store.save(self)
+
+    def add_event(self, event: dict) -> None:
+        """Record a progress event and wake up event streams."""
+        with self._lock:
+            self._add_event_locked(event)
+
+    def set_status(self, status: str, return_code: Optional[int] = None,
+                   error: Optional[str] = None) -> None:
+        """Change the job status; also published as a 'status' event."""
+        with self._lock:
+            self.status = status
+            if status == RUNNING:
+                self.started_at = time.time()
+            elif status in (SUCCEEDED, FAILED, CANCELLED):
+                self.finished_at = time.time()
+                self.return_code = return_code
+                self.error = error
+            self._add_event_locked({'event': 'status', 'status': status,
+                                    'return_code': return_code, 'time': round(time.time(), 3)})
+
+    def cancel(self, reason: str) -> bool:
+        """Request the job to stop; False if it has already finished."""
+        with self._lock:
+            if self.finished or self.cancelled.is_set():
+                return not self.finished
+            self.error = reason
+            self.cancelled.set()
+            callbacks = list(self._cancel_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Cannot stop job {self.id}: {e}")
+        return True
+
+    def on_cancel(self, callback) -> None:
+        """Call callback() when the job is cancelled (right away if it already is)."""
+        with self._lock:
+            self._cancel_callbacks.append(callback)
+        if self.cancelled.is_set():
+            callback()
+
+    def wait_events(self, after: int, timeout: float) -> List[tuple]:
+        """
+        Return events newer than sequence number `after`, waiting up to timeout.
+
+        Returns an empty list on timeout or when the job has finished and no
+        newer events remain.
+        """
+        with self._lock:
+            self._changed.wait_for(
+                lambda: self.finished or (self.events and self.events[-1][0] > after),
+                timeout=timeout
+            )
+            return [(seq, event) for seq, event in self.events if seq > after]
+
+    def add_line(self, line: str) -> None:
+        """Record one line of output (progress event lines become events)."""
+        if line.startswith(PROGRESS_EVENT_PREFIX):
+            try:
+                event = json.loads(line[len(PROGRESS_EVENT_PREFIX):])
+            except ValueError:
+                event = None
+            if isinstance(event, dict):
+                if event.get('event') == 'metrics':
+                    k1_metrics.record_worker_metrics(event)
+                    if self.store is not None:
+                        self.store.add_outcomes(self.id, event.get('outcomes') or [])
+                else:
+                    self.add_event(event)
+                return
+        with self._lock:
+            self.lines += 1
+            self.log.append(line)
+            for name, pattern in LOG_COUNTERS.items():
+                if pattern.search(line):
+                    self.counters[name] += 1
+        if self.store is not None:
+            self.store.save(self)
+
+    def to_dict(self, tail: int = 50) -> dict:
+        """JSON-serializable job state with the last `tail` log lines."""
+        with self._lock:
+            log_tail = list(self.log)[-tail:] if tail > 0 else []
+            counters = dict(self.counters)
+            lines = self.lines
+            progress = self.progress
+        if progress:
+            # Outputs written by worker processes do not show up in the log
+            counters['outputs_written'] = max(counters['outputs_written'], progress.get('outputs_done', 0))
+        end = self.finished_at or time.time()
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'success': self.status == SUCCEEDED,
+            'return_code': self.return_code,
+            'error': self.error,
+            'command': ' '.join(self.command),
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'elapsed': round(end - self.started_at, 2) if self.started_at else 0,
+            'worker_slots': self.worker_slots,
+            'priority': self.request.get('priority', 'normal'),
+            'deadline': self.deadline,
+            'counters': counters,
+            'progress': progress,
+            'log_lines': lines,
+            'log_tail': log_tail,
+        }
+
+    def to_record(self) -> dict:
+        """Job state for the JobStore (columns of its jobs table)."""
+        with self._lock:
+            return {
+                'id': self.id,
+                'command': self.command,
+                'request': self.request,
+                'status': self.status,
+                'return_code': self.return_code,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'deadline': self.deadline,
+                'worker_slots': self.worker_slots,
+                'counters': dict(self.counters),
+                'progress': self.progress,
+                'log_lines': self.lines,
+                'log_tail': list(self.log),
+            }
+
+    @classmethod
+    def from_record(cls, record: dict) -> 'Job':
+        """Job restored from a JobStore record."""
+        job = cls(record['id'], record['command'], record['request'])
+        for name in ('status', 'return_code', 'error', 'created_at', 'started_at', 'finished_at',
+                     'deadline', 'worker_slots', 'progress'):
+            setattr(job, name, record[name])
+        job.counters.update(record['counters'] or {})
+        job.lines = record['log_lines']
+        job.log.extend(record['log_tail'] or [])
+        return job
+
+class JobOutput:
+    """Text stream that feeds written lines into a job (e.g. for ProgressEvents)."""
+
+    def __init__(self, job: Job):
+        self.job = job
+        self._buffer = ''
+
+    def write(self, text: str) -> int:
+        self._buffer += text
+        while '\n' in self._buffer:
+            line, self._buffer = self._buffer.split('\n', 1)
+            self.job.add_line(line)
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+# Job whose log receives the records logged by the current thread
+_log_context = threading.local()
+
+@contextlib.contextmanager
+def job_log_context(job_id: str):
+    """Attribute log records of the current thread to a job (see JobLogHandler)."""
+    previous = getattr(_log_context, 'job_id', None)
+    _log_context.job_id = job_id
+    try:
+        yield
+    finally:
+        _log_context.job_id = previous
+
+class JobLogHandler(logging.Handler):
+    """Copies log records logged within job_log_context(job.id) into a job's log."""
+
+    def __init__(self, job: Job):
+        super().__init__()
+        self.job = job
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+        self.addFilter(lambda record: getattr(_log_context, 'job_id', None) == job.id)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.job.add_line(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+def process_tree(pid: int) -> Set[int]:
+    """
+    IDs of a job process and its worker processes.
+
+    On POSIX these are the members of its process group (the job runs in a
+    session of its own), on Windows its descendants. Only the process itself
+    is returned if the process table cannot be read.
+    """
+    pids = {pid}
+    try:
+        if os.name == 'nt':
+            listing = subprocess.run(
+                ['powershell', '-NoProfile', '-Command',
+                 'Get-CimInstance Win32_Process | ForEach-Object { "$($_.ProcessId) $($_.ParentProcessId)" }'],
+                capture_output=True, text=True, timeout=10).stdout
+            children = collections.defaultdict(list)
+            for line in listing.splitlines():
+                fields = line.split()
+                if len(fields) == 2 and fields[0].isdigit() and fields[1].isdigit():
+                    children[int(fields[1])].append(int(fields[0]))
+            stack = [pid]
+            while stack:
+                for child in children[stack.pop()]:
+                    if child not in pids:
+                        pids.add(child)
+                        stack.append(child)
+        else:
+            listing = subprocess.run(['ps', '-A', '-o', 'pid=', '-o', 'pgid='],
+                                     capture_output=True, text=True, timeout=10).stdout
+            for line in listing.splitlines():
+                fields = line.split()
+                if len(fields) == 2 and fields[1] == str(pid):
+                    pids.add(int(fields[0]))
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.debug(f"Cannot list the processes of job process {pid}: {e}")
+    return pids
+
+def job_output_folders(job: Job, cwd: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Existing output folders of a K1 job: <base_output>/<subfolder>_<config>.
+
+    Args:
+        job: The job
+        cwd: Folder relative paths of the request are resolved against
+            (default: the working directory)
+
+    Returns:
+        List[Tuple[str, str]]: (folder name, path) per subfolder of the job's
+            input that has an output folder, in name order
+    """
+    data = job.request
+    if not data.get('base_input') or not data.get('base_output') or not data.get('config'):
+        return []
+    cwd = cwd or os.getcwd()
+    base_input = os.path.join(cwd, data['base_input'])
+    base_output = os.path.join(cwd, data['base_output'])
+    try:
+        subfolders = sorted(entry.name for entry in os.scandir(base_input) if entry.is_dir())
+    except OSError:
+        return []
+    folders = [(f"{name}_{data['config']}", os.path.join(base_output, f"{name}_{data['config']}"))
+               for name in subfolders]
+    return [(name, folder) for name, folder in folders if os.path.isdir(folder)]
+
+class SubprocessRunner:
+    """Runs a job's K1 command line as a child process."""
+
+    def __init__(self, cwd: Optional[str] = None, stop_timeout: float = 1.0,
+                 output_cache: Optional[str] = None, output_cache_size: float = 20.0,
+                 memory_budget: Optional[float] = None, image_timeout: Optional[float] = None,
+                 max_pixels: Optional[float] = None):
+        """
+        Initialize the runner.
+
+        Args:
+            cwd: Working directory of the job processes
+            stop_timeout: Seconds a cancelled process gets to finish its images
+                in progress before it is killed
+            output_cache: Output cache folder passed to the jobs (--output-cache)
+            output_cache_size: Output cache size limit in GB
+            memory_budget: Memory in GB for the decoded images of each job
+                process (--memory-budget; None: no limit)
+            image_timeout: Seconds per image before the image is quarantined
+                (--image-timeout; None: no limit)
+            max_pixels: Largest image in megapixels (--max-pixels; None: Pillow's limit)
+        """
+        self.cwd = cwd or os.getcwd()
+        self.stop_timeout = stop_timeout
+        self.output_cache = output_cache
+        self.output_cache_size = output_cache_size
+        self.memory_budget = memory_budget
+        self.image_timeout = image_timeout
+        self.max_pixels = max_pixels
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    def requested_workers(self, job: Job) -> int:
+        """Worker processes the job asks for (its `parallel` setting)."""
+        try:
+            return max(1, int(job.request.get('parallel') or 1))
+        except (TypeError, ValueError):
+            return 1
+
+    def run(self, job: Job) -> int:
+        """Run the command, collecting its output line by line; returns the exit code."""
+        command = job.command
+        if job.worker_slots and job.worker_slots != self.requested_workers(job):
+            command = with_parallel(command, job.worker_slots)
+            job.add_line(f"Running with {job.worker_slots} of {self.requested_workers(job)} "
+                         f"requested workers (server worker budget)")
+        if self.output_cache and '--output-cache' not in command:
+            command = command + ['--output-cache', self.output_cache,
+                                 '--output-cache-size', str(self.output_cache_size)]
+        if self.memory_budget and '--memory-budget' not in command:
+            command = command + ['--memory-budget', str(self.memory_budget)]
+        if self.image_timeout and '--image-timeout' not in command:
+            command = command + ['--image-timeout', str(self.image_timeout)]
+        if self.max_pixels and '--max-pixels' not in command:
+            command = command + ['--max-pixels', str(self.max_pixels)]
+        # stderr is merged into stdout so neither pipe can fill up and stall the process.
+        # The job's worker processes share its new process group, so they can be killed with it.
+        if os.name == 'nt':
+            group = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+        else:
+            group = {'start_new_session': True}
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+            cwd=self.cwd,
+            **group
+        )
+        with self._lock:
+            self._processes.add(process)
+        # Processes of the job's tree seen at the cancel; only their partial files are removed
+        pids = {process.pid}
+        try:
+            job.on_cancel(lambda: self._stop(process, pids))
+            # Output is consumed line by line; only the bounded log tail and events are kept
+            for line in process.stdout:
+                job.add_line(line.rstrip())
+            return_code = process.wait()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if job.cancelled.is_set():
+            from watermark_script import remove_partial_outputs
+
+            # Worker processes left behind by the job would keep writing
+            self._kill_tree(process, pids)
+            with self._lock:
+                job_pids = set(pids)
+            # Other jobs writing to the same folders keep their partial files
+            removed = sum(remove_partial_outputs(folder, job_pids) for folder in self.output_folders(job))
+            if removed:
+                job.add_line(f"Removed {removed} partially written outputs")
+        return return_code
+
+    def output_folders(self, job: Job) -> List[str]:
+        """Existing output folders of a job: <base_output>/<subfolder>_<config>."""
+        return [folder for _, folder in job_output_folders(job, self.cwd)]
+
+    def _stop(self, process: subprocess.Popen, pids: Optional[Set[int]] = None) -> None:
+        """Ask the process to stop at an image boundary; kill its process tree after stop_timeout."""
+        if process.poll() is not None:
+            return
+        if os.name == 'nt':
+            # terminate() would end the K1 process at once and leave its workers running
+            self._kill_tree(process, pids)
+            return
+        self._record_tree(process, pids)
+        process.terminate()
+
+        def kill() -> None:
+            # Workers may outlive a job process that did stop (and keep its output pipe open)
+            if process.poll() is None or len(process_tree(process.pid)) > 1:
+                logger.warning(f"Killing job process {process.pid} and its workers")
+                self._kill_tree(process, pids)
+
+        timer = threading.Timer(self.stop_timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+    def _record_tree(self, process: subprocess.Popen, pids: Optional[Set[int]]) -> None:
+        """Add the IDs of a job process and its worker processes to pids."""
+        if pids is None:
+            return
+        tree = process_tree(process.pid)
+        with self._lock:
+            pids.update(tree)
+
+    def _kill_tree(self, process: subprocess.Popen, pids: Optional[Set[int]] = None) -> None:
+        """Kill a job process together with its worker processes (recording their IDs in pids)."""
+        self._record_tree(process, pids)
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/T', '/F', '/PID', str(process.pid)], capture_output=True)
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            # The process group is gone
+            pass
+
+    def shutdown(self) -> None:
+        """
+        Stop the running job processes.
+
+        They run in their own process groups, so a Ctrl+C in the server's
+        terminal does not reach them.
+        """
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            self._stop(process)
+
+class WarmPoolRunner:
+    """
+    Runs jobs on a pre-started pool of watermark worker processes.
+
+    The pool is started once with processors for WARM_CONFIGS: fonts are
+    resolved (Google Fonts downloaded) and the PNG watermark decoded in the
+    server process and shared with the workers, whose overlay caches stay warm
+    between jobs. Jobs the pool cannot run (custom settings, other
+    configurations) and all jobs before the pool is ready go to the fallback
+    runner.
+
+    Jobs on the pool run at the same time; a FairShareScheduler hands out the
+    workers image by image across users, weighted by priority, taking them from
+    the worker budget as images are dispatched.
+    """
+
+    def __init__(self, workers: Optional[int] = None, config_names=WARM_CONFIGS,
+                 fallback=None, budget: Optional[WorkerBudget] = None,
+                 output_cache: Optional[str] = None, output_cache_size: float = 20.0,
+                 memory_budget: Optional[float] = None, image_timeout: Optional[float] = None,
+                 max_pixels: Optional[float] = None):
+        """
+        Initialize the runner.
+
+        Args:
+            workers: Worker processes (default: CPU count)
+            config_names: Configurations to load into the workers
+            fallback: Runner for jobs the pool cannot run (default: SubprocessRunner
+                with the same output cache)
+            budget: Worker budget shared with the JobManager (pool workers are
+                taken from it per image)
+            output_cache: Folder of the output cache shared by all jobs (None: no cache)
+            output_cache_size: Output cache size limit in GB
+            memory_budget: Memory in GB for the images decoded by the pool's
+                workers together, shared by all jobs on the pool (None: no limit)
+            image_timeout: Seconds per image before its worker is replaced and
+                the image quarantined (None: no limit)
+            max_pixels: Largest image in megapixels; larger images are
+                quarantined undecoded (None: Pillow's limit)
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.config_names = list(config_names)
+        self.fallback = fallback or SubprocessRunner(output_cache=output_cache,
+                                                     output_cache_size=output_cache_size,
+                                                     memory_budget=memory_budget,
+                                                     image_timeout=image_timeout,
+                                                     max_pixels=max_pixels)
+        self.budget = budget
+        self.output_cache = output_cache
+        self.output_cache_size = output_cache_size
+        self.memory_budget = memory_budget
+        self.image_timeout = image_timeout
+        self.max_pixels = max_pixels
+        self.k1 = None
+        self.pool = None
+        self.scheduler = None
+        self.loaded_configs = set()
+        self._ready = threading.Event()
+
+    def start(self) -> None:
+        """Start the worker processes in the background."""
+        threading.Thread(target=self._start, name='k1-warm-pool', daemon=True).start()
+
+    def _start(self) -> None:
+        started = time.time()
+        try:
+            # Imported lazily: the server's logging setup must come first
+            from k1_multi_folder import K1MultiFolderProcessor
+            from watermark_pool import FairShareScheduler, WatermarkProcessPool
+
+            self.k1 = K1MultiFolderProcessor()
+            if self.output_cache:
+                from watermark_cache import OutputCache
+
+                self.k1.output_cache = OutputCache(self.output_cache, int(self.output_cache_size * 1024 ** 3))
+            memory_budget = None
+            if self.memory_budget:
+                from watermark_script import MemoryBudget
+
+                memory_budget = MemoryBudget(int(self.memory_budget * 1024 ** 3))
+            processors = self.k1.build_processors(self.config_names)
+            self.pool = WatermarkProcessPool(processors, self.workers, output_cache=self.k1.output_cache,
+                                             memory_budget=memory_budget, image_timeout=self.image_timeout,
+                                             max_pixels=int(self.max_pixels * 1e6) if self.max_pixels else None)
+            self.pool.warm_up()
+            self.scheduler = FairShareScheduler(self.pool, self.budget)
+            self.loaded_configs = set(processors)
+            self._ready.set()
+            logger.info(f"Warm worker pool ready: {self.workers} processes, configurations "
+                        f"{list(processors)} ({time.time() - started:.2f} seconds)")
+        except Exception as e:
+            logger.error(f"Warm worker pool unavailable, jobs run as subprocesses: {e}")
+
+    def can_run(self, job: Job) -> bool:
+        """Check whether the pool can run a job."""
+        data = job.request
+        custom_settings = {key: value for key, value in (data.get('custom_settings') or {}).items()
+                           if value is not None and value != ''}
+        return (self._ready.is_set() and not custom_settings
+                and data.get('config') in self.loaded_configs)
+
+    def requested_workers(self, job: Job) -> int:
+        """Worker processes the job asks for (0 on the pool: the scheduler takes them per image)."""
+        if not self.can_run(job):
+            return self.fallback.requested_workers(job)
+        return 0
+
+    def run(self, job: Job) -> int:
+        """Run a job on the pool (or the fallback runner); returns the exit code."""
+        if not self.can_run(job):
+            return self.fallback.run(job)
+
+        from k1_multi_folder import ProgressEvents, results_succeeded
+
+        data = job.request
+        priority = data.get('priority', 'normal')
+        # Jobs of the same user share one fair share
+        key = data.get('user') or job.id
+        handler = JobLogHandler(job)
+        k1_logger = logging.getLogger('k1_multi_folder')
+        k1_logger.addHandler(handler)
+        client = self.scheduler.client(key, PRIORITY_WEIGHTS.get(priority, 1.0),
+                                       context=lambda: job_log_context(job.id))
+        try:
+            with job_log_context(job.id):
+                k1_logger.info(f"Running on the warm worker pool ({self.workers} processes shared "
+                               f"with other jobs, {priority} priority)")
+                results = self.k1.process_work_queue(
+                    data['base_input'], data['base_output'], [data['config']],
+                    dry_run=bool(data.get('dry_run')), parallel=self.workers,
+                    resume=bool(data.get('resume')), progress=ProgressEvents(stream=JobOutput(job)),
+                    worker_pool=client, cancel=job.cancelled
+                )
+        finally:
+            client.close()
+            k1_logger.removeHandler(handler)
+        # Same exit status as k1_multi_folder.py: any failed (or no) output fails the job
+        return 0 if results_succeeded(results) else 1
+
+    def shutdown(self) -> None:
+        """Stop the worker processes and release the shared watermark assets."""
+        self.fallback.shutdown()
+        if self.pool is not None:
+            self._ready.clear()
+            self.scheduler.shutdown()
+            self.pool.shutdown()
+            self.pool = None
+
+class JobManager:
+    """Queues jobs and runs them on a bounded number of runner threads."""
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 20,
+                 keep_finished: int = 100, runner=None, budget: Optional[WorkerBudget] = None,
+                 store=None):
+        """
+        Initialize the job manager.
+
+        Args:
+            max_workers: Jobs running at the same time (their worker processes
+                are limited by the budget)
+            max_pending: Jobs waiting to run before new jobs are refused
+            keep_finished: Finished jobs kept for status queries
+            runner: Executes the jobs (default: SubprocessRunner)
+            budget: Worker processes shared by all jobs (default: CPU count)
+            store: JobStore keeping the jobs across restarts (default: memory only)
+        """
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.runner = runner or SubprocessRunner()
+        self.budget = budget or WorkerBudget()
+        self.store = store
+        self._jobs = collections.OrderedDict()
+        self._deadline_timers = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix='k1-job'
+        )
+        k1_metrics.JOBS.set_function(self._count_jobs)
+        k1_metrics.WORKER_SLOTS.set_function(self._count_worker_slots)
+        k1_metrics.WORKER_BUDGET.set(self.budget.total)
+        if store is not None:
+            self._restore()
+
+    def submit(self, command: List[str], request: Optional[Dict] = None) -> Job:
+        """
+        Queue a command as a new job.
+
+        Args:
+            command: K1 command line
+            request: The execute request the command was built from
+
+        Raises:
+            JobQueueFull: If max_pending jobs are already waiting
+        """
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if pending >= self.max_pending:
+                k1_metrics.JOBS_REJECTED.inc()
+                raise JobQueueFull(f"{pending} jobs are already waiting")
+            job = Job(uuid.uuid4().hex[:12], command, request)
+            self._jobs[job.id] = job
+            self._prune()
+        deadline = float((request or {}).get('deadline') or 0)
+        if deadline > 0:
+            job.deadline = job.created_at + deadline
+        self._enqueue(job)
+        k1_metrics.JOBS_SUBMITTED.inc()
+        logger.info(f"Queued job {job.id}: {' '.join(command)}")
+        return job
+
+    def _enqueue(self, job: Job) -> None:
+        """Save a queued job, start its deadline timer and hand it to a runner thread."""
+        if self.store is not None:
+            job.store = self.store
+            self.store.save(job)
+        if job.deadline:
+            reason = f"Deadline of {job.deadline - job.created_at:g} seconds exceeded"
+            timer = threading.Timer(max(0.0, job.deadline - time.time()), self.cancel, (job.id, reason))
+            timer.daemon = True
+            timer.start()
+            job.on_cancel(timer.cancel)
+            self._deadline_timers[job.id] = timer
+        self._executor.submit(self._run, job)
+
+    def _restore(self) -> None:
+        """Load the stored jobs: queue unfinished ones again, keep finished ones queryable."""
+        resumed = 0
+        restored = [Job.from_record(record) for record in self.store.load_jobs(self.keep_finished)]
+        with self._lock:
+            for job in restored:
+                self._jobs[job.id] = job
+        for job in restored:
+            if job.finished:
+                continue
+            if job.status == RUNNING:
+                # Interrupted by the restart: skip the images it already completed
+                job.request = dict(job.request, resume=True)
+                if '--resume' not in job.command:
+                    job.command = job.command + ['--resume']
+                job.status = QUEUED
+                job.started_at = None
+                job.add_line('Server restarted: resuming the job')
+                resumed += 1
+            job.worker_slots = 0
+            self._enqueue(job)
+        if restored:
+            logger.info(f"Restored {len(restored)} jobs from {self.store.path} "
+                        f"({sum(1 for job in restored if not job.finished)} queued again, {resumed} resumed)")
+
+    def cancel(self, job_id: str, reason: str = 'Cancelled') -> Optional[Job]:
+        """
+        Cancel a queued or running job.
+
+        Returns:
+            Optional[Job]: The job, or None if unknown
+        """
+        job = self.get(job_id)
+        if job is not None and job.cancel(reason):
+            logger.info(f"Cancelling job {job.id}: {reason}")
+            # A queued job may be waiting for the worker budget
+            self.budget.wake()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Return a job by ID, or None if unknown (older finished jobs come from the store)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            record = self.store.load_job(job_id)
+            if record is not None:
+                job = Job.from_record(record)
+        return job
+
+    def list(self) -> List[Job]:
+        """Return all known jobs, oldest first."""
+        with self._lock:
+            return list(self._jobs.values())
+
+    def _count_jobs(self) -> Dict[tuple, int]:
+        """Queued and running jobs for the k1_jobs gauge."""
+        jobs = self.list()
+        return {(state,): sum(1 for job in jobs if job.status == state) for state in (QUEUED, RUNNING)}
+
+    def _count_worker_slots(self) -> Dict[tuple, int]:
+        """Workers taken from the budget for the k1_worker_slots gauge."""
+        return {(): self.budget.in_use}
+
+    def _prune(self) -> None:
+        """Forget the oldest finished jobs beyond keep_finished."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job) -> None:
+        """Run a job with the runner once the budget grants it workers."""
+        requested = self.runner.requested_workers(job)
+        # The job stays queued while other jobs use the whole budget; jobs
+        # requesting none (warm pool) get their workers per image
+        if requested:
+            job.worker_slots = self.budget.acquire(requested, job.cancelled)
+        if job.cancelled.is_set():
+            self.budget.release(job.worker_slots)
+            job.set_status(CANCELLED, error=job.error)
+            self._finished(job)
+            logger.info(f"Job {job.id} cancelled before it started")
+            return
+        job.set_status(RUNNING)
+        if requested:
+            logger.info(f"Starting job {job.id} with {job.worker_slots} of {requested} requested workers "
+                        f"({self.budget.in_use}/{self.budget.total} in use)")
+        else:
+            logger.info(f"Starting job {job.id} on the shared worker pool")
+        try:
+            return_code = self.runner.run(job)
+            if job.cancelled.is_set():
+                job.set_status(CANCELLED, return_code, job.error)
+            else:
+                job.set_status(SUCCEEDED if return_code == 0 else FAILED, return_code)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            job.set_status(FAILED, error=str(e))
+        finally:
+            self.budget.release(job.worker_slots)
+            self._finished(job)
+        k1_metrics.JOB_DURATION.observe(job.finished_at - job.started_at)
+        logger.info(f"Job {job.id} {job.status} in {job.finished_at - job.started_at:.2f} seconds")
+
+    def _finished(self, job: Job) -> None:
+        """Bookkeeping once a job has reached a final state."""
+        timer = self._deadline_timers.pop(job.id, None)
+        if timer is not None:
+            timer.cancel()
+        k1_metrics.JOBS_FINISHED.inc(status=job.status)
+        with self._lock:
+            self._prune()
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Stop accepting jobs and optionally wait for running ones.
+
+        Without waiting, jobs that have not started are not started any more
+        (with a store they stay queued and run after a restart).
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+def with_parallel(command: List[str], workers: int) -> List[str]:
+    """Copy of a K1 command line with --parallel set to workers."""
+    command = list(command)
+    if '--parallel' in command:
+        command[command.index('--parallel') + 1] = str(workers)
+    else:
+        command.extend(['--parallel', str(workers)])
+    return command
+
+def build_k1_command(data: Dict) -> List[str]:
+    """
+    Build the k1_multi_folder.py command line for an execute request.
+
+    Raises:
+        ValueError: If a required field is missing
+    """
+    if not data.get('base_input') or not data.get('base_output') or not data.get('config'):
+        raise ValueError('Missing required fields: base_input, base_output, config')
+
+    cmd = ['py', 'k1_multi_folder.py']
+    cmd.extend(['--base-input', data['base_input']])
+    cmd.extend(['--base-output', data['base_output']])
+    cmd.extend(['--config', data['config']])
+    # Image-level scheduling with structured progress for the event stream
+    cmd.extend(['--scheduler', 'global', '--progress-events'])
+
+    # Add optional parameters
+    if data.get('parallel'):
+        cmd.extend(['--parallel', str(data['parallel'])])
+
+    if data.get('dry_run'):
+        cmd.append('--dry-run')
+
+    if data.get('resume'):
+        cmd.append('--resume')
+
+    if data.get('verbose'):
+        cmd.append('--verbose')
+
+    # Add custom settings if provided
+    custom_settings = data.get('custom_settings') or {}
+    for key, value in custom_settings.items():
+        if value is not None and value != '':
+            # Convert snake_case to kebab-case
+            arg_name = key.replace('_', '-')
+            cmd.extend([f'--{arg_name}', str(value)])
+
+    return cmd
+
+def format_sse(seq: int, event: dict) -> str:
+    """Format a progress event as a Server-Sent Events message."""
+    return f"id: {seq}\nevent: {event.get('event', 'message')}\ndata: {json.dumps(event)}\n\n"
+
+def create_jobs_blueprint(manager: JobManager, max_event_streams: int = 4) -> Blueprint:
+    """
+    Create the /api/execute and /api/jobs endpoints for a job manager.
+
+    Args:
+        manager: Job manager running the jobs
+        max_event_streams: Concurrent event streams; each holds a server thread,
+            further clients get 503 and fall back to polling /api/jobs/<id>
+    """
+    jobs_api = Blueprint('jobs', __name__)
+    event_streams = threading.BoundedSemaphore(max_event_streams)
+
+    @jobs_api.route('/api/execute', methods=['POST'])
+    def execute_command():
+        """Queue a watermark processing job and return its ID."""
+        data = request.json or {}
+        if data.get('priority', 'normal') not in PRIORITY_WEIGHTS:
+            return jsonify({'error': f"priority must be one of {', '.join(PRIORITY_WEIGHTS)}"}), 400
+        try:
+            if float(data.get('deadline') or 0) < 0:
+                raise ValueError
+        except (TypeError, ValueError):
+            return jsonify({'error': 'deadline must be a positive number of seconds'}), 400
+        try:
+            cmd = build_k1_command(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        try:
+            job = manager.submit(cmd, data)
+        except JobQueueFull as e:
+            return jsonify({'error': f'Server busy: {e}'}), 503
+
+        return jsonify(job.to_dict(tail=0)), 202
+
+    @jobs_api.route('/api/jobs', methods=['GET'])
+    def list_jobs():
+        """List known jobs without their logs."""
+        return jsonify([job.to_dict(tail=0) for job in manager.list()])
+
+    @jobs_api.route('/api/jobs/throughput', methods=['GET'])
+    def job_throughput():
+        """Per-configuration throughput of the jobs of the last ?days=N days (default 7)."""
+        if manager.store is None:
+            return jsonify({'error': 'Job history is not enabled on this server'}), 404
+        days = request.args.get('days', 7, type=float)
+        return jsonify({'days': days, 'configs': manager.store.throughput(time.time() - days * 86400)})
+
+    @jobs_api.route('/api/jobs/<job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Job status, progress counters and log tail (?tail=N lines, default 50)."""
+        job = manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        tail = request.args.get('tail', 50, type=int)
+        return jsonify(job.to_dict(tail=max(0, tail)))
+
+    @jobs_api.route('/api/jobs/<job_id>/images', methods=['GET'])
+    def job_images(job_id):
+        """Outcome of every image of a job (?failed=1: failed images only)."""
+        if manager.store is None:
+            return jsonify({'error': 'Job history is not enabled on this server'}), 404
+        if manager.get(job_id) is None:
+            return jsonify({'error': 'Job not found'}), 404
+        failed_only = request.args.get('failed', '') in ('1', 'true')
+        return jsonify(manager.store.image_results(job_id, failed_only))
+
+    @jobs_api.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+    def cancel_job(job_id):
+        """Stop a queued or running job."""
+        job = manager.cancel(job_id, 'Cancelled by user')
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if job.finished and job.status != CANCELLED:
+            return jsonify({'error': f'Job already {job.status}'}), 409
+        return jsonify(job.to_dict(tail=0)), 202
+
+    @jobs_api.route('/api/jobs/<job_id>/events', methods=['GET'])
+    def job_events(job_id):
+        """Stream progress events of a job as Server-Sent Events until it finishes."""
+        job = manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        if not event_streams.acquire(blocking=False):
+            return jsonify({'error': 'Too many event streams, poll /api/jobs/<id> instead'}), 503
+
+        # Reconnecting EventSource clients continue after the last event they saw
+        last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', 0))
+        try:
+            after = int(last_event_id)
+        except ValueError:
+            after = 0
+
+        def generate(after):
+            yield 'retry: 2000\n\n'
+            while True:
+                events = job.wait_events(after, EVENT_STREAM_KEEPALIVE)
+                for seq, event in events:
+                    yield format_sse(seq, event)
+                    after = seq
+                if not events:
+                    if job.finished:
+                        return
+                    # Comment line keeps proxies from closing an idle stream
+                    yield ': keep-alive\n\n'
+
+        response = Response(stream_with_context(generate(after)), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # Released when the server closes the response, also if the client disconnects early
+        response.call_on_close(event_streams.release)
+        return response
+
+    return jobs_api
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""
+K1 Web Server Load Test
+
+Drives a mix of /api/browse, /api/validate, /api/preview and /api/execute
+calls at a target rate against a local server_production.py instance and
+reports, per endpoint, latency percentiles and error rates, plus the CPU and
+memory (RSS) of the server process and its worker processes.
+
+- A corpus of generated JPEGs (--folders x --images) is created once and reused
+- By default a fresh server is started on a free port with its own job
+  database and output cache (K1_DATA_DIR), --threads waitress threads and
+  --workers worker processes; --url tests an already running server instead
+- Requests are sent open-loop: they are scheduled at the target rate whether
+  or not earlier requests have finished, and latency is measured from the
+  scheduled time, so a saturated server shows up as growing latency instead
+  of a lower request rate
+- --json writes the results for comparison with later runs
+
+Server CPU and RSS are read with psutil if it is installed, else from /proc
+(Linux); elsewhere they are not reported.
+
+USAGE:
+  # 60 seconds at 20 requests/s with the default mix
+  py k1_loadtest.py --rate 20 --duration 60
+
+  # Compare waitress thread counts on the same corpus
+  py k1_loadtest.py --rate 40 --threads 4 --json baseline_t4.json
+  py k1_loadtest.py --rate 40 --threads 16 --json baseline_t16.json
+
+  # Browse-heavy mix against a running server
+  py k1_loadtest.py --url http://localhost:5000 --mix browse=80,validate=20
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import math
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import requests
+from PIL import Image
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Share of each call in the request mix (--mix)
+DEFAULT_MIX = {'browse': 40, 'validate': 30, 'preview': 25, 'execute': 5}
+
+# Configurations used for previews and jobs (loaded in the warm pool)
+LOADTEST_CONFIGS = ('final_v2', 'final_v3', 'glow_effect', 'dramatic_shadow')
+
+PERCENTILES = (50, 90, 99)
+
+# Seconds between server CPU/RSS samples
+SAMPLE_INTERVAL = 0.5
+
+def generate_corpus(path: str, folders: int, images: int, size: tuple) -> List[str]:
+    """
+    Create folders x images numbered JPEGs below path (kept if already there).
+
+    Returns:
+        List[str]: Paths of all corpus images
+    """
+    paths = []
+    for folder_index in range(folders):
+        folder = os.path.join(path, f"set_{folder_index + 1:02d}")
+        os.makedirs(folder, exist_ok=True)
+        for image_index in range(images):
+            image_path = os.path.join(folder, f"IMG_{image_index + 1:04d}.jpg")
+            paths.append(image_path)
+            if os.path.exists(image_path):
+                continue
+            # Noise over a gradient: realistic JPEG sizes, unlike flat colors
+            noise = Image.effect_noise(size, 40 + image_index % 40)
+            gradient = Image.linear_gradient('L').resize(size)
+            Image.merge('RGB', (noise, gradient, Image.blend(noise, gradient, 0.5))).save(
+                image_path, quality=90)
+    logger.info(f"Corpus: {len(paths)} images in {folders} folders at {path}")
+    return paths
+
+def free_port() -> int:
+    """A currently unused local TCP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(sorted_values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of sorted values."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+class ProcessSampler:
+    """Samples CPU and RSS of a process and its children in the background."""
+
+    def __init__(self, pid: int, interval: float = SAMPLE_INTERVAL):
+        self.pid = pid
+        self.interval = interval
+        # (time, cpu seconds, rss bytes) of the process tree
+        self.samples = []
+        self.available = True
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='loadtest-sampler', daemon=True)
+        try:
+            import psutil
+            self._psutil = psutil
+        except ImportError:
+            self._psutil = None
+            self.available = os.path.isdir(f'/proc/{pid}')
+        self._ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self._page_size = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+    def start(self) -> None:
+        if self.available:
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                cpu, rss = self._sample_psutil() if self._psutil else self._sample_proc()
+                self.samples.append((time.time(), cpu, rss))
+            except Exception as e:
+                logger.debug(f"Cannot sample server process: {e}")
+            self._stop.wait(self.interval)
+
+    def _sample_psutil(self) -> tuple:
+        process = self._psutil.Process(self.pid)
+        cpu = rss = 0
+        for proc in [process] + process.children(recursive=True):
+            try:
+                times = proc.cpu_times()
+                cpu += times.user + times.system
+                rss += proc.memory_info().rss
+            except self._psutil.Error:
+                pass
+        return cpu, rss
+
+    def _sample_proc(self) -> tuple:
+        # Process tree from the parent PIDs in /proc/<pid>/stat
+        stats = {}
+        for name in os.listdir('/proc'):
+            if name.isdigit():
+                try:
+                    with open(f'/proc/{name}/stat') as f:
+                        fields = f.read().rsplit(')', 1)[1].split()
+                except OSError:
+                    continue
+                # fields[1] = ppid, [11]/[12] = utime/stime, [21] = rss pages
+                stats[int(name)] = (int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]))
+        tree = {self.pid}
+        changed = True
+        while changed:
+            children = {pid for pid, (ppid, _, _) in stats.items() if ppid in tree} - tree
+            tree |= children
+            changed = bool(children)
+        cpu = sum(stats[pid][1] for pid in tree if pid in stats) / self._ticks
+        rss = sum(stats[pid][2] for pid in tree if pid in stats) * self._page_size
+        return cpu, rss
+
+    def summary(self) -> Optional[Dict[str, float]]:
+        """Average and peak CPU (% of one core) and RSS (MB) over the samples."""
+        if len(self.samples) < 2:
+            return None
+        # Processes that exited between samples (job subprocesses) take their CPU time along
+        usage = [
+            max(0.0, 100 * (cpu - previous_cpu) / (now - previous_time))
+            for (previous_time, previous_cpu, _), (now, cpu, _) in zip(self.samples, self.samples[1:])
+            if now > previous_time
+        ]
+        rss = [sample[2] / 1e6 for sample in self.samples]
+        return {
+            'cpu_avg_percent': round(sum(usage) / len(usage), 1) if usage else 0.0,
+            'cpu_max_percent': round(max(usage), 1) if usage else 0.0,
+            'rss_avg_mb': round(sum(rss) / len(rss), 1),
+            'rss_max_mb': round(max(rss), 1),
+        }
+
+class LoadTest:
+    """Open-loop request generator with per-endpoint latency and error statistics."""
+
+    def __init__(self, url: str, corpus: str, images: List[str], output: str,
+                 mix: Dict[str, float], timeout: float = 30.0):
+        """
+        Initialize the load test.
+
+        Args:
+            url: Base URL of the server
+            corpus: Corpus folder (base input of validations and jobs)
+            images: Corpus image paths (for previews)
+            output: Folder below which jobs write their outputs
+            mix: Relative weight per call (browse, validate, preview, execute)
+            timeout: Seconds before a request counts as failed
+        """
+        self.url = url.rstrip('/')
+        self.corpus = corpus
+        self.images = images
+        self.output = output
+        self.kinds = [kind for kind, weight in mix.items() if weight > 0]
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.timeout = timeout
+        self.folders = sorted({os.path.dirname(path) for path in images})
+        # Per call: list of (latency seconds, status code or None on a connection error)
+        self.results = {kind: [] for kind in self.kinds}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._jobs = 0
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _request(self, kind: str) -> requests.Response:
+        session = self._session()
+        if kind == 'browse':
+            folder = random.choice([self.corpus] + self.folders)
+            return session.post(f"{self.url}/api/browse", json={'folder_path': folder, 'kind': 'all'},
+                                timeout=self.timeout)
+        if kind == 'validate':
+            return session.post(f"{self.url}/api/validate",
+                                json={'base_input': self.corpus, 'base_output': self.output},
+                                timeout=self.timeout)
+        if kind == 'preview':
+            return session.post(f"{self.url}/api/preview",
+                                json={'config': random.choice(LOADTEST_CONFIGS),
+                                      'image_path': random.choice(self.images)},
+                                timeout=self.timeout)
+        with self._lock:
+            self._jobs += 1
+            job_number = self._jobs
+        return session.post(f"{self.url}/api/execute",
+                            json={'base_input': self.corpus, 'config': random.choice(LOADTEST_CONFIGS),
+                                  'base_output': os.path.join(self.output, f"job_{job_number:04d}"),
+                                  'priority': 'low'},
+                            timeout=self.timeout)
+
+    def _call(self, kind: str, scheduled: float) -> None:
+        try:
+            status = self._request(kind).status_code
+        except requests.RequestException as e:
+            logger.debug(f"{kind} request failed: {e}")
+            status = None
+        # Measured from the scheduled start: time spent waiting for a client
+        # thread counts, as it would for a real user
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            self.results[kind].append((latency, status))
+
+    def run(self, rate: float, duration: float, clients: int) -> float:
+        """
+        Send requests at `rate` per second for `duration` seconds.
+
+        Returns:
+            float: Seconds until the last response arrived
+        """
+        started = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=clients,
+                                                   thread_name_prefix='loadtest') as executor:
+            next_time = started
+            while next_time < started + duration:
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                kind = random.choices(self.kinds, self.weights)[0]
+                executor.submit(self._call, kind, next_time)
+                # Poisson arrivals, like independent users
+                next_time += random.expovariate(rate)
+        return time.perf_counter() - started
+
+    def report(self, elapsed: float) -> Dict[str, dict]:
+        """Per call: requests, rate, errors, error rate and latency percentiles (ms)."""
+        report = {}
+        for kind, results in self.results.items():
+            latencies = sorted(latency for latency, _ in results)
+            errors = sum(1 for _, status in results if status is None or status >= 400)
+            statuses = {}
+            for _, status in results:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            entry = {
+                'requests': len(results),
+                'rate': round(len(results) / elapsed, 2) if elapsed else 0.0,
+                'errors': errors,
+                'error_rate': round(errors / len(results), 4) if results else 0.0,
+                'statuses': statuses,
+            }
+            for pct in PERCENTILES:
+                value = percentile(latencies, pct)
+                entry[f'p{pct}_ms'] = round(value * 1000, 1) if value is not None else None
+            entry['max_ms'] = round(latencies[-1] * 1000, 1) if latencies else None
+            report[kind] = entry
+        return report
+
+def start_server(port: int, data_dir: str, threads: int, workers: Optional[int],
+                 log_path: str, timeout: float = 120.0) -> subprocess.Popen:
+    """Start server_production.py and wait until it answers (warm pool included)."""
+    env = dict(os.environ, K1_PORT=str(port), K1_THREADS=str(threads), K1_DATA_DIR=data_dir)
+    if workers:
+        env['K1_WORKERS'] = str(workers)
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, 'server_production.py'], cwd=script_dir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}, see {log_path}")
+        try:
+            with open(log_path) as log:
+                if 'Warm worker pool ready' in log.read():
+                    return process
+        except OSError:
+            pass
+        time.sleep(0.25)
+    stop_server(process)
+    raise RuntimeError(f"Server not ready after {timeout:.0f} seconds, see {log_path}")
+
+def stop_server(process: subprocess.Popen) -> None:
+    """Stop the server like Ctrl+C (running exit handlers), killing it if it does not exit."""
+    if process.poll() is not None:
+        return
+    if os.name == 'nt':
+        process.terminate()
+    else:
+        process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Parse "browse=40,validate=30,..." into weights per call."""
+    mix = {kind: 0.0 for kind in DEFAULT_MIX}
+    for part in value.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in mix:
+            raise argparse.ArgumentTypeError(f"unknown call {kind!r} (use {', '.join(DEFAULT_MIX)})")
+        try:
+            mix[kind] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for {kind}: {weight!r}")
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("the mix needs at least one call with a positive weight")
+    return mix
+
+def parse_size(value: str) -> tuple:
+    """Parse "WIDTHxHEIGHT"."""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+        return width, height
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {value!r} (use e.g. 3000x2000)")
+
+def print_report(report: Dict[str, dict], server: Optional[Dict[str, float]], elapsed: float) -> None:
+    """Log the results as a table."""
+    logger.info("\n" + "=" * 78)
+    logger.info("LOAD TEST RESULTS")
+    logger.info("=" * 78)
+    logger.info(f"{'call':<10}{'requests':>9}{'req/s':>8}{'errors':>8}{'err %':>7}"
+                f"{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for kind, entry in report.items():
+        values = [entry[key] if entry[key] is not None else float('nan')
+                  for key in ('p50_ms', 'p90_ms', 'p99_ms', 'max_ms')]
+        logger.info(f"{kind:<10}{entry['requests']:>9}{entry['rate']:>8.2f}{entry['errors']:>8}"
+                    f"{entry['error_rate'] * 100:>7.1f}" + ''.join(f"{value:>9.1f}" for value in values))
+    logger.info(f"\nDuration: {elapsed:.1f} seconds")
+    if server:
+        logger.info(f"Server CPU: {server['cpu_avg_percent']:.0f}% average, {server['cpu_max_percent']:.0f}% peak "
+                    f"(100% = one core, worker processes included)")
+        logger.info(f"Server RSS: {server['rss_avg_mb']:.0f} MB average, {server['rss_max_mb']:.0f} MB peak")
+    else:
+        logger.info("Server CPU/RSS: not available (install psutil or run on Linux)")
+
+def main():
+    """Main function for the K1 web server load test."""
+    parser = argparse.ArgumentParser(
+        description="Load test for the K1 web server (server_production.py)",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  # Baseline: 60 seconds at 20 requests/s, fresh server with 8 threads
+  py k1_loadtest.py --rate 20 --duration 60 --json baseline.json
+
+  # Only browsing and validation against a running server
+  py k1_loadtest.py --url http://localhost:5000 --mix browse=70,validate=30
+        """
+    )
+    parser.add_argument('--url', help='Test a running server instead of starting one '
+                                      '(CPU/RSS need --server-pid)')
+    parser.add_argument('--server-pid', type=int, help='PID of the server given with --url')
+    parser.add_argument('--corpus', default='k1_loadtest_corpus',
+                        help='Folder of the generated test images (default: k1_loadtest_corpus)')
+    parser.add_argument('--folders', type=int, default=4, help='Corpus subfolders (default: 4)')
+    parser.add_argument('--images', type=int, default=25, help='Images per subfolder (default: 25)')
+    parser.add_argument('--image-size', type=parse_size, default=(3000, 2000),
+                        help='Size of the generated images (default: 3000x2000)')
+    parser.add_argument('--rate', type=float, default=10.0, help='Requests per second (default: 10)')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds of load (default: 30)')
+    parser.add_argument('--mix', type=parse_mix, default=dict(DEFAULT_MIX),
+                        help='Relative weights of the calls (default: browse=40,validate=30,preview=25,execute=5)')
+    parser.add_argument('--clients', type=int, default=64,
+                        help='Client threads, the most requests in flight (default: 64)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Seconds before a request counts as failed (default: 30)')
+    parser.add_argument('--threads', type=int, default=8, help='Waitress threads of the started server (default: 8)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker processes of the started server (default: CPU count)')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the started server\'s data folder (job outputs, logs)')
+    args = parser.parse_args()
+
+    images = generate_corpus(os.path.abspath(args.corpus), args.folders, args.images, args.image_size)
+    work_dir = tempfile.mkdtemp(prefix='k1_loadtest_')
+    process = None
+    try:
+        if args.url:
+            url, server_pid = args.url, args.server_pid
+        else:
+            port = free_port()
+            logger.info(f"Starting server_production.py on port {port} ({args.threads} threads, "
+                        f"{args.workers or os.cpu_count()} workers), data in {work_dir}")
+            process = start_server(port, work_dir, args.threads, args.workers,
+                                   os.path.join(work_dir, 'server.log'))
+            url, server_pid = f"http://127.0.0.1:{port}", process.pid
+
+        test = LoadTest(url, os.path.abspath(args.corpus), images, os.path.join(work_dir, 'outputs'),
+                        args.mix, args.timeout)
+        sampler = ProcessSampler(server_pid) if server_pid else None
+        if sampler:
+            sampler.start()
+        logger.info(f"Sending {args.rate:g} requests/s for {args.duration:g} seconds: "
+                    + ', '.join(f"{kind} {weight:g}" for kind, weight in args.mix.items() if weight))
+        elapsed = test.run(args.rate, args.duration, args.clients)
+        if sampler:
+            sampler.stop()
+
+        report = test.report(elapsed)
+        server = sampler.summary() if sampler else None
+        print_report(report, server, elapsed)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'settings': {'rate': args.rate, 'duration': args.duration, 'mix': args.mix,
+                                 'clients': args.clients, 'threads': None if args.url else args.threads,
+                                 'workers': None if args.url else (args.workers or os.cpu_count()),
+                                 'corpus': {'folders': args.folders, 'images': args.images,
+                                            'image_size': list(args.image_size)}},
+                    'elapsed': round(elapsed, 2),
+                    'calls': report,
+                    'server': server,
+                }, f, indent=2)
+            logger.info(f"Results written to {args.json}")
+    finally:
+        if process is not None:
+            stop_server(process)
+        if args.keep:
+            logger.info(f"Server data kept in {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+K1 Server Metrics
+
+Counters, gauges and histograms for the web server, exposed at /metrics in the
+Prometheus text format (version 0.0.4) without extra dependencies.
+
+The image metrics are measured by the workers themselves: every processed
+image reports its latency per configuration, bytes read and written, overlay
+cache hits and busy time. Job workers send them as 'metrics' progress events
+(see k1_multi_folder.ProgressEvents), which record_worker_metrics() adds up;
+the upload endpoint records its images directly with record_image().
+
+Used by both server.py and server_production.py through create_metrics_blueprint().
+"""
+
+import math
+import threading
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from flask import Blueprint, Response
+
+# Seconds; watermarking one image takes from milliseconds (small web images)
+# to several seconds (large prints with several configurations)
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+JOB_DURATION_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0)
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metric:
+    """Base class of a metric family with optional labels."""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """Yield (suffix, labels, value) samples."""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield '', _format_labels(self.labelnames, key), value
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{labels} {_format_value(value)}')
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    """Monotonically increasing value."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    """Value that goes up and down, set directly or read from a function at scrape time."""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """Read the values from function() at scrape time ({label values: value})."""
+        self._function = function
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        if self._function is None:
+            yield from super().samples()
+            return
+        for key, value in sorted(self._function().items()):
+            yield '', _format_labels(self.labelnames, key), value
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            values = {key: (list(counts), total, count) for key, (counts, total, count) in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield '_bucket', _format_labels(self.labelnames, key, le), cumulative
+            yield '_sum', _format_labels(self.labelnames, key), total
+            yield '_count', _format_labels(self.labelnames, key), count
+
+class MetricsRegistry:
+    """Collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric already registered: {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+JOBS_SUBMITTED = REGISTRY.counter('k1_jobs_submitted_total', 'Jobs accepted by /api/execute')
+JOBS_REJECTED = REGISTRY.counter('k1_jobs_rejected_total', 'Jobs refused because the queue was full')
+JOBS = REGISTRY.gauge('k1_jobs', 'Jobs currently queued or running', ['state'])
+JOBS_FINISHED = REGISTRY.counter('k1_jobs_finished_total', 'Finished jobs', ['status'])
+JOB_DURATION = REGISTRY.histogram('k1_job_duration_seconds', 'Run time of finished jobs',
+                                  buckets=JOB_DURATION_BUCKETS)
+
+IMAGES_PROCESSED = REGISTRY.counter('k1_images_processed_total',
+                                    'Watermarked outputs per configuration',
+                                    ['config', 'source', 'result'])
+IMAGE_DURATION = REGISTRY.histogram('k1_image_duration_seconds',
+                                    'Per-image latency per configuration (decode, watermark, encode)',
+                                    ['config', 'source'])
+BYTES_READ = REGISTRY.counter('k1_bytes_read_total', 'Encoded input image bytes read', ['source'])
+BYTES_WRITTEN = REGISTRY.counter('k1_bytes_written_total', 'Encoded output image bytes written', ['source'])
+CACHE_HITS = REGISTRY.counter('k1_overlay_cache_hits_total',
+                              'Watermark overlays served from the processor cache', ['source'])
+CACHE_MISSES = REGISTRY.counter('k1_overlay_cache_misses_total',
+                                'Watermark overlays that had to be rendered', ['source'])
+OUTPUT_CACHE_HITS = REGISTRY.counter('k1_output_cache_hits_total',
+                                     'Outputs linked from the output cache instead of processed', ['source'])
+OUTPUT_CACHE_MISSES = REGISTRY.counter('k1_output_cache_misses_total',
+                                       'Outputs looked up in the output cache and processed', ['source'])
+WORKER_BUSY = REGISTRY.counter('k1_worker_busy_seconds_total',
+                               'Time workers spent processing images', ['source'])
+WORKER_SLOTS = REGISTRY.gauge('k1_worker_slots',
+                              'Worker processes taken from the worker budget by running jobs '
+                              '(utilization = rate(k1_worker_busy_seconds_total) / k1_worker_slots)')
+WORKER_BUDGET = REGISTRY.gauge('k1_worker_budget', 'Worker processes shared by all jobs')
+
+def record_image(config_name: str, source: str, seconds: float, success: bool,
+                 bytes_read: int = 0, bytes_written: int = 0,
+                 cache_hits: int = 0, cache_misses: int = 0) -> None:
+    """Record one processed image (e.g. from the upload endpoint)."""
+    IMAGES_PROCESSED.inc(config=config_name, source=source, result='ok' if success else 'failed')
+    IMAGE_DURATION.observe(seconds, config=config_name, source=source)
+    BYTES_READ.inc(bytes_read, source=source)
+    BYTES_WRITTEN.inc(bytes_written, source=source)
+    CACHE_HITS.inc(cache_hits, source=source)
+    CACHE_MISSES.inc(cache_misses, source=source)
+    WORKER_BUSY.inc(seconds, source=source)
+
+def record_worker_metrics(event: dict, source: str = 'job') -> None:
+    """Add up a 'metrics' event reported by job workers (counts since the previous event)."""
+    for config_name, counts in event.get('images', {}).items():
+        IMAGES_PROCESSED.inc(counts.get('ok', 0), config=config_name, source=source, result='ok')
+        IMAGES_PROCESSED.inc(counts.get('failed', 0), config=config_name, source=source, result='failed')
+    for config_name, latencies in event.get('latencies', {}).items():
+        for seconds in latencies:
+            IMAGE_DURATION.observe(seconds, config=config_name, source=source)
+    BYTES_READ.inc(event.get('bytes_read', 0), source=source)
+    BYTES_WRITTEN.inc(event.get('bytes_written', 0), source=source)
+    CACHE_HITS.inc(event.get('cache_hits', 0), source=source)
+    CACHE_MISSES.inc(event.get('cache_misses', 0), source=source)
+    OUTPUT_CACHE_HITS.inc(event.get('output_cache_hits', 0), source=source)
+    OUTPUT_CACHE_MISSES.inc(event.get('output_cache_misses', 0), source=source)
+    WORKER_BUSY.inc(event.get('busy_seconds', 0.0), source=source)
+
+def create_metrics_blueprint(registry: Optional[MetricsRegistry] = None) -> Blueprint:
+    """Create the /metrics endpoint."""
+    metrics_api = Blueprint('metrics', __name__)
+    registry = registry or REGISTRY
+
+    @metrics_api.route('/metrics', methods=['GET'])
+    def metrics():
+        """Current metrics in the Prometheus text format."""
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return metrics_api
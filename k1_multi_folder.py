@@ -16,13 +16,17 @@ CONFIGURATION EDITING:
 """
 
 import argparse
+import functools
+import hashlib
+import json
 import os
 import sys
 import logging
+import threading
 import time
 import subprocess
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, List, NamedTuple, Optional, Tuple
 import concurrent.futures
 
 # Configure logging
@@ -36,6 +40,333 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maps configuration keys to WatermarkProcessor arguments for in-process runs
+PROCESSOR_ARGUMENTS = {
+    "custom_text": ("custom_text", str),
+    "google_font": ("google_font_name", str),
+    "png_watermark": ("png_watermark_path", str),
+    "png_opacity": ("png_opacity", float),
+    "png_position": ("png_position", str),
+    "png_x_offset": ("png_x_offset", int),
+    "png_y_offset": ("png_y_offset", int),
+    "custom_text_position": ("custom_text_position", str),
+    "custom_text_size_ratio": ("custom_text_size_ratio", float),
+    "margin": ("margin", int),
+    "custom_text_shadow_offset": ("custom_text_shadow_offset", int),
+    "custom_text_shadow_blur": ("custom_text_shadow_blur", int),
+    "custom_text_shadow_color": ("custom_text_shadow_color", str),
+    "custom_text_opacity": ("custom_text_opacity", float),
+    "shadow_offset": ("shadow_offset", int),
+    "shadow_blur": ("shadow_blur", int),
+    "shadow_color": ("shadow_color", str),
+    "shadow_opacity": ("shadow_opacity", float),
+    "number_opacity": ("number_opacity", float),
+    "number_color": ("number_color", str),
+    "number_x_offset": ("number_x_offset", int),
+    "number_y_offset": ("number_y_offset", int),
+}
+
+# Prefix of the JSON progress event lines written with --progress-events
+PROGRESS_EVENT_PREFIX = "K1_EVENT "
+
+class WorkItem(NamedTuple):
+    """A single source image to watermark with one or more configurations."""
+    folder: str                    # Subfolder name (key of the per-folder results)
+    input_path: str                # Full path of the source image
+    config_names: Tuple[str, ...]  # Configurations to apply to the decoded frame
+    cost: int                      # Estimated cost (pixel count from the image header)
+    size: Optional[Tuple[int, int]] = None  # Image size from the header, if readable
+    memory: int = 0                # Estimated decoded footprint in bytes (see estimate_image_memory)
+
+def estimate_image_cost(image_path: str, size: Optional[Tuple[int, int]]) -> int:
+    """Estimate processing cost of an image from its header size (pixel count)."""
+    if size:
+        return size[0] * size[1]
+    
+    # Fall back to file size so unreadable files still get scheduled
+    try:
+        return os.path.getsize(image_path)
+    except OSError:
+        return 0
+
+def results_succeeded(results: Dict) -> bool:
+    """
+    Check the results of a run: success per folder, or per configuration and folder.
+    
+    A run succeeded if it has results and none of them failed; a run without
+    any results (no folders, no usable configuration) did not.
+    """
+    if not results:
+        return False
+    return all(results_succeeded(value) if isinstance(value, dict) else value
+               for value in results.values())
+
+def _fsync_path(path: str) -> None:
+    """Flush a file or folder to stable storage (folders cannot be synced on Windows)."""
+    try:
+        fd = os.open(path, os.O_RDONLY if os.path.isdir(path) else os.O_RDWR)
+    except OSError as e:
+        logger.debug(f"Cannot open {path} to sync it: {e}")
+        return
+    try:
+        os.fsync(fd)
+    except OSError as e:
+        logger.debug(f"Cannot sync {path}: {e}")
+    finally:
+        os.close(fd)
+
+class CompletionJournal:
+    """
+    Durable journal of completed (image, configuration) pairs.
+    
+    Every completion is appended as one JSON line with a single write() on an
+    O_APPEND descriptor, so a crash can at worst leave a torn last line, which
+    is ignored on load. fsync is batched (every sync_every records or
+    sync_interval seconds) to keep the journal off the image hot path.
+    
+    Completions are held back until the batch is synced: the output files and
+    their folders are synced first, so the journal never lists an output that
+    a power loss could still take back.
+    """
+    
+    def __init__(self, path: str, sync_every: int = 64, sync_interval: float = 2.0):
+        """
+        Initialize the journal.
+        
+        Args:
+            path: Journal file path
+            sync_every: fsync after this many records
+            sync_interval: fsync at least every this many seconds while recording
+        """
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._fd = None
+        self._lock = threading.Lock()
+        # Completions (record, output path) waiting for the next sync
+        self._pending = []
+        self._last_sync = time.time()
+    
+    def load(self, fingerprint: str) -> set:
+        """Return completed (image, config) pairs recorded for a job fingerprint."""
+        completed = set()
+        if not os.path.exists(self.path):
+            return completed
+        
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        
+        job = None
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Torn write from an interrupted run
+                continue
+            if 'job' in record:
+                job = record['job']
+            elif job == fingerprint:
+                completed.add((record['image'], record['config']))
+        
+        if job is not None and job != fingerprint:
+            logger.warning(f"Journal {self.path} belongs to a different job, ignoring it")
+            return set()
+        return completed
+    
+    def open(self, fingerprint: str, resume: bool = False) -> set:
+        """
+        Open the journal for writing.
+        
+        Args:
+            fingerprint: Identifies the job (inputs, configurations and settings)
+            resume: Keep and return earlier completions instead of starting over
+            
+        Returns:
+            set: Completed (image, config) pairs to skip
+        """
+        completed = self.load(fingerprint) if resume else set()
+        
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        flags = os.O_WRONLY | os.O_CREAT | os.O_APPEND
+        if not completed:
+            flags |= os.O_TRUNC
+        self._fd = os.open(self.path, flags, 0o644)
+        if completed and not self._ends_with_newline():
+            # Terminate a torn last line so the next record stays parseable
+            os.write(self._fd, b'\n')
+        if not completed:
+            self._append({'job': fingerprint})
+            self.sync()
+        return completed
+    
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b'\n'
+    
+    def _append(self, record: dict) -> None:
+        """Append one record with a single write call."""
+        os.write(self._fd, (json.dumps(record) + '\n').encode('utf-8'))
+    
+    def record(self, folder: str, image: str, config_name: str,
+               output_path: Optional[str] = None) -> None:
+        """Record the completion of an image with a configuration (written with the next sync)."""
+        with self._lock:
+            if self._fd is None:
+                return
+            self._pending.append(({'folder': folder, 'image': image, 'config': config_name}, output_path))
+            if (len(self._pending) >= self.sync_every or
+                    time.time() - self._last_sync >= self.sync_interval):
+                self._sync_locked()
+    
+    def _sync_locked(self) -> None:
+        pending, self._pending = self._pending, []
+        output_paths = [output_path for _, output_path in pending if output_path]
+        for path in output_paths:
+            _fsync_path(path)
+        for folder in {os.path.dirname(path) for path in output_paths}:
+            _fsync_path(folder)
+        for record, _ in pending:
+            self._append(record)
+        os.fsync(self._fd)
+        self._last_sync = time.time()
+    
+    def sync(self) -> None:
+        """Flush recorded completions to stable storage."""
+        with self._lock:
+            if self._fd is not None:
+                self._sync_locked()
+    
+    def close(self) -> None:
+        """Sync and close the journal."""
+        with self._lock:
+            if self._fd is not None:
+                self._sync_locked()
+                os.close(self._fd)
+                self._fd = None
+
+class ProgressEvents:
+    """
+    Emits machine-readable progress events as single JSON lines.
+    
+    Each event is one line "K1_EVENT {...}" on stdout, interleaved with the
+    regular log, so a supervising process (the web server) can follow a run
+    incrementally without parsing log messages. Progress events are throttled
+    to min_interval seconds; start, folder and done events are always sent.
+    """
+    
+    def __init__(self, stream=None, min_interval: float = 0.5):
+        """
+        Initialize the event emitter.
+        
+        Args:
+            stream: Text stream to write to (default: sys.stdout)
+            min_interval: Minimum seconds between two progress events
+        """
+        self.stream = stream or sys.stdout
+        self.min_interval = min_interval
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.outputs_done = 0
+        self.folder = None
+        self._started = time.time()
+        self._last_progress = 0.0
+        self._reported_done = -1
+        self._metrics = self._new_metrics()
+    
+    @staticmethod
+    def _new_metrics() -> dict:
+        return {"images": {}, "latencies": {}, "outcomes": [], "bytes_read": 0, "bytes_written": 0,
+                "cache_hits": 0, "cache_misses": 0, "output_cache_hits": 0, "output_cache_misses": 0,
+                "busy_seconds": 0.0}
+    
+    def flush_metrics(self) -> None:
+        """Send the worker measurements collected since the last metrics event."""
+        metrics = self._metrics
+        if not metrics["images"]:
+            return
+        self._metrics = self._new_metrics()
+        metrics["busy_seconds"] = round(metrics["busy_seconds"], 4)
+        self.emit("metrics", **metrics)
+    
+    def emit(self, event: str, **fields) -> None:
+        """Write one event line."""
+        record = {"event": event, "time": round(time.time(), 3)}
+        record.update(fields)
+        self.stream.write(PROGRESS_EVENT_PREFIX + json.dumps(record) + '\n')
+        self.stream.flush()
+    
+    def start(self, total: int, folders: List[str], outputs: int) -> None:
+        """Announce the work of a run."""
+        self.total = total
+        self._started = time.time()
+        self.emit("start", total=total, outputs=outputs, folders=folders)
+    
+    def progress(self, force: bool = False) -> None:
+        """Send the current counters, throughput and ETA (throttled unless forced)."""
+        now = time.time()
+        if not force and now - self._last_progress < self.min_interval:
+            return
+        self._last_progress = now
+        self._reported_done = self.done
+        
+        elapsed = now - self._started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = (self.total - self.done) / rate if rate > 0 else None
+        self.emit("progress", done=self.done, total=self.total, failed=self.failed,
+                  outputs_done=self.outputs_done, folder=self.folder, rate=round(rate, 2),
+                  eta=round(eta, 1) if eta is not None else None, elapsed=round(elapsed, 2))
+        self.flush_metrics()
+    
+    def item_done(self, folder: str, results: Dict[str, bool], stats: Optional[dict] = None,
+                  image: Optional[str] = None) -> None:
+        """
+        Count a finished work item (success per configuration).
+        
+        stats are the worker's measurements of the image (see
+        watermark_script.process_image_fanout); they are sent with the next
+        progress event as a 'metrics' event, together with the outcome per
+        configuration of the image ([image, config, success, seconds]).
+        """
+        metrics = self._metrics
+        seconds = (stats or {}).get("seconds", {})
+        for config_name, success in results.items():
+            counts = metrics["images"].setdefault(config_name, {"ok": 0, "failed": 0})
+            counts["ok" if success else "failed"] += 1
+            if image is not None:
+                duration = seconds.get(config_name)
+                metrics["outcomes"].append([image, config_name, success,
+                                            round(duration, 4) if duration is not None else None])
+        if stats:
+            for config_name, seconds in stats.get("seconds", {}).items():
+                metrics["latencies"].setdefault(config_name, []).append(round(seconds, 4))
+            for key in ("bytes_read", "bytes_written", "cache_hits", "cache_misses",
+                        "output_cache_hits", "output_cache_misses", "busy_seconds"):
+                metrics[key] += stats.get(key, 0)
+        
+        self.done += 1
+        self.outputs_done += sum(1 for success in results.values() if success)
+        if not all(results.values()):
+            self.failed += 1
+        self.folder = folder
+        self.progress()
+    
+    def folder_done(self, folder: str, failed: int, elapsed: float) -> None:
+        """Announce that all work items of a folder are finished."""
+        self.emit("folder", folder=folder, failed=failed, elapsed=round(elapsed, 2))
+        self.progress(force=True)
+    
+    def finish(self) -> None:
+        """Send the final counters."""
+        if self._reported_done != self.done:
+            self.progress(force=True)
+        self.emit("done", done=self.done, total=self.total, failed=self.failed,
+                  elapsed=round(time.time() - self._started, 2))
+
 class K1MultiFolderProcessor:
     """Handles multi-folder watermark processing with pre-configured settings."""
     
@@ -43,6 +374,16 @@ class K1MultiFolderProcessor:
         """Initialize the K1 multi-folder processor."""
         self.configs = self._load_configurations()
         self.base_script = "watermark_script.py"
+        self.journal_name = ".k1_journal.jsonl"
+        self.quarantine_name = "k1_quarantine.jsonl"
+        self._processors = {}
+        # watermark_cache.OutputCache reused by repeated runs (None: disabled)
+        self.output_cache = None
+        # watermark_script.MemoryBudget shared by the images in flight (None: no limit)
+        self.memory_budget = None
+        # Per-image limits of process workers: seconds and pixels (None: no limit)
+        self.image_timeout = None
+        self.max_pixels = None
         
     def _load_configurations(self) -> Dict[str, Dict[str, str]]:
         """Load pre-configured watermark settings."""
@@ -264,7 +605,8 @@ class K1MultiFolderProcessor:
     
     def process_folders(self, base_input: str, base_output: str, config_name: str,
                        custom_settings: Optional[Dict[str, str]] = None, 
-                       dry_run: bool = False, parallel: int = 1) -> Dict[str, bool]:
+                       dry_run: bool = False, parallel: int = 1,
+                       shard: Optional[Tuple[int, int]] = None) -> Dict[str, bool]:
         """Process multiple folders with the specified configuration."""
         # Get folder variants
         input_folders = self.get_folder_variants(base_input)
@@ -273,6 +615,15 @@ class K1MultiFolderProcessor:
             logger.error(f"No valid input folders found for base: {base_input}")
             return {}
         
+        if shard:
+            from watermark_script import in_shard
+            
+            # Each folder/config pair belongs to exactly one shard
+            input_folders = [folder for folder in input_folders
+                             if in_shard(self.folder_shard_key(folder, config_name), shard)]
+            logger.info(f"Shard {shard[0]}/{shard[1]}: {len(input_folders)} folders assigned "
+                        f"for {config_name}")
+        
         logger.info(f"Found {len(input_folders)} folders to process: {input_folders}")
         
         # Create output folders
@@ -321,9 +672,608 @@ class K1MultiFolderProcessor:
         
         return results
     
+    def create_watermark_processor(self, config_name: str,
+                                   custom_settings: Optional[Dict[str, str]] = None):
+        """Build an in-process WatermarkProcessor for the specified configuration."""
+        # Imported lazily so the subprocess workflow keeps its own logging setup
+        from watermark_script import WatermarkProcessor
+        
+        # For custom configurations, use a default config as base
+        base_config = "final_v2" if config_name == "custom" else config_name
+        if base_config not in self.configs:
+            raise ValueError(f"Unknown configuration: {config_name}")
+        
+        config = self.configs[base_config].copy()
+        
+        # Override with custom settings if provided
+        if custom_settings:
+            config.update(custom_settings)
+        
+        kwargs = {"enable_numbering": True}
+        for key, value in config.items():
+            if key in PROCESSOR_ARGUMENTS:
+                arg_name, arg_type = PROCESSOR_ARGUMENTS[key]
+                kwargs[arg_name] = arg_type(value)
+        
+        # Same requirements as watermark_script.validate_inputs
+        if not kwargs.get("png_watermark_path") and not kwargs.get("custom_text"):
+            raise ValueError(f"Configuration {config_name} needs a PNG watermark or custom text")
+        if kwargs.get("png_watermark_path") and not os.path.isfile(kwargs["png_watermark_path"]):
+            raise ValueError(f"PNG watermark file does not exist: {kwargs['png_watermark_path']}")
+        
+        return WatermarkProcessor(**kwargs)
+    
+    def get_watermark_processor(self, config_name: str,
+                                custom_settings: Optional[Dict[str, str]] = None):
+        """Return a cached in-process WatermarkProcessor (fonts and watermark loaded once)."""
+        key = (config_name, tuple(sorted((custom_settings or {}).items())))
+        if key not in self._processors:
+            self._processors[key] = self.create_watermark_processor(config_name, custom_settings)
+        return self._processors[key]
+    
+    def build_processors(self, config_names: List[str],
+                          custom_settings: Optional[Dict[str, str]] = None) -> Dict[str, object]:
+        """Build one processor per configuration (fonts and PNG watermark loaded once)."""
+        processors = {}
+        for config_name in config_names:
+            if config_name != "custom" and config_name not in self.configs:
+                logger.warning(f"Skipping unknown configuration: {config_name}")
+                continue
+            try:
+                processors[config_name] = self.get_watermark_processor(config_name, custom_settings)
+            except ValueError as e:
+                logger.error(f"Skipping configuration {config_name}: {e}")
+        return processors
+    
+    def process_image_fanout(self, input_path: str, output_paths: Dict[str, str],
+                             processors: Dict[str, object], stats: Optional[dict] = None) -> Dict[str, bool]:
+        """Decode an image once and apply every configuration to the in-memory frame."""
+        from watermark_script import process_image_fanout
+        return process_image_fanout(input_path, output_paths, processors, stats, self.output_cache)
+    
+    def process_folder_fanout(self, input_folder: str, output_folders: Dict[str, str],
+                              processors: Dict[str, object], dry_run: bool = False) -> Dict[str, bool]:
+        """Process a single folder, decoding each image once for all configurations."""
+        from watermark_script import get_image_files
+        
+        image_files = get_image_files(input_folder)
+        logger.info(f"Processing: {input_folder} ({len(image_files)} images, "
+                    f"configurations: {', '.join(output_folders)})")
+        
+        results = {config_name: True for config_name in output_folders}
+        start_time = time.time()
+        
+        for img_file in image_files:
+            output_paths = {
+                config_name: os.path.join(output_folder, Path(img_file).name)
+                for config_name, output_folder in output_folders.items()
+            }
+            
+            if dry_run:
+                for config_name, output_path in output_paths.items():
+                    logger.info(f"DRY RUN - Would process ({config_name}): {img_file} -> {output_path}")
+                continue
+            
+            for config_name, success in self.process_image_fanout(img_file, output_paths, processors).items():
+                results[config_name] = results[config_name] and success
+        
+        processing_time = time.time() - start_time
+        logger.info(f"Completed: {input_folder} in {processing_time:.2f} seconds")
+        return results
+    
+    def process_batch_fanout(self, base_input: str, base_output: str,
+                             config_names: List[str], custom_settings: Optional[Dict[str, str]] = None,
+                             dry_run: bool = False, parallel: int = 1) -> Dict[str, Dict[str, bool]]:
+        """
+        Process folders with multiple configurations, decoding every image only once.
+        
+        Each decoded frame is watermarked with all requested configurations and
+        written to the matching <folder>_<config> output directory.
+        """
+        logger.info(f"Fan-out processing with configurations: {config_names}")
+        
+        processors = self.build_processors(config_names, custom_settings)
+        if not processors:
+            logger.error("No valid configurations to process")
+            return {}
+        
+        input_folders = self.get_folder_variants(base_input)
+        if not input_folders:
+            logger.error(f"No valid input folders found for base: {base_input}")
+            return {}
+        
+        batch_results = {config_name: {} for config_name in processors}
+        
+        def run_folder(input_folder: str) -> Dict[str, bool]:
+            full_input_path = os.path.join(base_input, input_folder)
+            output_folders = {
+                config_name: os.path.join(base_output, f"{input_folder}_{config_name}")
+                for config_name in processors
+            }
+            return self.process_folder_fanout(full_input_path, output_folders, processors, dry_run)
+        
+        if parallel > 1 and not dry_run:
+            logger.info(f"Processing {len(input_folders)} folders with {parallel} parallel workers")
+            
+            with concurrent.futures.ThreadPoolExecutor(max_workers=parallel) as executor:
+                future_to_folder = {
+                    executor.submit(run_folder, input_folder): input_folder
+                    for input_folder in input_folders
+                }
+                
+                for future in concurrent.futures.as_completed(future_to_folder):
+                    input_folder = future_to_folder[future]
+                    try:
+                        folder_results = future.result()
+                    except Exception as e:
+                        logger.error(f"Exception in {input_folder}: {e}")
+                        folder_results = {config_name: False for config_name in processors}
+                    for config_name, success in folder_results.items():
+                        batch_results[config_name][input_folder] = success
+        else:
+            for input_folder in input_folders:
+                for config_name, success in run_folder(input_folder).items():
+                    batch_results[config_name][input_folder] = success
+        
+        return batch_results
+    
+    def collect_work_items(self, base_input: str, config_names: List[str],
+                           fan_out: bool = True) -> List[WorkItem]:
+        """
+        Flatten all subfolders into image-level work items.
+        
+        Args:
+            base_input: Parent input folder containing subfolders
+            config_names: Configurations to apply
+            fan_out: One item per image carrying all configurations (decode once),
+                otherwise one item per image and configuration
+            
+        Returns:
+            List[WorkItem]: Work items in folder/file order
+        """
+        from watermark_script import estimate_image_memory, get_image_files, read_image_info
+        
+        items = []
+        for input_folder in self.get_folder_variants(base_input):
+            for img_file in get_image_files(os.path.join(base_input, input_folder)):
+                size, mode = read_image_info(img_file) or (None, None)
+                cost = estimate_image_cost(img_file, size)
+                if fan_out:
+                    # All configurations are applied to one decoded frame
+                    memory = estimate_image_memory(size, mode, len(config_names))
+                    items.append(WorkItem(input_folder, img_file, tuple(config_names), cost, size, memory))
+                else:
+                    memory = estimate_image_memory(size, mode)
+                    for config_name in config_names:
+                        items.append(WorkItem(input_folder, img_file, (config_name,), cost, size, memory))
+        return items
+    
+    def job_fingerprint(self, base_input: str, config_names: List[str],
+                        custom_settings: Optional[Dict[str, str]] = None,
+                        shard: Optional[Tuple[int, int]] = None) -> str:
+        """Stable identifier of a job, used to match journal entries on resume."""
+        job = {
+            "base_input": os.path.abspath(base_input),
+            "configs": {
+                name: self.configs.get("final_v2" if name == "custom" else name)
+                for name in sorted(config_names)
+            },
+            "custom_settings": custom_settings or {},
+            "shard": list(shard) if shard else None,
+        }
+        return hashlib.sha1(json.dumps(job, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def journal_path(self, fingerprint: str) -> str:
+        """Journal file name of a job in the base output folder."""
+        return self.journal_name.replace('.jsonl', f'.{fingerprint[:12]}.jsonl')
+    
+    def folder_shard_key(self, folder: str, config_name: str) -> str:
+        """Shard key of a folder/config pair (folder scheduler)."""
+        return f"{folder}/{config_name}"
+    
+    def image_shard_key(self, folder: str, input_path: str) -> str:
+        """
+        Shard key of an image: its subfolder and output file name.
+        
+        Images of nested folders are written flat into <folder>_<config>, so
+        images with the same name in one subfolder share their outputs and
+        must share a shard.
+        """
+        return f"{folder}/{Path(input_path).name}"
+    
+    def work_item_key(self, item: WorkItem) -> str:
+        """Shard key of a work item: image shard key, plus the config for single-config items."""
+        key = self.image_shard_key(item.folder, item.input_path)
+        if len(item.config_names) == 1:
+            key = f"{key}|{item.config_names[0]}"
+        return key
+    
+    def verify_outputs(self, base_input: str, base_output: str, config_names: List[str],
+                       shard_count: Optional[int] = None, fan_out: bool = False,
+                       scheduler: str = 'global') -> bool:
+        """
+        Check that every image has an output for every configuration.
+        
+        Used after a sharded run to confirm the union of all shard outputs is
+        complete. With shard_count, missing outputs are attributed to the shard
+        that owns them, assigned as the run did: folder/config pairs with the
+        folder scheduler, work items with the global scheduler.
+        
+        Returns:
+            bool: True if no output is missing
+        """
+        from watermark_script import shard_of
+        
+        items = self.collect_work_items(base_input, config_names, fan_out)
+        expected = 0
+        missing = []
+        for item in items:
+            for config_name, output_path in self.get_output_paths(item, base_output).items():
+                expected += 1
+                if not os.path.isfile(output_path):
+                    missing.append((item, config_name))
+        
+        logger.info(f"Verified {expected} outputs: {expected - len(missing)} present, {len(missing)} missing")
+        for item, config_name in missing:
+            shard_info = ""
+            if shard_count:
+                if scheduler == 'folder':
+                    key = self.folder_shard_key(item.folder, config_name)
+                else:
+                    key = self.work_item_key(item)
+                shard_info = f" (shard {shard_of(key, shard_count)}/{shard_count})"
+            logger.warning(f"Missing {config_name} output for {item.input_path}{shard_info}")
+        return not missing
+    
+    def get_output_paths(self, item: WorkItem, base_output: str) -> Dict[str, str]:
+        """Output path of a work item per configuration."""
+        return {
+            config_name: os.path.join(base_output, f"{item.folder}_{config_name}",
+                                      Path(item.input_path).name)
+            for config_name in item.config_names
+        }
+    
+    def run_work_item(self, item: WorkItem, base_output: str,
+                      processors: Dict[str, object], stats: Optional[dict] = None) -> Dict[str, bool]:
+        """Process one work item, writing each configuration to <folder>_<config>."""
+        if self.memory_budget is None:
+            return self.process_image_fanout(item.input_path, self.get_output_paths(item, base_output),
+                                             processors, stats)
+        # Waits here while the images in progress leave too little of the memory budget
+        with self.memory_budget.reserve(item.memory, item.input_path):
+            return self.process_image_fanout(item.input_path, self.get_output_paths(item, base_output),
+                                             processors, stats)
+    
+    def process_work_queue(self, base_input: str, base_output: str,
+                           config_names: List[str], custom_settings: Optional[Dict[str, str]] = None,
+                           dry_run: bool = False, parallel: int = 1,
+                           fan_out: bool = True, executor: str = 'thread',
+                           recycle_after: Optional[int] = None,
+                           resume: bool = False,
+                           shard: Optional[Tuple[int, int]] = None,
+                           progress: Optional[ProgressEvents] = None,
+                           worker_pool=None,
+                           cancel: Optional[threading.Event] = None) -> Dict[str, Dict[str, bool]]:
+        """
+        Process all images of all subfolders through one global work queue.
+        
+        Unlike process_folders, which hands whole folders to workers, every
+        (folder, image, config) item goes into a single queue served by a fixed
+        number of workers. Items are dispatched largest-first by pixel count so
+        one huge folder cannot leave the other workers idle at the end.
+        
+        With executor='process' the workers are processes sharing the decoded
+        watermark assets through shared memory (see watermark_pool.py), recycled
+        after recycle_after images.
+        
+        Completed (image, config) pairs are recorded in a journal in the base
+        output folder; with resume=True the pairs completed by an earlier,
+        interrupted run of the same job are skipped.
+        
+        With shard=(i, N) only the work items hashed to shard i are processed.
+        
+        With a memory budget (self.memory_budget) images are only started while
+        their estimated decoded footprints fit it together; a warm worker_pool
+        applies its own budget.
+        
+        Process workers enforce the per-image limits (self.image_timeout,
+        self.max_pixels, or the worker_pool's own): images over a limit or
+        crashing their worker are listed with the reason in the quarantine
+        list in the base output folder and count as failed.
+        
+        With progress, start/progress/folder/done events are reported as
+        work items finish.
+        
+        worker_pool is an already running WatermarkProcessPool whose processors
+        include config_names (e.g. the web server's warm pool); it is used
+        instead of starting workers and stays running afterwards. At most
+        `parallel` images are in flight on it at a time.
+        
+        Once cancel is set no further images are dispatched and queued ones
+        are dropped; images in flight in process workers are stopped (see
+        WatermarkProcessPool.submit), those in threads are finished. Outputs
+        are only ever complete or absent, and the folders of images not
+        processed count as failed.
+        
+        Returns:
+            Dict[str, Dict[str, bool]]: Per configuration, success per subfolder
+        """
+        logger.info(f"Global work queue processing with configurations: {config_names}")
+        
+        processors = self.build_processors(config_names, custom_settings)
+        if not processors:
+            logger.error("No valid configurations to process")
+            return {}
+        
+        input_folders = self.get_folder_variants(base_input)
+        if not input_folders:
+            logger.error(f"No valid input folders found for base: {base_input}")
+            return {}
+        
+        items = self.collect_work_items(base_input, list(processors), fan_out)
+        
+        if shard:
+            from watermark_script import in_shard
+            
+            items = [item for item in items if in_shard(self.work_item_key(item), shard)]
+            logger.info(f"Shard {shard[0]}/{shard[1]}: {len(items)} work items assigned")
+        
+        # Folders without images still succeed, as with watermark_script.py
+        batch_results = {config_name: {folder: True for folder in input_folders}
+                         for config_name in processors}
+        
+        if dry_run:
+            for item in items:
+                for config_name in item.config_names:
+                    output_folder = os.path.join(base_output, f"{item.folder}_{config_name}")
+                    logger.info(f"DRY RUN - Would process ({config_name}): {item.input_path} -> {output_folder}")
+            return batch_results
+        
+        # Jobs (and shards) sharing an output folder each keep their own journal
+        fingerprint = self.job_fingerprint(base_input, list(processors), custom_settings, shard)
+        journal = CompletionJournal(os.path.join(base_output, self.journal_path(fingerprint)))
+        completed = journal.open(fingerprint, resume)
+        
+        if completed:
+            pending = []
+            for item in items:
+                image = os.path.relpath(item.input_path, base_input)
+                config_names = tuple(name for name in item.config_names
+                                     if (image, name) not in completed)
+                if config_names:
+                    pending.append(item._replace(config_names=config_names))
+            logger.info(f"Resuming: {len(completed)} completed image/config pairs skipped, "
+                        f"{len(pending)} of {len(items)} work items left")
+            items = pending
+        
+        # Per-folder bookkeeping for the folder summaries
+        remaining = {folder: 0 for folder in input_folders}
+        failed = {folder: 0 for folder in input_folders}
+        started = {}
+        for item in items:
+            remaining[item.folder] += 1
+        
+        total_cost = sum(item.cost for item in items)
+        logger.info(f"Queued {len(items)} work items from {len(input_folders)} folders "
+                    f"({total_cost / 1e6:.1f} MP) for {parallel} workers")
+        
+        # Longest-processing-time-first keeps the tail of the run short
+        queue = sorted(items, key=lambda item: item.cost, reverse=True)
+        
+        if progress:
+            progress.start(len(items), sorted({item.folder for item in items}),
+                           sum(len(item.config_names) for item in items))
+        
+        # Worker measurements per work item, passed on with the progress events
+        item_stats = {}
+        
+        def run(item: WorkItem) -> Dict[str, bool]:
+            started.setdefault(item.folder, time.time())
+            stats = item_stats[id(item)] = {}
+            return self.run_work_item(item, base_output, processors, stats)
+        
+        # Images the process workers set aside
+        quarantine = None
+        
+        if worker_pool is not None or executor == 'process':
+            from watermark_pool import ImageQuarantined, QuarantineList
+            
+            quarantine = QuarantineList(os.path.join(base_output, self.quarantine_name))
+            if worker_pool is not None:
+                pool = worker_pool
+            else:
+                from watermark_pool import WatermarkProcessPool, common_image_sizes
+                
+                pool = WatermarkProcessPool(processors, parallel, recycle_after,
+                                            common_image_sizes(item.size for item in items),
+                                            self.output_cache, self.memory_budget,
+                                            self.image_timeout, self.max_pixels)
+            
+            # A shared pool may have more workers than this run was granted
+            in_flight = threading.BoundedSemaphore(max(1, parallel)) if worker_pool is not None else None
+            
+            def submit(item: WorkItem) -> concurrent.futures.Future:
+                started.setdefault(item.folder, time.time())
+                if in_flight is not None:
+                    in_flight.acquire()
+                try:
+                    future = pool.submit(item.input_path, self.get_output_paths(item, base_output),
+                                         on_stats=functools.partial(item_stats.__setitem__, id(item)),
+                                         memory=item.memory)
+                except Exception:
+                    if in_flight is not None:
+                        in_flight.release()
+                    raise
+                if in_flight is not None:
+                    future.add_done_callback(lambda _: in_flight.release())
+                return future
+        else:
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, parallel))
+            
+            def submit(item: WorkItem) -> concurrent.futures.Future:
+                return pool.submit(run, item)
+        
+        lock = threading.Lock()
+        
+        def on_done(item: WorkItem, future: concurrent.futures.Future) -> None:
+            if future.cancelled():
+                with lock:
+                    for config_name in item.config_names:
+                        batch_results[config_name][item.folder] = False
+                return
+            quarantined = None
+            try:
+                item_results = future.result()
+            except Exception as e:
+                if quarantine is not None and isinstance(e, ImageQuarantined):
+                    quarantined = e.reason
+                    quarantine.add(item.input_path, e.reason, folder=item.folder)
+                else:
+                    logger.error(f"Exception processing {item.input_path}: {e}")
+                item_results = {config_name: False for config_name in item.config_names}
+            
+            image = os.path.relpath(item.input_path, base_input)
+            output_paths = self.get_output_paths(item, base_output)
+            for config_name, success in item_results.items():
+                if success:
+                    journal.record(item.folder, image, config_name, output_paths.get(config_name))
+            
+            with lock:
+                for config_name, success in item_results.items():
+                    if not success:
+                        batch_results[config_name][item.folder] = False
+                if not all(item_results.values()):
+                    failed[item.folder] += 1
+                
+                remaining[item.folder] -= 1
+                stats = item_stats.pop(id(item), None)
+                if progress and quarantined:
+                    progress.emit("quarantine", folder=item.folder, image=image, reason=quarantined)
+                if progress:
+                    progress.item_done(item.folder, item_results, stats, image)
+                if remaining[item.folder] == 0:
+                    elapsed = time.time() - started[item.folder]
+                    logger.info(f"Completed folder {item.folder}: "
+                                f"{failed[item.folder]} failed work items, {elapsed:.2f} seconds")
+                    if progress:
+                        progress.folder_done(item.folder, failed[item.folder], elapsed)
+        
+        try:
+            futures = []
+            for item in queue:
+                if cancel is not None and cancel.is_set():
+                    break
+                future = submit(item)
+                # Results are handled as they finish so the journal keeps up
+                future.add_done_callback(functools.partial(on_done, item))
+                futures.append(future)
+            # Queued items are dropped as soon as a stop is requested
+            while cancel is not None and not cancel.is_set():
+                if not concurrent.futures.wait(futures, timeout=0.25).not_done:
+                    break
+            if cancel is not None and cancel.is_set():
+                cancelled = sum(1 for future in futures if future.cancel()) + len(queue) - len(futures)
+                logger.warning(f"Cancelled: {cancelled} of {len(queue)} work items not processed")
+                for item in queue[len(futures):]:
+                    for config_name in item.config_names:
+                        batch_results[config_name][item.folder] = False
+            concurrent.futures.wait(futures)
+        finally:
+            if pool is not worker_pool:
+                pool.shutdown()
+            journal.close()
+        
+        if quarantine is not None and quarantine.entries:
+            logger.warning(f"{len(quarantine.entries)} images quarantined, listed in {quarantine.path}")
+        if self.output_cache is not None and not dry_run:
+            self.output_cache.trim()
+        if self.memory_budget is not None:
+            logger.info(f"Memory budget: peak {self.memory_budget.peak / 1e6:.0f} MB "
+                        f"of {self.memory_budget.total / 1e6:.0f} MB in use")
+        
+        if progress:
+            progress.finish()
+        
+        return batch_results
+    
+    def watch_folders(self, base_input: str, base_output: str, config_names: List[str],
+                      custom_settings: Optional[Dict[str, str]] = None,
+                      dry_run: bool = False, parallel: int = 1,
+                      shard: Optional[Tuple[int, int]] = None,
+                      settle_seconds: float = 1.0, queue_size: int = 100,
+                      poll_interval: float = 1.0) -> None:
+        """
+        Keep running and process images as they arrive in the subfolders.
+        
+        Images without up-to-date outputs are processed first. After that each
+        new or changed image (in existing or newly created subfolders) is
+        processed on its own, with all configurations, by warm processors.
+        
+        Args:
+            base_input: Parent input folder containing subfolders
+            base_output: Parent output folder
+            config_names: Configurations to apply
+            custom_settings: Custom settings for the "custom" configuration
+            dry_run: Only log what would be processed
+            parallel: Number of worker threads
+            shard: Only process images hashed to shard i of N
+            settle_seconds: Seconds a file must stay unchanged before it is processed
+            queue_size: Maximum images waiting for a worker
+            poll_interval: Scan interval when inotify is unavailable
+        """
+        from watermark_script import estimate_image_memory, in_shard, output_is_current, read_image_info
+        from watch_folder import WatchService
+        
+        processors = self.build_processors(config_names, custom_settings)
+        if not processors:
+            logger.error("No valid configurations to process")
+            return
+        
+        def make_item(img_file: str) -> WorkItem:
+            folder = os.path.relpath(img_file, base_input).split(os.sep)[0]
+            size, mode = read_image_info(img_file) or (None, None)
+            return WorkItem(folder, img_file, tuple(processors), estimate_image_cost(img_file, size), size,
+                            estimate_image_memory(size, mode, len(processors)))
+        
+        def accept(img_file: str) -> bool:
+            # Images directly in the base folder belong to no subfolder
+            if os.sep not in os.path.relpath(img_file, base_input):
+                return False
+            folder = os.path.relpath(img_file, base_input).split(os.sep)[0]
+            return not shard or in_shard(self.image_shard_key(folder, img_file), shard)
+        
+        def handle(img_file: str) -> bool:
+            item = make_item(img_file)
+            if dry_run:
+                for config_name, output_path in self.get_output_paths(item, base_output).items():
+                    logger.info(f"DRY RUN - Would process ({config_name}): {img_file} -> {output_path}")
+                return True
+            return all(self.run_work_item(item, base_output, processors).values())
+        
+        items = [item for item in self.collect_work_items(base_input, list(processors))
+                 if accept(item.input_path)]
+        pending = [
+            item.input_path for item in items
+            if not all(output_is_current(item.input_path, output_path)
+                       for output_path in self.get_output_paths(item, base_output).values())
+        ]
+        logger.info(f"Watch mode: {len(pending)} of {len(items)} existing images need processing")
+        
+        service = WatchService(
+            base_input, handle,
+            workers=parallel,
+            queue_size=queue_size,
+            settle_seconds=settle_seconds,
+            poll_interval=poll_interval,
+            exclude=[base_output],
+            accept=accept
+        )
+        service.run(initial=pending)
+    
     def process_batch_configs(self, base_input: str, base_output: str, 
                             config_names: List[str], custom_settings: Optional[Dict[str, str]] = None,
-                            dry_run: bool = False, parallel: int = 1) -> Dict[str, Dict[str, bool]]:
+                            dry_run: bool = False, parallel: int = 1,
+                            shard: Optional[Tuple[int, int]] = None) -> Dict[str, Dict[str, bool]]:
         """Process folders with multiple configurations."""
         logger.info(f"Batch processing with configurations: {config_names}")
         
@@ -336,7 +1286,7 @@ class K1MultiFolderProcessor:
             
             logger.info(f"Processing with configuration: {config_name}")
             results = self.process_folders(
-                base_input, base_output, config_name, custom_settings, dry_run, parallel
+                base_input, base_output, config_name, custom_settings, dry_run, parallel, shard
             )
             batch_results[config_name] = results
         
@@ -362,6 +1312,8 @@ class K1MultiFolderProcessor:
 
 def main():
     """Main function for K1 multi-folder processing."""
+    from watermark_script import parse_shard
+    
     parser = argparse.ArgumentParser(
         description="K1 Multi-Folder Watermark Processing Script",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -376,6 +1328,15 @@ Examples:
   # Batch processing with multiple configs
   py k1_multi_folder.py --base-input "k1_test_input" --base-output "k1_output" --config "batch" --batch-configs "final_v2,glow_effect"
   
+  # Batch processing decoding each image only once for all configs
+  py k1_multi_folder.py --base-input "k1_test_input" --base-output "k1_output" --config "batch" --batch-configs "final_v2,glow_effect" --fan-out
+  
+  # Balance all images of all subfolders over 8 workers
+  py k1_multi_folder.py --base-input "k1_test_input" --base-output "k1_output" --config "final_v2" --scheduler global --parallel 8
+  
+  # Keep running and watermark images as they are dropped into the subfolders
+  py k1_multi_folder.py --base-input "k1_test_input" --base-output "k1_output" --config "final_v2" --watch
+  
   # List available configurations
   py k1_multi_folder.py --list-configs
         """
@@ -432,6 +1393,48 @@ Examples:
                        help='Number watermark Y offset (can be negative, overrides config)')
     parser.add_argument('--parallel', type=int, default=1,
                        help='Number of parallel workers (default: 1)')
+    parser.add_argument('--fan-out', action='store_true',
+                       help='Process in-process, decoding each image once and applying all configurations to it')
+    parser.add_argument('--scheduler', choices=['folder', 'global'], default='folder',
+                       help='Parallelize by folder (default) or through one global image-level work queue')
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread',
+                       help='Worker type for the global scheduler; process workers share watermark assets '
+                            'through shared memory (implies --scheduler global)')
+    parser.add_argument('--recycle-after', type=int, default=None,
+                       help='Replace process workers after this many images (default: never)')
+    parser.add_argument('--resume', action='store_true',
+                       help='Skip images completed by an interrupted run, using the journal in the base output '
+                            'folder (implies --scheduler global)')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                       help='Process only shard i of N (e.g. "0/4"): folder/config pairs, or images with '
+                            '--fan-out/--scheduler global, assigned by a stable hash of their relative path')
+    parser.add_argument('--verify-output', action='store_true',
+                       help='Check that the base output folder holds every expected output and exit')
+    parser.add_argument('--progress-events', action='store_true',
+                       help='Write JSON progress events ("K1_EVENT {...}" lines) to stdout '
+                            '(implies --scheduler global)')
+    parser.add_argument('--output-cache', default=None,
+                       help='Folder of a content-addressed cache of outputs: images already watermarked with the '
+                            'same settings are linked from it instead of processed (implies --scheduler global)')
+    parser.add_argument('--output-cache-size', type=float, default=20.0,
+                       help='Size limit of the output cache in GB, least recently used outputs are removed '
+                            '(default: 20)')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                       help='Memory in GB for the images decoded by all workers together: images whose estimated '
+                            'footprint (from the header) does not fit wait for images in progress to finish '
+                            '(implies --scheduler global, default: no limit)')
+    parser.add_argument('--image-timeout', type=float, default=None,
+                       help='Seconds an image may take: the worker process of a slower image is replaced and the '
+                            'image quarantined (implies --executor process, default: no limit)')
+    parser.add_argument('--max-pixels', type=float, default=None,
+                       help='Largest image in megapixels (from the header); larger images are quarantined without '
+                            'being decoded (implies --executor process, default: Pillow\'s decompression bomb limit)')
+    parser.add_argument('--watch', action='store_true',
+                       help='Keep running and process new or changed images in the subfolders as they arrive')
+    parser.add_argument('--watch-settle', type=float, default=1.0,
+                       help='Seconds a file must stay unchanged before it is processed (default: 1.0)')
+    parser.add_argument('--watch-queue-size', type=int, default=100,
+                       help='Maximum images waiting for a worker in watch mode (default: 100)')
     parser.add_argument('--dry-run', action='store_true',
                        help='Show what would be processed without actually processing')
     parser.add_argument('--verbose', action='store_true',
@@ -513,16 +1516,88 @@ Examples:
         if args.number_y_offset:
             custom_settings["number_y_offset"] = args.number_y_offset
     
+    # Per-image limits are enforced by replacing worker processes
+    if args.image_timeout or args.max_pixels:
+        from watermark_script import set_pixel_limit
+        
+        args.executor = 'process'
+        processor.image_timeout = args.image_timeout
+        processor.max_pixels = int(args.max_pixels * 1e6) if args.max_pixels else None
+        # Headers up to the limit must be readable when the work items are collected
+        set_pixel_limit(processor.max_pixels)
+    
+    # Process workers, resumable runs, image-level shards, progress events, the
+    # output cache and the memory budget use the global work queue
+    if (args.executor == 'process' or args.resume or args.progress_events or args.output_cache
+            or args.memory_budget or (args.shard and args.fan_out)):
+        args.scheduler = 'global'
+    if args.memory_budget:
+        from watermark_script import MemoryBudget
+        
+        processor.memory_budget = MemoryBudget(int(args.memory_budget * 1024 ** 3))
+    if args.output_cache:
+        from watermark_cache import OutputCache
+        
+        processor.output_cache = OutputCache(args.output_cache, int(args.output_cache_size * 1024 ** 3))
+    progress = ProgressEvents() if args.progress_events else None
+    
+    # SIGTERM (e.g. a cancelled server job) stops the global work queue at an image boundary
+    stop = threading.Event()
+    if args.scheduler == 'global' and threading.current_thread() is threading.main_thread():
+        import signal
+        
+        def request_stop(signum, frame):
+            logger.warning("Stop requested, finishing the images in progress")
+            stop.set()
+        
+        signal.signal(signal.SIGTERM, request_stop)
+    
+    if args.verify_output:
+        if args.batch_configs:
+            config_names = [name.strip() for name in args.batch_configs.split(',')]
+        else:
+            config_names = [args.config]
+        complete = processor.verify_outputs(
+            args.base_input, args.base_output, config_names,
+            args.shard[1] if args.shard else None, args.fan_out, args.scheduler
+        )
+        sys.exit(0 if complete else 1)
+    
+    if args.watch:
+        if args.batch_configs:
+            config_names = [name.strip() for name in args.batch_configs.split(',')]
+        else:
+            config_names = [args.config]
+        processor.watch_folders(
+            args.base_input, args.base_output, config_names, custom_settings,
+            args.dry_run, args.parallel, args.shard,
+            args.watch_settle, args.watch_queue_size
+        )
+        return
+    
     # Process folders
     start_time = time.time()
     
     if args.batch_configs:
         # Batch processing with multiple configurations
         config_names = [name.strip() for name in args.batch_configs.split(',')]
-        results = processor.process_batch_configs(
-            args.base_input, args.base_output, config_names, 
-            custom_settings, args.dry_run, args.parallel
-        )
+        if args.scheduler == 'global':
+            results = processor.process_work_queue(
+                args.base_input, args.base_output, config_names,
+                custom_settings, args.dry_run, args.parallel, args.fan_out,
+                args.executor, args.recycle_after, args.resume, args.shard, progress,
+                cancel=stop
+            )
+        elif args.fan_out:
+            results = processor.process_batch_fanout(
+                args.base_input, args.base_output, config_names,
+                custom_settings, args.dry_run, args.parallel
+            )
+        else:
+            results = processor.process_batch_configs(
+                args.base_input, args.base_output, config_names, 
+                custom_settings, args.dry_run, args.parallel, args.shard
+            )
         
         # Summary
         logger.info("\n" + "="*50)
@@ -549,10 +1624,23 @@ Examples:
         
     else:
         # Single configuration processing
-        results = processor.process_folders(
-            args.base_input, args.base_output, args.config,
-            custom_settings, args.dry_run, args.parallel
-        )
+        if args.scheduler == 'global':
+            results = processor.process_work_queue(
+                args.base_input, args.base_output, [args.config],
+                custom_settings, args.dry_run, args.parallel,
+                executor=args.executor, recycle_after=args.recycle_after,
+                resume=args.resume, shard=args.shard, progress=progress, cancel=stop
+            ).get(args.config, {})
+        elif args.fan_out:
+            results = processor.process_batch_fanout(
+                args.base_input, args.base_output, [args.config],
+                custom_settings, args.dry_run, args.parallel
+            ).get(args.config, {})
+        else:
+            results = processor.process_folders(
+                args.base_input, args.base_output, args.config,
+                custom_settings, args.dry_run, args.parallel, args.shard
+            )
         
         # Summary
         success_count = sum(1 for success in results.values() if success)
@@ -578,6 +1666,10 @@ Examples:
         logger.info("DRY RUN COMPLETED - No files were processed")
     else:
         logger.info("Processing completed!")
+    
+    # Callers (e.g. server jobs) see failed, quarantined or missing work in the exit status
+    if not results_succeeded(results):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
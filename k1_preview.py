@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+K1 Watermark Preview
+
+Renders a downscaled preview of a watermarked sample image for the web
+frontend, fast enough to follow slider adjustments (well under 100 ms once the
+sample is cached):
+
+- The sample is decoded at reduced resolution (JPEG DCT scaling via
+  Image.draft) and the reduced frame is cached
+- The overlays are computed with the full-resolution geometry of the sample,
+  so positions, margins and offsets match the real output, then scaled down
+- Rendered overlays are shared between settings that only differ in placement
+  (offsets, margins, positions), so moving a watermark never re-renders it
+- Fonts and the decoded PNG watermark are taken from the cached base
+  configuration (no Google Font download per adjustment)
+
+Used by both server.py and server_production.py through create_preview_blueprint().
+"""
+
+import collections
+import io
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from flask import Blueprint, Response, jsonify, request
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.bmp'}
+
+# Settings that only move watermarks; overlays are shared across them
+PLACEMENT_SETTINGS = {
+    'margin', 'png_position', 'png_x_offset', 'png_y_offset',
+    'custom_text_position', 'number_position', 'number_x_offset', 'number_y_offset',
+}
+
+def find_sample_image(folder: str) -> Optional[str]:
+    """Return the first image in a folder or, failing that, in its subfolders."""
+    subfolders = []
+    try:
+        entries = sorted(os.scandir(folder), key=lambda entry: entry.name)
+    except OSError:
+        return None
+    for entry in entries:
+        if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+            return entry.path
+        if entry.is_dir():
+            subfolders.append(entry.path)
+    for subfolder in subfolders:
+        sample = find_sample_image(subfolder)
+        if sample:
+            return sample
+    return None
+
+class LRUCache:
+    """Small thread-safe least-recently-used cache."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+class PreviewRenderer:
+    """Renders downscaled watermark previews with cached decodes and overlays."""
+
+    def __init__(self, max_size: int = 1024, quality: int = 85, cache_size: int = 16):
+        """
+        Initialize the renderer.
+
+        Args:
+            max_size: Longest side of the preview in pixels
+            quality: JPEG quality of the preview
+            cache_size: Number of samples, processors and overlay sets kept
+        """
+        # Imported lazily: the server's logging setup must come first
+        from k1_multi_folder import K1MultiFolderProcessor
+
+        self.k1 = K1MultiFolderProcessor()
+        self.max_size = max_size
+        self.quality = quality
+        self._samples = LRUCache(cache_size)
+        self._processors = LRUCache(cache_size * 2)
+        self._overlays = LRUCache(cache_size)
+        self._scaled = LRUCache(cache_size * 4)
+        self._lock = threading.Lock()
+
+    def load_sample(self, image_path: str) -> Tuple[Image.Image, Tuple[int, int]]:
+        """
+        Return the reduced-resolution RGBA frame of a sample and its full size.
+
+        The frame is cached until the file changes.
+        """
+        stat = os.stat(image_path)
+        key = (os.path.abspath(image_path), stat.st_mtime, stat.st_size, self.max_size)
+        sample = self._samples.get(key)
+        if sample is None:
+            with Image.open(image_path) as img:
+                full_size = img.size
+                # JPEG: let the decoder scale down by 1/2, 1/4 or 1/8 while decoding
+                img.draft('RGB', (self.max_size, self.max_size))
+                frame = img.convert('RGBA')
+            frame.thumbnail((self.max_size, self.max_size), Image.Resampling.BILINEAR)
+            sample = (frame, full_size)
+            self._samples.put(key, sample)
+        return sample
+
+    def get_processor(self, config_name: str, custom_settings: Optional[Dict[str, str]] = None):
+        """Return a processor for a configuration with (preview) custom settings applied."""
+        from k1_multi_folder import PROCESSOR_ARGUMENTS
+        from watermark_script import WatermarkProcessor
+
+        overrides = {}
+        for key, value in (custom_settings or {}).items():
+            if key in PROCESSOR_ARGUMENTS and value is not None and value != '':
+                arg_name, arg_type = PROCESSOR_ARGUMENTS[key]
+                overrides[arg_name] = arg_type(value)
+
+        key = (config_name, tuple(sorted(overrides.items())))
+        processor = self._processors.get(key)
+        if processor is not None:
+            return processor
+
+        with self._lock:
+            # The base configuration holds the resolved font and the decoded PNG
+            base = self.k1.get_watermark_processor(config_name)
+        settings = base.get_settings()
+        if 'google_font_name' in overrides:
+            settings['custom_font_path'] = None
+        settings.update(overrides)
+        png_watermark = base.png_watermark if 'png_watermark_path' not in overrides else None
+        processor = WatermarkProcessor(png_watermark_image=png_watermark, **settings)
+
+        # Overlays do not depend on placement: reuse those rendered for the same look
+        overlays = self._overlays.get(self._appearance_key(config_name, settings))
+        if overlays:
+            processor.seed_overlays(overlays)
+
+        self._processors.put(key, processor)
+        return processor
+
+    def _appearance_key(self, config_name: str, settings: dict) -> tuple:
+        return (config_name, tuple(sorted(
+            (name, value) for name, value in settings.items() if name not in PLACEMENT_SETTINGS
+        )))
+
+    def _scale_overlay(self, overlay: Image.Image, size: Tuple[int, int], cached: bool) -> Image.Image:
+        """Return a downscaled copy of an overlay (cached per overlay and size if it is reused)."""
+        if not cached:
+            return overlay.resize(size, Image.Resampling.BILINEAR)
+        key = (id(overlay), size)
+        entry = self._scaled.get(key)
+        # The cache entry keeps the overlay alive, so its id cannot be reused meanwhile
+        if entry is not None and entry[0] is overlay:
+            return entry[1]
+        scaled = overlay.resize(size, Image.Resampling.BILINEAR)
+        self._scaled.put(key, (overlay, scaled))
+        return scaled
+
+    def render(self, config_name: str, image_path: str,
+               custom_settings: Optional[Dict[str, str]] = None) -> Tuple[bytes, dict]:
+        """
+        Render a watermarked preview of a sample image.
+
+        Args:
+            config_name: K1 configuration name
+            image_path: Sample image (or a folder to take the first image from)
+            custom_settings: Settings overriding the configuration
+
+        Returns:
+            Tuple[bytes, dict]: JPEG data and preview information
+
+        Raises:
+            ValueError: For an unknown configuration or a missing sample image
+        """
+        started = time.time()
+        if os.path.isdir(image_path):
+            sample_path = find_sample_image(image_path)
+            if not sample_path:
+                raise ValueError(f"No images found in: {image_path}")
+        elif os.path.isfile(image_path):
+            sample_path = image_path
+        else:
+            raise ValueError(f"Sample image does not exist: {image_path}")
+
+        frame, full_size = self.load_sample(sample_path)
+        processor = self.get_processor(config_name, custom_settings)
+
+        scale_x = frame.width / full_size[0]
+        scale_y = frame.height / full_size[1]
+        preview = frame.copy()
+        layers = processor.watermark_layers(full_size, Path(sample_path).name)
+        overlays = processor.get_overlays()
+        # Number overlays are rendered per image; only scale-cache the shared ones
+        reused = {id(overlay) for overlay in overlays.values()}
+        for overlay, (x, y) in layers:
+            size = (max(1, round(overlay.width * scale_x)), max(1, round(overlay.height * scale_y)))
+            scaled = self._scale_overlay(overlay, size, id(overlay) in reused)
+            preview.paste(scaled, (round(x * scale_x), round(y * scale_y)), scaled)
+
+        self._overlays.put(self._appearance_key(config_name, processor.get_settings()), overlays)
+
+        buffer = io.BytesIO()
+        preview.convert('RGB').save(buffer, 'JPEG', quality=self.quality)
+        info = {
+            'sample': sample_path,
+            'image_size': full_size,
+            'preview_size': preview.size,
+            'render_ms': round((time.time() - started) * 1000, 1),
+        }
+        return buffer.getvalue(), info
+
+def create_preview_blueprint(renderer_factory=PreviewRenderer) -> Blueprint:
+    """Create the /api/preview endpoint (the renderer is created on first use)."""
+    preview_api = Blueprint('preview', __name__)
+    state = {'renderer': None}
+    lock = threading.Lock()
+
+    def get_renderer() -> PreviewRenderer:
+        with lock:
+            if state['renderer'] is None:
+                state['renderer'] = renderer_factory()
+            return state['renderer']
+
+    @preview_api.route('/api/preview', methods=['POST'])
+    def preview():
+        """Return a downscaled JPEG of a sample image watermarked with a configuration."""
+        data = request.json or {}
+        config_name = data.get('config')
+        image_path = data.get('image_path') or data.get('base_input')
+        if not config_name or not image_path:
+            return jsonify({'error': 'Missing required fields: config, image_path'}), 400
+
+        try:
+            jpeg, info = get_renderer().render(config_name, image_path, data.get('custom_settings'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Error rendering preview: {e}")
+            return jsonify({'error': str(e)}), 500
+
+        return Response(jpeg, mimetype='image/jpeg', headers={
+            'Cache-Control': 'no-store',
+            'X-Preview-Sample': info['sample'],
+            'X-Preview-Render-Ms': str(info['render_ms']),
+        })
+
+    return preview_api
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+K1 Upload-and-Watermark Endpoint
+
+Watermarks uploaded images in memory with a named K1 configuration and streams
+the encoded results back, without touching the filesystem:
+
+- POST /api/watermark/<config> with a raw image body returns the watermarked
+  image
+- POST /api/watermark/<config> with multipart/form-data (one or more files)
+  returns multipart/mixed, one part per file, each written as soon as it is done
+- The multipart body is parsed incrementally; only the file being read is held
+  in memory
+- Requests are limited by a concurrency cap (503 when saturated) and by a
+  per-request memory cap on the upload and on the decoded image size
+
+Used by both server.py and server_production.py through create_upload_blueprint().
+"""
+
+import io
+import logging
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from PIL import UnidentifiedImageError
+from werkzeug.sansio.multipart import Data, Epilogue, File, MultipartDecoder, NeedData
+
+import k1_metrics
+
+logger = logging.getLogger(__name__)
+
+# Encoded output formats (query parameter `format`)
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'png': ('PNG', 'image/png', '.png'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+}
+INPUT_FORMATS = {'JPEG': 'jpeg', 'MPO': 'jpeg', 'PNG': 'png', 'WEBP': 'webp'}
+
+# Decoded RGBA frame plus the watermarked copy
+BYTES_PER_PIXEL = 8
+READ_CHUNK_SIZE = 64 * 1024
+
+class UploadTooLarge(Exception):
+    """The upload exceeds the per-request memory cap."""
+
+class UploadWatermarker:
+    """Applies cached K1 configurations to in-memory image data."""
+
+    def __init__(self, max_request_bytes: int = 64 * 1024 * 1024,
+                 max_request_memory: int = 512 * 1024 * 1024):
+        """
+        Initialize the watermarker.
+
+        Args:
+            max_request_bytes: Maximum size of one uploaded file (bytes)
+            max_request_memory: Maximum memory one request may use for a
+                decoded image and its watermarked copy (bytes)
+        """
+        # Imported lazily: the server's logging setup must come first
+        from k1_multi_folder import K1MultiFolderProcessor
+
+        self.k1 = K1MultiFolderProcessor()
+        self.max_request_bytes = max_request_bytes
+        self.max_request_memory = max_request_memory
+        self._lock = threading.Lock()
+
+    def get_processor(self, config_name: str):
+        """Return the cached processor of a configuration (ValueError if unknown)."""
+        with self._lock:
+            return self.k1.get_watermark_processor(config_name)
+
+    def watermark(self, processor, data: bytes, filename: str,
+                  output_format: Optional[str], quality: int,
+                  config_name: str = 'upload') -> Tuple[bytes, str, str]:
+        """
+        Watermark one encoded image (recorded in the /metrics counters).
+
+        Args:
+            processor: WatermarkProcessor to apply
+            data: Encoded input image
+            filename: Original file name (used for number extraction)
+            output_format: 'jpeg', 'png', 'webp' or None to keep the input format
+            quality: JPEG/WebP quality
+            config_name: Configuration name the metrics are recorded under
+
+        Returns:
+            Tuple[bytes, str, str]: Encoded image, its MIME type and file name
+
+        Raises:
+            UploadTooLarge: If the decoded image would exceed the memory cap
+            ValueError: If the data is not a supported image
+        """
+        started = time.perf_counter()
+        hits, misses = processor.cache_counts()
+        try:
+            result = self._watermark(processor, data, filename, output_format, quality)
+        except Exception:
+            k1_metrics.record_image(config_name, 'upload', time.perf_counter() - started, False, len(data))
+            raise
+        now_hits, now_misses = processor.cache_counts()
+        k1_metrics.record_image(config_name, 'upload', time.perf_counter() - started, True,
+                                len(data), len(result[0]), now_hits - hits, now_misses - misses)
+        return result
+
+    def _watermark(self, processor, data: bytes, filename: str,
+                   output_format: Optional[str], quality: int) -> Tuple[bytes, str, str]:
+        from watermark_script import encode_image, open_image_source
+
+        try:
+            img = open_image_source(data)
+        except UnidentifiedImageError:
+            raise ValueError(f"{filename} is not a supported image")
+        except Exception as e:
+            raise ValueError(f"Cannot read {filename}: {e}")
+
+        with img:
+            width, height = img.size
+            needed = len(data) + width * height * BYTES_PER_PIXEL
+            if needed > self.max_request_memory:
+                raise UploadTooLarge(f"{width}x{height} image needs ~{needed // (1024 * 1024)} MB, "
+                                     f"limit is {self.max_request_memory // (1024 * 1024)} MB")
+            output_format = output_format or INPUT_FORMATS.get(img.format, 'jpeg')
+            watermarked = processor.apply_watermarks(img, filename)
+
+        pil_format, mimetype, extension = OUTPUT_FORMATS[output_format]
+        if pil_format == 'PNG':
+            encoded = encode_image(watermarked, pil_format)
+        else:
+            encoded = encode_image(watermarked, pil_format, quality=quality)
+        return encoded, mimetype, str(Path(filename).with_suffix(extension))
+
+def _read_body(stream, limit: int) -> bytes:
+    """Read a raw request body, enforcing the size limit while reading."""
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            return buffer.getvalue()
+        if buffer.tell() + len(chunk) > limit:
+            raise UploadTooLarge(f"Upload exceeds {limit // (1024 * 1024)} MB")
+        buffer.write(chunk)
+
+def iter_uploaded_files(stream, boundary: bytes, limit: int) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (filename, data) for each file of a multipart body as soon as it is read.
+
+    Form fields are skipped; only the current file is buffered.
+    """
+    decoder = MultipartDecoder(boundary)
+    current = None
+    name = None
+    finished = False
+    while not finished:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        decoder.receive_data(chunk or None)
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                break
+            if isinstance(event, Epilogue):
+                finished = True
+                break
+            if isinstance(event, File):
+                current = io.BytesIO()
+                name = event.filename or event.name or 'upload'
+            elif isinstance(event, Data) and current is not None:
+                if current.tell() + len(event.data) > limit:
+                    raise UploadTooLarge(f"{name} exceeds {limit // (1024 * 1024)} MB")
+                current.write(event.data)
+                if not event.more_data:
+                    yield name, current.getvalue()
+                    current = None
+        if not chunk:
+            finished = True
+
+def _header_filename(filename: str) -> str:
+    """File name safe for a Content-Disposition header."""
+    return Path(filename.replace('\\', '/')).name.replace('"', '').replace('\r', '').replace('\n', '')
+
+def create_upload_blueprint(max_concurrent: int = 4, queue_timeout: float = 2.0,
+                            watermarker_factory=UploadWatermarker) -> Blueprint:
+    """
+    Create the /api/watermark endpoint.
+
+    Args:
+        max_concurrent: Requests processed at the same time (others wait up to queue_timeout)
+        queue_timeout: Seconds a request may wait for a slot before getting 503
+        watermarker_factory: Creates the UploadWatermarker (on first use)
+    """
+    upload_api = Blueprint('upload', __name__)
+    slots = threading.BoundedSemaphore(max_concurrent)
+    state = {'watermarker': None}
+    lock = threading.Lock()
+
+    def get_watermarker() -> UploadWatermarker:
+        with lock:
+            if state['watermarker'] is None:
+                state['watermarker'] = watermarker_factory()
+            return state['watermarker']
+
+    @upload_api.route('/api/watermark/<config_name>', methods=['POST'])
+    def watermark(config_name):
+        """Watermark uploaded images in memory and stream the results back."""
+        output_format = request.args.get('format')
+        if output_format is not None and output_format not in OUTPUT_FORMATS:
+            return jsonify({'error': f"Unsupported format: {output_format}"}), 400
+        try:
+            quality = int(request.args.get('quality', 100))
+        except ValueError:
+            return jsonify({'error': 'quality must be an integer'}), 400
+
+        watermarker = get_watermarker()
+        # A raw body is one file; multipart files are limited one by one while reading
+        if (request.mimetype != 'multipart/form-data' and request.content_length
+                and request.content_length > watermarker.max_request_bytes):
+            return jsonify({'error': f"Upload exceeds {watermarker.max_request_bytes // (1024 * 1024)} MB"}), 413
+        try:
+            processor = watermarker.get_processor(config_name)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        if not slots.acquire(timeout=queue_timeout):
+            return jsonify({'error': 'Too many concurrent requests'}), 503, {'Retry-After': '1'}
+
+        streaming = False
+        try:
+            if request.mimetype != 'multipart/form-data':
+                # Single raw image body
+                filename = request.args.get('filename', 'image')
+                try:
+                    data = _read_body(request.stream, watermarker.max_request_bytes)
+                    encoded, mimetype, filename = watermarker.watermark(
+                        processor, data, filename, output_format, quality, config_name)
+                except UploadTooLarge as e:
+                    return jsonify({'error': str(e)}), 413
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+                return Response(encoded, mimetype=mimetype, headers={
+                    'Content-Disposition': f'inline; filename="{_header_filename(filename)}"',
+                })
+
+            boundary = request.mimetype_params.get('boundary')
+            if not boundary:
+                return jsonify({'error': 'Missing multipart boundary'}), 400
+            response_boundary = uuid.uuid4().hex
+
+            def generate():
+                try:
+                    files = iter_uploaded_files(request.stream, boundary.encode('latin-1'),
+                                                watermarker.max_request_bytes)
+                    for filename, data in files:
+                        headers = [f'Content-Disposition: attachment; filename="{_header_filename(filename)}"']
+                        try:
+                            encoded, mimetype, out_name = watermarker.watermark(
+                                processor, data, filename, output_format, quality, config_name)
+                            headers = [f'Content-Type: {mimetype}',
+                                       f'Content-Disposition: attachment; filename="{_header_filename(out_name)}"',
+                                       'X-Status: 200']
+                        except (UploadTooLarge, ValueError) as e:
+                            status = 413 if isinstance(e, UploadTooLarge) else 400
+                            logger.warning(f"Cannot watermark upload {filename}: {e}")
+                            encoded = str(e).encode('utf-8')
+                            headers += ['Content-Type: text/plain; charset=utf-8', f'X-Status: {status}']
+                        # Drop the input before encoding the next part
+                        del data
+                        yield (f'--{response_boundary}\r\n' + '\r\n'.join(headers) + '\r\n\r\n').encode('latin-1')
+                        yield encoded
+                        yield b'\r\n'
+                except UploadTooLarge as e:
+                    # The remaining upload is discarded; report it as a last part
+                    yield (f'--{response_boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                           f'X-Status: 413\r\n\r\n{e}\r\n').encode('utf-8')
+                except ValueError as e:
+                    yield (f'--{response_boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n'
+                           f'X-Status: 400\r\n\r\nMalformed multipart body: {e}\r\n').encode('utf-8')
+                yield f'--{response_boundary}--\r\n'.encode('latin-1')
+
+            response = Response(stream_with_context(generate()),
+                                mimetype=f'multipart/mixed; boundary={response_boundary}')
+            # The slot is held until the whole response has been sent
+            response.call_on_close(slots.release)
+            streaming = True
+            return response
+        finally:
+            if not streaming:
+                slots.release()
+
+    return upload_api
@@ -6,11 +6,20 @@ Provides API endpoints to execute watermark processing commands
 
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import subprocess
 import os
 import json
 import logging
 from pathlib import Path
+import atexit
+import multiprocessing
+from k1_jobs import JobManager, SubprocessRunner, create_jobs_blueprint
+from k1_job_store import JobStore
+from k1_preview import create_preview_blueprint
+from k1_upload import create_upload_blueprint
+from k1_browse import create_browse_blueprint
+from k1_folder_index import create_validate_blueprint
+from k1_metrics import create_metrics_blueprint
+from k1_download import create_download_blueprint
 
 app = Flask(__name__, static_folder='.')
 CORS(app)
@@ -19,6 +28,40 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Processing runs as background jobs so request threads stay free; their worker
+# processes all come from one budget of CPU cores. Jobs are kept in a local
+# SQLite database across restarts; the debug reloader imports this module in its
+# watcher process too, and spawned worker processes import it as __mp_main__:
+# only the serving process opens the database.
+job_store = None
+if (multiprocessing.parent_process() is None
+        and (__name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')):
+    job_store = JobStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'k1_jobs.db'))
+    atexit.register(job_store.close)
+# Outputs of repeated runs are linked from a content-addressed cache
+output_cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'k1_output_cache')
+job_manager = JobManager(max_workers=4, runner=SubprocessRunner(output_cache=output_cache_dir),
+                         store=job_store)
+app.register_blueprint(create_jobs_blueprint(job_manager))
+
+# Live previews of a sample image while adjusting settings
+app.register_blueprint(create_preview_blueprint())
+
+# In-memory watermarking of uploaded images (bytes in, bytes out)
+app.register_blueprint(create_upload_blueprint())
+
+# Cached, paginated directory listings for the folder browser
+app.register_blueprint(create_browse_blueprint())
+
+# Path validation with per-subfolder image statistics (indexed in the background)
+app.register_blueprint(create_validate_blueprint())
+
+# Prometheus metrics measured by the workers (jobs, images, bytes, cache, utilization)
+app.register_blueprint(create_metrics_blueprint())
+
+# ZIP downloads of job outputs, streamed while the archive is built
+app.register_blueprint(create_download_blueprint(job_manager))
+
 @app.route('/')
 def index():
     """Serve the frontend HTML file."""
@@ -56,181 +99,6 @@ def get_configs():
     }
     return jsonify(configs)
 
-@app.route('/api/execute', methods=['POST'])
-def execute_command():
-    """Execute the watermark processing command."""
-    try:
-        data = request.json
-        
-        # Validate required fields
-        if not data.get('base_input') or not data.get('base_output') or not data.get('config'):
-            return jsonify({'error': 'Missing required fields: base_input, base_output, config'}), 400
-        
-        # Build command
-        cmd = ['py', 'k1_multi_folder.py']
-        cmd.extend(['--base-input', data['base_input']])
-        cmd.extend(['--base-output', data['base_output']])
-        cmd.extend(['--config', data['config']])
-        
-        # Add optional parameters
-        if data.get('parallel'):
-            cmd.extend(['--parallel', str(data['parallel'])])
-        
-        if data.get('dry_run'):
-            cmd.append('--dry-run')
-        
-        if data.get('verbose'):
-            cmd.append('--verbose')
-        
-        # Add custom settings if provided
-        custom_settings = data.get('custom_settings', {})
-        for key, value in custom_settings.items():
-            if value is not None and value != '':
-                # Convert camelCase to kebab-case
-                arg_name = key.replace('_', '-')
-                cmd.extend([f'--{arg_name}', str(value)])
-        
-        logger.info(f"Executing command: {' '.join(cmd)}")
-        
-        # Execute command
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=os.getcwd()
-        )
-        
-        # Read output in real-time
-        output_lines = []
-        error_lines = []
-        
-        # Read stdout
-        for line in process.stdout:
-            output_lines.append(line.strip())
-            logger.info(f"STDOUT: {line.strip()}")
-        
-        # Read stderr
-        for line in process.stderr:
-            error_lines.append(line.strip())
-            logger.warning(f"STDERR: {line.strip()}")
-        
-        # Wait for process to complete
-        return_code = process.wait()
-        
-        return jsonify({
-            'success': return_code == 0,
-            'return_code': return_code,
-            'output': '\n'.join(output_lines),
-            'errors': '\n'.join(error_lines),
-            'command': ' '.join(cmd)
-        })
-        
-    except Exception as e:
-        logger.error(f"Error executing command: {e}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/validate', methods=['POST'])
-def validate_paths():
-    """Validate input and output paths."""
-    try:
-        data = request.json
-        base_input = data.get('base_input', '')
-        base_output = data.get('base_output', '')
-        
-        results = {
-            'base_input': {
-                'exists': os.path.exists(base_input) if base_input else False,
-                'is_dir': os.path.isdir(base_input) if base_input and os.path.exists(base_input) else False
-            },
-            'base_output': {
-                'exists': os.path.exists(base_output) if base_output else False,
-                'is_dir': os.path.isdir(base_output) if base_output and os.path.exists(base_output) else False,
-                'can_create': True  # We can always try to create
-            }
-        }
-        
-        # Check if input folder has subfolders
-        if results['base_input']['is_dir']:
-            try:
-                subfolders = [f for f in os.listdir(base_input) if os.path.isdir(os.path.join(base_input, f))]
-                results['base_input']['subfolders'] = subfolders
-                results['base_input']['subfolder_count'] = len(subfolders)
-            except Exception as e:
-                results['base_input']['error'] = str(e)
-        
-        return jsonify(results)
-        
-    except Exception as e:
-        logger.error(f"Error validating paths: {e}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/browse', methods=['POST'])
-def browse_directory():
-    """Browse directory and return folders."""
-    try:
-        data = request.json
-        folder_path = data.get('folder_path', '')
-        
-        # If no path provided, start from current directory
-        if not folder_path:
-            folder_path = os.getcwd()
-        
-        # Normalize the path
-        folder_path = os.path.normpath(folder_path)
-        
-        # Check if path exists and is a directory
-        if not os.path.exists(folder_path):
-            return jsonify({'error': 'Path does not exist'}), 400
-        
-        if not os.path.isdir(folder_path):
-            return jsonify({'error': 'Path is not a directory'}), 400
-        
-        # Get all items in directory
-        try:
-            items = os.listdir(folder_path)
-            folders = []
-            files = []
-            
-            for item in items:
-                item_path = os.path.join(folder_path, item)
-                try:
-                    if os.path.isdir(item_path):
-                        folders.append(item)
-                    else:
-                        files.append(item)
-                except (PermissionError, OSError):
-                    continue
-            
-            folders.sort()
-            files.sort()
-            
-            # Get parent directory
-            parent_dir = os.path.dirname(folder_path) if folder_path != os.path.dirname(folder_path) else None
-            
-            # Get folder name
-            folder_name = os.path.basename(folder_path) if folder_path != os.path.dirname(folder_path) else folder_path
-            
-            return jsonify({
-                'folder_name': folder_name,
-                'full_path': folder_path,
-                'parent_dir': parent_dir,
-                'folders': folders,
-                'files': files[:10],  # Limit files for performance
-                'folder_count': len(folders),
-                'file_count': len(files)
-            })
-            
-        except PermissionError as e:
-            return jsonify({'error': f'Permission denied: {str(e)}'}), 403
-        except Exception as e:
-            logger.error(f"Error listing directory: {e}")
-            return jsonify({'error': str(e)}), 500
-        
-    except Exception as e:
-        logger.error(f"Error browsing directory: {e}")
-        return jsonify({'error': str(e)}), 500
-
 @app.route('/api/get-folder-name', methods=['POST'])
 def get_folder_name():
     """Get folder name from full path."""
@@ -266,5 +134,10 @@ def get_folder_name():
 if __name__ == '__main__':
     print("Starting K1 Watermark Frontend Server...")
     print("Open your browser and navigate to: http://localhost:5000")
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    try:
+        app.run(debug=True, host='0.0.0.0', port=5000)
+    finally:
+        # Job processes run in their own process groups: stop them with the server
+        job_manager.shutdown(wait=False)
+        job_manager.runner.shutdown()
 
@@ -2,16 +2,34 @@
 """
 Production Flask server for K1 Watermark Frontend
 Uses Waitress WSGI server for production deployment
+
+Environment overrides (e.g. for load tests with k1_loadtest.py):
+  K1_PORT      Port to listen on (default: 5000)
+  K1_THREADS   Waitress request threads (default: 8)
+  K1_WORKERS   Worker processes shared by all jobs (default: CPU count)
+  K1_DATA_DIR  Folder of the job database and output cache (default: next to this file)
+  K1_MEMORY_BUDGET  Memory in GB for the images decoded by all workers together (default: no limit)
+  K1_IMAGE_TIMEOUT  Seconds an image may take before it is quarantined (default: 600)
+  K1_MAX_PIXELS     Largest image in megapixels (default: Pillow's decompression bomb limit)
 """
 
 from flask import Flask, request, jsonify, send_from_directory
 from flask_cors import CORS
-import subprocess
 import os
 import json
 import logging
+import atexit
+import multiprocessing
 import socket
 from pathlib import Path
+from k1_jobs import JobManager, WarmPoolRunner, WorkerBudget, create_jobs_blueprint
+from k1_job_store import JobStore
+from k1_preview import create_preview_blueprint
+from k1_upload import create_upload_blueprint
+from k1_browse import create_browse_blueprint
+from k1_folder_index import create_validate_blueprint
+from k1_metrics import create_metrics_blueprint
+from k1_download import create_download_blueprint
 from waitress import serve
 
 app = Flask(__name__, static_folder='.')
@@ -24,6 +42,60 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+data_dir = os.environ.get('K1_DATA_DIR') or os.path.dirname(os.path.abspath(__file__))
+workers = int(os.environ.get('K1_WORKERS') or 0) or None
+memory_budget = float(os.environ.get('K1_MEMORY_BUDGET') or 0) or None
+image_timeout = float(os.environ.get('K1_IMAGE_TIMEOUT') or 600)
+max_pixels = float(os.environ.get('K1_MAX_PIXELS') or 0) or None
+
+# Processing runs as background jobs so request threads stay free; jobs with the
+# standard configurations go to a pre-started pool of warm worker processes.
+# All jobs together never use more worker processes than there are CPU cores;
+# jobs on the warm pool share its workers fairly, so more of them can run at once.
+# Jobs are kept in a local SQLite database: after a restart queued and interrupted
+# jobs run again and finished jobs stay queryable.
+# Worker processes started with spawn (Windows) import this module again as
+# __mp_main__: only the serving process opens the database and runs jobs.
+warm_runner = None
+job_manager = None
+if multiprocessing.parent_process() is None:
+    worker_budget = WorkerBudget(workers)
+    # Outputs of repeated runs are linked from a content-addressed cache instead of processed.
+    output_cache_dir = os.path.join(data_dir, 'k1_output_cache')
+    # Huge scans wait for memory instead of being decoded all at once (K1_MEMORY_BUDGET).
+    # Images that stall or crash a worker are quarantined and the worker is replaced.
+    warm_runner = WarmPoolRunner(workers=workers, budget=worker_budget, output_cache=output_cache_dir,
+                                 memory_budget=memory_budget, image_timeout=image_timeout,
+                                 max_pixels=max_pixels)
+    # Started here rather than under __main__ so WSGI hosts importing `app` get the pool too
+    # (jobs run as subprocesses until it is ready)
+    warm_runner.start()
+    job_store = JobStore(os.path.join(data_dir, 'k1_jobs.db'))
+    # atexit runs in reverse: jobs stop first, then the pool, then the database closes
+    atexit.register(job_store.close)
+    atexit.register(warm_runner.shutdown)
+    job_manager = JobManager(max_workers=8, runner=warm_runner, budget=worker_budget, store=job_store)
+    atexit.register(job_manager.shutdown, wait=False)
+    app.register_blueprint(create_jobs_blueprint(job_manager))
+    
+    # ZIP downloads of job outputs, streamed while the archive is built
+    app.register_blueprint(create_download_blueprint(job_manager))
+
+# Live previews of a sample image while adjusting settings
+app.register_blueprint(create_preview_blueprint())
+
+# In-memory watermarking of uploaded images (bytes in, bytes out)
+app.register_blueprint(create_upload_blueprint())
+
+# Cached, paginated directory listings for the folder browser
+app.register_blueprint(create_browse_blueprint())
+
+# Path validation with per-subfolder image statistics (indexed in the background)
+app.register_blueprint(create_validate_blueprint())
+
+# Prometheus metrics measured by the workers (jobs, images, bytes, cache, utilization)
+app.register_blueprint(create_metrics_blueprint())
+
 def get_lan_ip():
     """Get the local network IP address."""
     try:
@@ -140,181 +212,6 @@ def get_configs():
     }
     return jsonify(configs)
 
-@app.route('/api/execute', methods=['POST'])
-def execute_command():
-    """Execute the watermark processing command."""
-    try:
-        data = request.json
-        
-        # Validate required fields
-        if not data.get('base_input') or not data.get('base_output') or not data.get('config'):
-            return jsonify({'error': 'Missing required fields: base_input, base_output, config'}), 400
-        
-        # Build command
-        cmd = ['py', 'k1_multi_folder.py']
-        cmd.extend(['--base-input', data['base_input']])
-        cmd.extend(['--base-output', data['base_output']])
-        cmd.extend(['--config', data['config']])
-        
-        # Add optional parameters
-        if data.get('parallel'):
-            cmd.extend(['--parallel', str(data['parallel'])])
-        
-        if data.get('dry_run'):
-            cmd.append('--dry-run')
-        
-        if data.get('verbose'):
-            cmd.append('--verbose')
-        
-        # Add custom settings if provided
-        custom_settings = data.get('custom_settings', {})
-        for key, value in custom_settings.items():
-            if value is not None and value != '':
-                # Convert camelCase to kebab-case
-                arg_name = key.replace('_', '-')
-                cmd.extend([f'--{arg_name}', str(value)])
-        
-        logger.info(f"Executing command: {' '.join(cmd)}")
-        
-        # Execute command
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            cwd=os.getcwd()
-        )
-        
-        # Read output in real-time
-        output_lines = []
-        error_lines = []
-        
-        # Read stdout
-        for line in process.stdout:
-            output_lines.append(line.strip())
-            logger.info(f"STDOUT: {line.strip()}")
-        
-        # Read stderr
-        for line in process.stderr:
-            error_lines.append(line.strip())
-            logger.warning(f"STDERR: {line.strip()}")
-        
-        # Wait for process to complete
-        return_code = process.wait()
-        
-        return jsonify({
-            'success': return_code == 0,
-            'return_code': return_code,
-            'output': '\n'.join(output_lines),
-            'errors': '\n'.join(error_lines),
-            'command': ' '.join(cmd)
-        })
-        
-    except Exception as e:
-        logger.error(f"Error executing command: {e}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/validate', methods=['POST'])
-def validate_paths():
-    """Validate input and output paths."""
-    try:
-        data = request.json
-        base_input = data.get('base_input', '')
-        base_output = data.get('base_output', '')
-        
-        results = {
-            'base_input': {
-                'exists': os.path.exists(base_input) if base_input else False,
-                'is_dir': os.path.isdir(base_input) if base_input and os.path.exists(base_input) else False
-            },
-            'base_output': {
-                'exists': os.path.exists(base_output) if base_output else False,
-                'is_dir': os.path.isdir(base_output) if base_output and os.path.exists(base_output) else False,
-                'can_create': True  # We can always try to create
-            }
-        }
-        
-        # Check if input folder has subfolders
-        if results['base_input']['is_dir']:
-            try:
-                subfolders = [f for f in os.listdir(base_input) if os.path.isdir(os.path.join(base_input, f))]
-                results['base_input']['subfolders'] = subfolders
-                results['base_input']['subfolder_count'] = len(subfolders)
-            except Exception as e:
-                results['base_input']['error'] = str(e)
-        
-        return jsonify(results)
-        
-    except Exception as e:
-        logger.error(f"Error validating paths: {e}")
-        return jsonify({'error': str(e)}), 500
-
-@app.route('/api/browse', methods=['POST'])
-def browse_directory():
-    """Browse directory and return folders."""
-    try:
-        data = request.json
-        folder_path = data.get('folder_path', '')
-        
-        # If no path provided, start from current directory
-        if not folder_path:
-            folder_path = os.getcwd()
-        
-        # Normalize the path
-        folder_path = os.path.normpath(folder_path)
-        
-        # Check if path exists and is a directory
-        if not os.path.exists(folder_path):
-            return jsonify({'error': 'Path does not exist'}), 400
-        
-        if not os.path.isdir(folder_path):
-            return jsonify({'error': 'Path is not a directory'}), 400
-        
-        # Get all items in directory
-        try:
-            items = os.listdir(folder_path)
-            folders = []
-            files = []
-            
-            for item in items:
-                item_path = os.path.join(folder_path, item)
-                try:
-                    if os.path.isdir(item_path):
-                        folders.append(item)
-                    else:
-                        files.append(item)
-                except (PermissionError, OSError):
-                    continue
-            
-            folders.sort()
-            files.sort()
-            
-            # Get parent directory
-            parent_dir = os.path.dirname(folder_path) if folder_path != os.path.dirname(folder_path) else None
-            
-            # Get folder name
-            folder_name = os.path.basename(folder_path) if folder_path != os.path.dirname(folder_path) else folder_path
-            
-            return jsonify({
-                'folder_name': folder_name,
-                'full_path': folder_path,
-                'parent_dir': parent_dir,
-                'folders': folders,
-                'files': files[:10],  # Limit files for performance
-                'folder_count': len(folders),
-                'file_count': len(files)
-            })
-            
-        except PermissionError as e:
-            return jsonify({'error': f'Permission denied: {str(e)}'}), 403
-        except Exception as e:
-            logger.error(f"Error listing directory: {e}")
-            return jsonify({'error': str(e)}), 500
-        
-    except Exception as e:
-        logger.error(f"Error browsing directory: {e}")
-        return jsonify({'error': str(e)}), 500
-
 @app.route('/api/get-folder-name', methods=['POST'])
 def get_folder_name():
     """Get folder name from full path."""
@@ -348,7 +245,7 @@ def get_folder_name():
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    port = 5000
+    port = int(os.environ.get('K1_PORT') or 5000)
     lan_ip = get_lan_ip()
     
     print("=" * 60)
@@ -365,5 +262,12 @@ if __name__ == '__main__':
     
     # Serve using Waitress production server
     # host='0.0.0.0' makes it accessible on all network interfaces
-    serve(app, host='0.0.0.0', port=port, threads=4)
+    try:
+        # Extra threads leave room for the job event streams next to regular requests
+        serve(app, host='0.0.0.0', port=port, threads=int(os.environ.get('K1_THREADS') or 8))
+    finally:
+        # Job processes run in their own process groups: stop them with the server
+        # (the atexit handlers then find everything stopped)
+        job_manager.shutdown(wait=False)
+        warm_runner.shutdown()
 
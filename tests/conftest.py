@@ -0,0 +1,41 @@
+"""Test configuration: the modules under test live in the repository root."""
+
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configurations that render with the default font (no Google Fonts download)
+OFFLINE_CONFIGS = {
+    'plain': {'custom_text': 'k1', 'margin': '5'},
+    'corner': {'custom_text': 'k1', 'custom_text_position': 'top-left', 'margin': '5'},
+}
+
+@pytest.fixture
+def offline_configs(monkeypatch):
+    """Give every K1MultiFolderProcessor the offline configurations."""
+    from k1_multi_folder import K1MultiFolderProcessor
+    monkeypatch.setattr(K1MultiFolderProcessor, '_load_configurations',
+                        lambda self: {name: dict(config) for name, config in OFFLINE_CONFIGS.items()})
+
+@pytest.fixture
+def k1_processor(offline_configs):
+    """K1MultiFolderProcessor with the offline configurations."""
+    from k1_multi_folder import K1MultiFolderProcessor
+    return K1MultiFolderProcessor()
+
+@pytest.fixture
+def make_images():
+    """Create images: make_images(folder, {'name.jpg': (width, height), ...}) -> list of paths."""
+    def make(folder, sizes):
+        os.makedirs(folder, exist_ok=True)
+        paths = []
+        for name, size in sizes.items():
+            path = os.path.join(folder, name)
+            Image.new('RGB', size, 'gray').save(path)
+            paths.append(path)
+        return paths
+    return make
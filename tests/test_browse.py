@@ -0,0 +1,86 @@
+"""
+Tests for the cached, paginated directory browser (/api/browse).
+"""
+
+import os
+import time
+
+import pytest
+from flask import Flask
+
+from k1_browse import DirectoryListingCache, create_browse_blueprint
+
+def settle(folder):
+    """Date a folder back so its listing is trusted by the cache."""
+    old = time.time() - 60
+    os.utime(folder, (old, old))
+
+@pytest.fixture
+def browse(tmp_path):
+    for name in ('b', 'a', 'c'):
+        (tmp_path / name).mkdir()
+    for name in ('2.jpg', 'notes.txt', '1.png'):
+        (tmp_path / name).write_bytes(b'')
+    settle(tmp_path)
+    cache = DirectoryListingCache()
+    app = Flask(__name__)
+    app.register_blueprint(create_browse_blueprint(cache))
+    client = app.test_client()
+
+    def post(**data):
+        return client.post('/api/browse', json=dict({'folder_path': str(tmp_path)}, **data))
+    return post, cache
+
+def test_pages_follow_the_cursor_folders_first(browse):
+    post, _ = browse
+    pages = []
+    cursor = None
+    while True:
+        page = post(limit=2, cursor=cursor).get_json()
+        pages.append((page['folders'], page['files']))
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert pages == [(['a', 'b'], []), (['c'], ['1.png']), ([], ['2.jpg', 'notes.txt'])]
+    assert page['folder_count'] == 3 and page['file_count'] == 3 and page['image_count'] == 2
+    images = post(kind='files', images_only=True).get_json()
+    assert images['folders'] == [] and images['files'] == ['1.png', '2.jpg']
+
+def test_listing_is_cached_until_the_folder_changes(tmp_path, browse, monkeypatch):
+    post, cache = browse
+    assert post().get_json()['cached'] is False
+
+    stats = []
+    real_stat = os.stat
+    monkeypatch.setattr(os, 'stat', lambda *args, **kwargs: stats.append(args[0]) or real_stat(*args, **kwargs))
+    assert post().get_json()['cached'] is True
+    monkeypatch.undo()
+    assert stats == [str(tmp_path)]
+
+    (tmp_path / '3.jpg').write_bytes(b'')
+    page = post().get_json()
+    assert page['cached'] is False and '3.jpg' in page['files']
+    assert (cache.hits, cache.misses) == (1, 2)
+
+def test_bad_paths_are_refused(tmp_path, browse):
+    post, _ = browse
+    assert post(folder_path=str(tmp_path / 'missing')).status_code == 400
+    assert post(folder_path=str(tmp_path / 'notes.txt')).get_json()['error'] == 'Path is not a directory'
+    assert post(kind='everything').status_code == 400
+    assert post(cursor='x:1').status_code == 400
+
+def test_failed_scan_is_not_left_building(tmp_path, monkeypatch):
+    settle(tmp_path)
+    cache = DirectoryListingCache()
+    real_scan = cache._scan
+    def failing_scan(folder_path, mtime_ns):
+        raise PermissionError(folder_path)
+    monkeypatch.setattr(cache, '_scan', failing_scan)
+    with pytest.raises(PermissionError):
+        cache.get(str(tmp_path))
+    assert cache._building == {}
+
+    monkeypatch.setattr(cache, '_scan', real_scan)
+    listing, cached = cache.get(str(tmp_path))
+    assert not cached and listing.folders == [] and listing.files == []
@@ -0,0 +1,61 @@
+"""
+Tests for watermarking in memory (bytes, file objects and decoded images).
+"""
+
+import io
+
+import pytest
+from PIL import Image
+
+@pytest.fixture
+def processor(k1_processor):
+    return k1_processor.get_watermark_processor('plain')
+
+@pytest.fixture
+def sample(tmp_path, make_images):
+    path, = make_images(tmp_path / 'input', {'IMG_0042.png': (400, 300)})
+    return path
+
+def test_every_source_gives_the_file_output(tmp_path, processor, sample):
+    output = tmp_path / 'IMG_0042.png'
+    assert processor.process_image(sample, str(output))
+    with Image.open(output) as written:
+        expected = written.convert('RGBA').tobytes()
+
+    with open(sample, 'rb') as f:
+        data = f.read()
+    with open(sample, 'rb') as f:
+        from_file = processor.watermark_image(f)
+    with Image.open(sample) as decoded:
+        from_image = processor.watermark_image(decoded, 'IMG_0042.png')
+    from_bytes = processor.watermark_image(data, 'IMG_0042.png')
+
+    for image in (from_bytes, from_file, from_image):
+        assert image.mode == 'RGBA' and image.tobytes() == expected
+
+def test_decoded_image_is_left_untouched(processor, sample):
+    with Image.open(sample) as decoded:
+        decoded.load()
+        before = decoded.tobytes()
+        processor.watermark_image(decoded, 'IMG_0042.png')
+        assert decoded.tobytes() == before
+
+def test_watermark_bytes_encodes_the_requested_format(processor, sample):
+    with open(sample, 'rb') as f:
+        data = f.read()
+
+    jpeg = processor.watermark_bytes(data, 'jpg', 'IMG_0042.png', quality=80)
+    webp = processor.watermark_bytes(data, 'WEBP', 'IMG_0042.png')
+
+    with Image.open(io.BytesIO(jpeg)) as result:
+        assert result.format == 'JPEG' and result.mode == 'RGB' and result.size == (400, 300)
+    with Image.open(io.BytesIO(webp)) as result:
+        assert result.format == 'WEBP'
+    # Encoder options override the defaults
+    assert len(processor.watermark_bytes(data, 'JPEG', 'IMG_0042.png', quality=20)) < len(jpeg)
+
+def test_unsupported_sources_are_refused(processor):
+    with pytest.raises(ValueError):
+        processor.watermark_image('IMG_0042.png')
+    with pytest.raises(Image.UnidentifiedImageError):
+        processor.watermark_image(b'not an image')
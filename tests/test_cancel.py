@@ -0,0 +1,169 @@
+"""
+Tests for cancelling images and jobs: pool futures stop their images, and a
+cancelled subprocess job only removes its own partial outputs.
+
+Pool workers inherit a replaced process_image_fanout when they are forked, so
+the pool tests need the fork start method.
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+import watermark_pool
+from k1_jobs import Job, SubprocessRunner
+from watermark_pool import FairShareScheduler, WatermarkProcessPool
+from watermark_script import PARTIAL_SUFFIX, WatermarkProcessor
+
+fork_only = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                               reason="workers must inherit the patched module")
+
+def wait_until(condition, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.05)
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    """
+    Workers log the images they start, hang on hang*.jpg (after writing a
+    partial output) and take a second for slow*.jpg.
+    """
+    started_log = tmp_path / 'started.log'
+    real = watermark_pool.process_image_fanout
+
+    def process_image_fanout(input_path, output_paths, processors, stats=None, output_cache=None):
+        name = os.path.basename(input_path)
+        with open(started_log, 'a') as f:
+            f.write(name + '\n')
+        if name.startswith('hang'):
+            for output_path in output_paths.values():
+                with open(f"{output_path}.{os.getpid()}{PARTIAL_SUFFIX}", 'wb') as f:
+                    f.write(b'partial')
+            time.sleep(60)
+        if name.startswith('slow'):
+            time.sleep(1)
+        return real(input_path, output_paths, processors, stats, output_cache)
+
+    monkeypatch.setattr(watermark_pool, 'process_image_fanout', process_image_fanout)
+    (tmp_path / 'input').mkdir()
+    (tmp_path / 'output').mkdir()
+
+    def make(*names):
+        for name in names:
+            Image.new('RGB', (64, 48), 'gray').save(tmp_path / 'input' / name)
+        return lambda name: (str(tmp_path / 'input' / name), {'k1': str(tmp_path / 'output' / name)})
+
+    def started():
+        return started_log.read_text().split() if started_log.exists() else []
+    return make, started
+
+def is_running(pool, name):
+    with pool._lock:
+        return any(task.started is not None and task.input_path.endswith(name) for task in pool._running.values())
+
+@fork_only
+def test_cancelling_a_running_image_kills_its_worker(tmp_path, images):
+    make, started = images
+    paths = make('hang.jpg', 'slow.jpg')
+    pool = WatermarkProcessPool({'k1': WatermarkProcessor(custom_text='k1')}, 2)
+    began = time.time()
+    try:
+        hanging = pool.submit(*paths('hang.jpg'))
+        slow = pool.submit(*paths('slow.jpg'))
+        wait_until(lambda: is_running(pool, 'hang.jpg') and is_running(pool, 'slow.jpg'))
+
+        assert hanging.cancel()
+        # The other image of the killed generation is processed again
+        assert slow.result(timeout=30) == {'k1': True}
+        assert hanging.cancelled()
+    finally:
+        pool.shutdown()
+
+    assert time.time() - began < 30
+    assert started().count('slow.jpg') == 2
+    # Neither an output nor the partial file of the killed worker remains
+    assert os.listdir(tmp_path / 'output') == ['slow.jpg']
+
+@fork_only
+def test_cancelled_image_is_never_started(tmp_path, images):
+    make, started = images
+    paths = make('slow.jpg', 'hang.jpg')
+    pool = WatermarkProcessPool({'k1': WatermarkProcessor(custom_text='k1')}, 1)
+    try:
+        slow = pool.submit(*paths('slow.jpg'))
+        queued = pool.submit(*paths('hang.jpg'))
+        wait_until(lambda: is_running(pool, 'slow.jpg'))
+
+        # Already handed to the worker, which skips it
+        assert queued.cancel()
+        assert slow.result(timeout=30) == {'k1': True}
+    finally:
+        pool.shutdown()
+
+    assert started() == ['slow.jpg']
+    assert os.listdir(tmp_path / 'output') == ['slow.jpg']
+
+@fork_only
+def test_cancelling_a_scheduled_image_stops_it_in_the_pool(tmp_path, images):
+    make, started = images
+    paths = make('hang.jpg')
+    pool = WatermarkProcessPool({'k1': WatermarkProcessor(custom_text='k1')}, 1)
+    scheduler = FairShareScheduler(pool)
+    began = time.time()
+    try:
+        with scheduler.client('job') as client:
+            future = client.submit(*paths('hang.jpg'))
+            wait_until(lambda: is_running(pool, 'hang.jpg'))
+            assert future.cancel()
+            wait_until(lambda: scheduler.stats['busy'] == 0)
+    finally:
+        scheduler.shutdown()
+        pool.shutdown()
+
+    assert time.time() - began < 30
+    assert os.listdir(tmp_path / 'output') == []
+
+JOB_SCRIPT = """
+import os, subprocess, sys, time
+folder = sys.argv[1]
+def write_partial():
+    with open(os.path.join(folder, f"a.jpg.{os.getpid()}.part"), "w") as f:
+        f.write("partial")
+if len(sys.argv) > 2:
+    write_partial()
+    time.sleep(60)
+subprocess.Popen([sys.executable, __file__, folder, "worker"])
+write_partial()
+print("started", flush=True)
+time.sleep(60)
+"""
+
+def test_cancelled_subprocess_job_removes_only_its_own_partial_files(tmp_path):
+    (tmp_path / 'input' / 'set').mkdir(parents=True)
+    output_folder = tmp_path / 'output' / 'set_plain'
+    output_folder.mkdir(parents=True)
+    # Written by another job into the same folder
+    other_partial = output_folder / f"b.jpg.{os.getpid()}{PARTIAL_SUFFIX}"
+    other_partial.write_text('partial')
+    script = tmp_path / 'job.py'
+    script.write_text(JOB_SCRIPT)
+
+    job = Job('job', [sys.executable, str(script), str(output_folder)],
+              {'base_input': str(tmp_path / 'input'), 'base_output': str(tmp_path / 'output'), 'config': 'plain'})
+    runner = SubprocessRunner(cwd=str(tmp_path), stop_timeout=0.5)
+    thread = threading.Thread(target=runner.run, args=(job,), daemon=True)
+    thread.start()
+    wait_until(lambda: len(list(output_folder.glob('a.jpg.*.part'))) == 2)
+
+    job.cancel('test')
+    thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert os.listdir(output_folder) == [other_partial.name]
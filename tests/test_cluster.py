@@ -0,0 +1,74 @@
+"""
+Tests for the leases of the K1 cluster work queue and the coordinator's wait.
+"""
+
+import threading
+import time
+
+from k1_cluster import WorkQueue, run_coordinator
+from k1_multi_folder import WorkItem
+
+def publish(queue, tmp_path, names):
+    items = [WorkItem('set', str(tmp_path / 'set' / name), ('plain',), cost)
+             for cost, name in enumerate(names, 1)]
+    queue.publish({'config_names': ['plain']}, items, str(tmp_path))
+
+def test_expired_lease_is_delivered_to_the_next_worker(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=0.2, max_attempts=2)
+    publish(queue, tmp_path, ['small.jpg', 'large.jpg'])
+
+    first = queue.claim('worker-1')
+    assert first['image'].endswith('large.jpg') and first['attempt'] == 1
+    time.sleep(0.3)
+    queue.expire()
+    assert queue.counts() == {'pending': 2}
+
+    again = queue.claim('worker-2')
+    assert again['id'] == first['id'] and again['attempt'] == 2
+    # The first worker's lease is gone, its late result is not taken
+    assert not queue.ack(first['id'], 'worker-1', {'plain': True})
+    assert queue.ack(again['id'], 'worker-2', {'plain': True})
+
+    # An item whose workers keep dying fails after max_attempts deliveries
+    for attempt in (1, 2):
+        assert queue.claim('worker-3')['attempt'] == attempt
+        time.sleep(0.3)
+        queue.expire()
+    assert queue.counts() == {'done': 1, 'failed': 1}
+    assert queue.results() == {'plain': {'set': False}}
+    queue.close()
+
+def test_live_lease_is_not_delivered_twice(tmp_path):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), lease_seconds=30)
+    publish(queue, tmp_path, ['only.jpg'])
+
+    leased = queue.claim('worker-1')
+    queue.expire()
+    assert queue.claim('worker-2') is None
+    assert queue.renew(leased['id'], 'worker-1')
+    assert not queue.renew(leased['id'], 'worker-2')
+    assert queue.ack(leased['id'], 'worker-1', {'plain': True})
+    assert queue.results() == {'plain': {'set': True}}
+    queue.close()
+
+def test_coordinator_finishes_when_the_last_worker_dies_holding_a_lease(tmp_path, make_images):
+    base_input = tmp_path / 'input'
+    make_images(base_input / 'set', {'a.jpg': (40, 30), 'b.jpg': (30, 20)})
+    queue_path = str(tmp_path / 'queue.db')
+    results = []
+    coordinator = threading.Thread(target=lambda: results.append(run_coordinator(
+        queue_path, str(base_input), str(tmp_path / 'output'), ['final_v2'],
+        lease_seconds=0.5, max_attempts=5, poll_interval=0.1, idle_timeout=1.0)), daemon=True)
+    coordinator.start()
+
+    # A worker leases an item, then dies without renewing or acknowledging it
+    worker = WorkQueue(queue_path, lease_seconds=0.5)
+    deadline = time.time() + 10
+    while not worker.get_meta() and time.time() < deadline:
+        time.sleep(0.05)
+    assert worker.claim('dead-worker') is not None
+    worker.close()
+
+    coordinator.join(timeout=15)
+    assert not coordinator.is_alive(), "coordinator still waiting for the dead worker"
+    assert results == [{'final_v2': {'set': False}}]
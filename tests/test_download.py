@@ -0,0 +1,95 @@
+"""
+Tests for the ZIP download of a job's outputs.
+"""
+
+import io
+import os
+import threading
+import time
+import zipfile
+
+from flask import Flask
+
+from k1_download import create_download_blueprint, stream_job_zip
+from k1_jobs import Job, JobManager
+from watermark_script import PARTIAL_SUFFIX
+
+REQUEST = {'base_input': 'input', 'base_output': 'output', 'config': 'plain'}
+
+class WritingRunner:
+    """Writes one output per folder, the second one once released."""
+
+    def __init__(self, output):
+        self.output = output
+        self.release = threading.Event()
+
+    def requested_workers(self, job):
+        return 1
+
+    def run(self, job):
+        (self.output / 'a_plain' / '1.jpg').write_bytes(b'first')
+        self.release.wait(10)
+        (self.output / 'b_plain' / '2.jpg').write_bytes(b'second')
+        return 0
+
+def make_folders(tmp_path):
+    for name in ('a', 'b', 'empty'):
+        (tmp_path / 'input' / name).mkdir(parents=True)
+    for name in ('a', 'b'):
+        (tmp_path / 'output' / f"{name}_plain").mkdir(parents=True)
+    # Another configuration's output folder is not part of the job
+    (tmp_path / 'output' / 'a_corner').mkdir()
+    (tmp_path / 'output' / 'a_corner' / '1.jpg').write_bytes(b'other')
+    return tmp_path / 'output'
+
+def test_download_contains_only_what_the_job_wrote(tmp_path):
+    output = make_folders(tmp_path)
+    # Left by an earlier run
+    stale = output / 'a_plain' / 'old.jpg'
+    stale.write_bytes(b'stale')
+    os.utime(stale, (time.time() - 3600, time.time() - 3600))
+    (output / 'a_plain' / f"3.jpg.123{PARTIAL_SUFFIX}").write_bytes(b'partial')
+    (output / '.k1_journal.jsonl').write_text('{}')
+
+    runner = WritingRunner(output)
+    runner.release.set()
+    manager = JobManager(max_workers=1, runner=runner)
+    try:
+        job = manager.submit(['k1'], dict(REQUEST))
+        app = Flask(__name__)
+        # Relative job paths resolve against the folder the runner works in
+        app.register_blueprint(create_download_blueprint(manager, cwd=str(tmp_path)))
+        client = app.test_client()
+
+        response = client.get(f'/api/jobs/{job.id}/download')
+        assert response.status_code == 200
+        assert response.headers['Content-Disposition'] == f'attachment; filename="k1_job_{job.id}.zip"'
+        with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+            assert sorted(archive.namelist()) == ['a_plain/1.jpg', 'b_plain/2.jpg']
+            assert archive.read('b_plain/2.jpg') == b'second'
+            assert archive.getinfo('a_plain/1.jpg').compress_type == zipfile.ZIP_STORED
+
+        assert client.get('/api/jobs/unknown/download').status_code == 404
+    finally:
+        manager.shutdown()
+
+def test_running_job_streams_outputs_as_they_appear(tmp_path):
+    output = make_folders(tmp_path)
+    runner = WritingRunner(output)
+    job = Job('job', ['k1'], dict(REQUEST))
+    job.set_status('running')
+    thread = threading.Thread(target=lambda: (runner.run(job), job.set_status('succeeded', 0)), daemon=True)
+    thread.start()
+
+    chunks = []
+    stream = stream_job_zip(job, scan_interval=0.05, cwd=str(tmp_path))
+    # The first output is sent while the job is still running
+    while b'first' not in b''.join(chunks):
+        chunks.append(next(stream))
+    assert not job.finished
+    runner.release.set()
+    chunks.extend(stream)
+    thread.join(timeout=10)
+
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.namelist() == ['a_plain/1.jpg', 'b_plain/2.jpg']
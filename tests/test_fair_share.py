@@ -0,0 +1,114 @@
+"""
+Tests for the FairShareScheduler and the WorkerBudget it takes workers from.
+
+The scheduler runs on a stand-in pool whose images only finish when a test
+resolves them, so the dispatch order is deterministic.
+"""
+
+import concurrent.futures
+import queue
+import threading
+import time
+
+from k1_jobs import WorkerBudget
+from watermark_pool import FairShareScheduler
+
+class FakePool:
+    """Stands in for a WatermarkProcessPool: records dispatched images, finishes them on request."""
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.dispatched = queue.Queue()
+
+    def submit(self, input_path, output_paths, on_stats=None, memory=None):
+        future = concurrent.futures.Future()
+        self.dispatched.put((input_path, future))
+        return future
+
+    def next_image(self):
+        """Wait for the next dispatched image; returns (input_path, future)."""
+        return self.dispatched.get(timeout=5)
+
+    def finish_next(self) -> str:
+        """Finish the next dispatched image and return its path."""
+        input_path, future = self.next_image()
+        future.set_result({})
+        return input_path
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.01)
+
+def test_flows_are_dispatched_by_weight():
+    pool = FakePool(workers=1)
+    scheduler = FairShareScheduler(pool)
+    try:
+        # Occupy the only worker so both flows are queued before anything is dispatched
+        scheduler.client('blocker').submit('blocker.jpg', {})
+        _, blocker = pool.next_image()
+        heavy = scheduler.client('heavy', weight=2.0)
+        light = scheduler.client('light', weight=1.0)
+        for i in range(6):
+            heavy.submit(f'heavy-{i}.jpg', {})
+            light.submit(f'light-{i}.jpg', {})
+        blocker.set_result({})
+
+        order = [pool.finish_next() for _ in range(9)]
+        assert sum(path.startswith('heavy') for path in order) == 6
+        assert sum(path.startswith('light') for path in order) == 3
+    finally:
+        scheduler.shutdown()
+
+def test_worker_is_handed_back_while_a_job_waits():
+    budget = WorkerBudget(2)
+    pool = FakePool(workers=2)
+    scheduler = FairShareScheduler(pool, budget, poll_interval=0.01)
+    try:
+        client = scheduler.client('warm-job')
+        for i in range(4):
+            client.submit(f'image-{i}.jpg', {})
+        _, first = pool.next_image()
+        _, second = pool.next_image()
+        assert budget.in_use == 2
+
+        # Another job asks for a worker while the scheduler holds both
+        granted = []
+        waiter = threading.Thread(target=lambda: granted.append(budget.acquire(1)))
+        waiter.start()
+        wait_until(lambda: budget.waiting == 1)
+
+        first.set_result({})
+        waiter.join(timeout=5)
+        assert granted == [1]
+        # The worker went to the waiting job instead of the next queued image
+        time.sleep(0.1)
+        assert pool.dispatched.empty()
+
+        second.set_result({})
+        assert pool.finish_next() == 'image-2.jpg'
+        assert pool.finish_next() == 'image-3.jpg'
+        budget.release(1)
+    finally:
+        scheduler.shutdown()
+    wait_until(lambda: budget.in_use == 0)
+
+def test_cancelled_queued_image_is_dropped():
+    pool = FakePool(workers=1)
+    scheduler = FairShareScheduler(pool)
+    try:
+        client = scheduler.client('job')
+        client.submit('running.jpg', {})
+        _, running = pool.next_image()
+        dropped = client.submit('dropped.jpg', {})
+        kept = client.submit('kept.jpg', {})
+        assert dropped.cancel()
+
+        running.set_result({})
+        assert pool.finish_next() == 'kept.jpg'
+        assert kept.result(timeout=5) == {}
+        time.sleep(0.1)
+        assert pool.dispatched.empty()
+    finally:
+        scheduler.shutdown()
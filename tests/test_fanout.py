@@ -0,0 +1,51 @@
+"""
+Tests for process_image_fanout, which decodes an image once for several configurations.
+"""
+
+from PIL import Image, ImageChops
+
+import watermark_script
+from watermark_script import WatermarkProcessor, process_image_fanout
+
+def test_image_is_decoded_once_for_all_configurations(tmp_path, monkeypatch):
+    source = tmp_path / 'photo_12.png'
+    Image.new('RGB', (120, 80), 'gray').save(source)
+    processors = {
+        'top': WatermarkProcessor(custom_text='top', custom_text_position='top-left'),
+        'bottom': WatermarkProcessor(custom_text='bottom', custom_text_position='bottom-right'),
+    }
+    output_paths = {name: str(tmp_path / f'{name}.png') for name in processors}
+
+    opened = []
+    real_open = Image.open
+    def counting_open(*args, **kwargs):
+        opened.append(args[0])
+        return real_open(*args, **kwargs)
+    monkeypatch.setattr(watermark_script.Image, 'open', counting_open)
+
+    stats = {}
+    results = process_image_fanout(str(source), output_paths, processors, stats)
+
+    assert results == {'top': True, 'bottom': True}
+    assert opened == [str(source)]
+    assert set(stats['seconds']) == {'top', 'bottom'}
+    assert stats['bytes_read'] == source.stat().st_size
+    monkeypatch.undo()
+
+    # Each output is the same as processing the image with that configuration alone
+    for name, processor in processors.items():
+        single = tmp_path / f'{name}-single.png'
+        assert processor.process_image(str(source), str(single))
+        with Image.open(output_paths[name]) as fanned_out, Image.open(single) as alone:
+            assert ImageChops.difference(fanned_out, alone).getbbox() is None
+
+def test_failing_configuration_does_not_stop_the_others(tmp_path):
+    source = tmp_path / 'photo.png'
+    Image.new('RGB', (60, 40), 'white').save(source)
+    processors = {'k1': WatermarkProcessor(custom_text='k1')}
+    output_paths = {'k1': str(tmp_path / 'k1.png'), 'unknown': str(tmp_path / 'unknown.png')}
+
+    results = process_image_fanout(str(source), output_paths, processors)
+
+    assert results == {'k1': True, 'unknown': False}
+    assert not (tmp_path / 'unknown.png').exists()
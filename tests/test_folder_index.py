@@ -0,0 +1,77 @@
+"""
+Tests for the folder statistics index behind /api/validate.
+"""
+
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import k1_folder_index
+from k1_folder_index import FolderStatsIndex, create_validate_blueprint
+
+def settle(root):
+    """Date all folders back so unchanged ones are trusted by a refresh."""
+    old = time.time() - 60
+    for folder, _, _ in os.walk(root):
+        os.utime(folder, (old, old))
+
+@pytest.fixture
+def stats_index():
+    index = FolderStatsIndex()
+    yield index
+    index.shutdown()
+
+@pytest.fixture
+def validate(stats_index):
+    app = Flask(__name__)
+    app.register_blueprint(create_validate_blueprint(stats_index))
+    client = app.test_client()
+    return lambda **data: client.post('/api/validate', json=data)
+
+def test_statistics_cover_nested_images(tmp_path, make_images, validate):
+    make_images(tmp_path / 'a', {'1.jpg': (40, 30), '2.jpg': (40, 30)})
+    make_images(tmp_path / 'a' / 'nested', {'3.png': (20, 10)})
+    make_images(tmp_path / 'b', {'4.jpg': (40, 30)})
+    (tmp_path / 'b' / 'broken.jpg').write_bytes(b'not an image')
+
+    result = validate(base_input=str(tmp_path), base_output=str(tmp_path / 'out')).get_json()
+
+    assert result['base_input']['is_dir'] and not result['base_output']['exists']
+    stats = result['base_input']['stats']
+    assert stats['status'] == 'ready'
+    assert stats['subfolders']['a']['image_count'] == 3
+    assert stats['subfolders']['b']['unreadable'] == 1
+    totals = stats['totals']
+    assert totals['image_count'] == 5
+    assert totals['formats'] == [['JPEG', 3], ['PNG', 1]]
+    assert totals['resolutions'] == [['40x30', 3], ['20x10', 1]]
+    assert stats['suggested_parallel'] == 1
+
+def test_request_waits_at_most_the_server_limit(tmp_path, make_images, validate, monkeypatch):
+    make_images(tmp_path / 'a', {'1.jpg': (40, 30)})
+    release = threading.Event()
+    monkeypatch.setattr(k1_folder_index, 'MAX_VALIDATE_WAIT', 0.2)
+    monkeypatch.setattr(k1_folder_index, 'read_header', lambda path: release.wait(10) and ('JPEG', 40, 30))
+    try:
+        started = time.time()
+        stats = validate(base_input=str(tmp_path), wait=30).get_json()['base_input']['stats']
+        assert time.time() - started < 2
+        assert stats['status'] in ('pending', 'building')
+    finally:
+        release.set()
+
+def test_refresh_only_reads_new_headers(tmp_path, make_images, stats_index):
+    make_images(tmp_path / 'a', {'1.jpg': (40, 30), '2.jpg': (40, 30)})
+    settle(tmp_path)
+    stats_index.get(str(tmp_path), wait=10)
+    index = stats_index._indexes[str(tmp_path)]
+    assert index.headers_read == 2
+
+    make_images(tmp_path / 'a', {'3.jpg': (40, 30)})
+    stats_index.refresh(index)
+
+    assert index.headers_read == 1
+    assert stats_index.snapshot(index)['totals']['image_count'] == 3
@@ -0,0 +1,50 @@
+"""
+Tests for the image-level global work queue of K1MultiFolderProcessor.
+"""
+
+import os
+
+def test_images_of_all_folders_are_dispatched_largest_first(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    base_output = tmp_path / 'output'
+    make_images(base_input / 'small', {'s1.jpg': (40, 30), 's2.jpg': (200, 150)})
+    make_images(base_input / 'large', {'l1.jpg': (300, 200), 'l2.jpg': (60, 40)})
+
+    order = []
+    real_fanout = k1_processor.process_image_fanout
+    def recording_fanout(input_path, output_paths, processors, stats=None):
+        order.append(os.path.basename(input_path))
+        return real_fanout(input_path, output_paths, processors, stats)
+    k1_processor.process_image_fanout = recording_fanout
+
+    results = k1_processor.process_work_queue(str(base_input), str(base_output), ['plain', 'corner'])
+
+    # One queue across folders, ordered by pixel count, not folder by folder
+    assert order == ['l1.jpg', 's2.jpg', 'l2.jpg', 's1.jpg']
+    assert results == {'plain': {'small': True, 'large': True},
+                       'corner': {'small': True, 'large': True}}
+    for folder, names in {'small': ['s1.jpg', 's2.jpg'], 'large': ['l1.jpg', 'l2.jpg']}.items():
+        for config_name in ('plain', 'corner'):
+            assert sorted(os.listdir(base_output / f'{folder}_{config_name}')) == names
+
+def test_work_items_without_fan_out_carry_one_configuration(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    make_images(base_input / 'set', {'a.jpg': (50, 40)})
+
+    fanned_out = k1_processor.collect_work_items(str(base_input), ['plain', 'corner'])
+    single = k1_processor.collect_work_items(str(base_input), ['plain', 'corner'], fan_out=False)
+
+    assert [item.config_names for item in fanned_out] == [('plain', 'corner')]
+    assert sorted(item.config_names for item in single) == [('corner',), ('plain',)]
+    assert {item.cost for item in fanned_out + single} == {50 * 40}
+
+def test_failed_image_fails_only_its_folder(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    make_images(base_input / 'good', {'a.jpg': (50, 40)})
+    (base_input / 'bad').mkdir()
+    (base_input / 'bad' / 'broken.jpg').write_bytes(b'not an image')
+
+    results = k1_processor.process_work_queue(str(base_input), str(tmp_path / 'output'), ['plain'],
+                                              parallel=2)
+
+    assert results == {'plain': {'good': True, 'bad': False}}
@@ -0,0 +1,94 @@
+"""
+Tests for the Server-Sent Events progress stream of jobs.
+"""
+
+import json
+import threading
+
+from flask import Flask
+
+from k1_jobs import PROGRESS_EVENT_PREFIX, JobManager, create_jobs_blueprint
+
+REQUEST = {'base_input': 'in', 'base_output': 'out', 'config': 'final_v2'}
+
+class EventRunner:
+    """Writes K1 progress event lines, then waits until released."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def requested_workers(self, job):
+        return 1
+
+    def run(self, job):
+        job.add_line(PROGRESS_EVENT_PREFIX + json.dumps({'event': 'start', 'total': 2}))
+        job.add_line(PROGRESS_EVENT_PREFIX + json.dumps({'event': 'progress', 'done': 1, 'total': 2}))
+        job.add_line(PROGRESS_EVENT_PREFIX + json.dumps({'event': 'metrics', 'images': {'final_v2': {'ok': 1}}}))
+        job.add_line('2026-01-01 00:00:00 - INFO - plain log line')
+        self.release.wait(10)
+        job.add_line(PROGRESS_EVENT_PREFIX + json.dumps({'event': 'progress', 'done': 2, 'total': 2}))
+        return 0
+
+def parse_sse(text):
+    """(id, event name, data) of the messages of an event stream."""
+    messages = []
+    for block in text.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in block.splitlines() if ': ' in line and not line.startswith(':'))
+        if 'data' in fields:
+            messages.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+    return messages
+
+def make_client(runner, **blueprint_options):
+    manager = JobManager(runner=runner)
+    app = Flask(__name__)
+    app.register_blueprint(create_jobs_blueprint(manager, **blueprint_options))
+    return app.test_client(), manager
+
+def test_stream_replays_and_follows_progress_until_the_job_finishes():
+    runner = EventRunner()
+    client, manager = make_client(runner)
+    try:
+        job_id = client.post('/api/execute', json=REQUEST).get_json()['job_id']
+        # The last progress event and the final status arrive while the stream is open
+        threading.Timer(0.3, runner.release.set).start()
+        response = client.get(f'/api/jobs/{job_id}/events')
+        assert response.mimetype == 'text/event-stream'
+        messages = parse_sse(response.get_data(as_text=True))
+    finally:
+        manager.shutdown()
+
+    names = [name for _, name, _ in messages]
+    assert names[0] == 'status' and messages[0][2]['status'] == 'running'
+    assert names.count('progress') == 2 and 'start' in names
+    # Worker metrics and log lines are not progress events
+    assert 'metrics' not in names and 'message' not in names
+    assert messages[-1][2]['status'] == 'succeeded'
+    ids = [seq for seq, _, _ in messages]
+    assert ids == sorted(ids)
+
+def test_reconnect_continues_after_last_event_id():
+    runner = EventRunner()
+    runner.release.set()
+    client, manager = make_client(runner)
+    try:
+        job_id = client.post('/api/execute', json=REQUEST).get_json()['job_id']
+        everything = parse_sse(client.get(f'/api/jobs/{job_id}/events').get_data(as_text=True))
+        resumed = parse_sse(client.get(f'/api/jobs/{job_id}/events',
+                                       headers={'Last-Event-ID': str(everything[2][0])}).get_data(as_text=True))
+    finally:
+        manager.shutdown()
+    assert resumed == everything[3:]
+
+def test_streams_beyond_the_limit_are_refused():
+    runner = EventRunner()
+    client, manager = make_client(runner, max_event_streams=1)
+    try:
+        job_id = client.post('/api/execute', json=REQUEST).get_json()['job_id']
+        first = client.get(f'/api/jobs/{job_id}/events', buffered=False)
+        assert client.get(f'/api/jobs/{job_id}/events').status_code == 503
+        first.close()
+        runner.release.set()
+        assert client.get(f'/api/jobs/{job_id}/events').status_code == 200
+    finally:
+        runner.release.set()
+        manager.shutdown()
@@ -0,0 +1,100 @@
+"""
+Tests for keeping jobs across server restarts (JobStore) and for the
+production server's start-up and shutdown of its job runner.
+"""
+
+import atexit
+import importlib
+import sys
+import threading
+import time
+
+from k1_job_store import JobStore
+from k1_jobs import JobManager, WarmPoolRunner
+
+REQUEST = {'base_input': 'in', 'base_output': 'out', 'config': 'final_v2'}
+
+class HoldingRunner:
+    """Records the jobs it runs; holds each one until released."""
+
+    def __init__(self, hold: bool = False):
+        self.commands = {}
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def requested_workers(self, job):
+        return 1
+
+    def run(self, job):
+        self.commands[job.id] = list(job.command)
+        self.release.wait(10)
+        return 0
+
+    def shutdown(self):
+        pass
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.02)
+
+def test_restart_resumes_interrupted_and_runs_queued_jobs(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    store = JobStore(path, flush_interval=0.05)
+    before = HoldingRunner(hold=True)
+    manager = JobManager(max_workers=1, runner=before, store=store)
+    try:
+        finished = manager.submit(['k1', 'finished'], REQUEST)
+        before.release.set()
+        wait_until(lambda: finished.finished)
+        before.release.clear()
+        interrupted = manager.submit(['k1', 'interrupted'], REQUEST)
+        queued = manager.submit(['k1', 'queued'], REQUEST)
+        wait_until(lambda: interrupted.id in before.commands)
+        store.flush()
+
+        # A second server on the same database, as after a crash of the first
+        after = HoldingRunner()
+        restarted = JobManager(max_workers=1, runner=after, store=JobStore(path, flush_interval=0.05))
+        try:
+            wait_until(lambda: all(restarted.get(job.id).finished for job in (interrupted, queued)))
+            assert after.commands[interrupted.id] == ['k1', 'interrupted', '--resume']
+            assert restarted.get(interrupted.id).request['resume'] is True
+            assert after.commands[queued.id] == ['k1', 'queued']
+            # Finished jobs stay queryable and are not run again
+            assert finished.id not in after.commands
+            assert restarted.get(finished.id).status == 'succeeded'
+        finally:
+            restarted.shutdown()
+            restarted.store.close()
+    finally:
+        before.release.set()
+        manager.shutdown()
+        store.close()
+
+def test_production_server_starts_the_pool_on_import(tmp_path, monkeypatch):
+    # WSGI hosts import the module instead of running it as __main__
+    started = []
+    exit_handlers = []
+    monkeypatch.setattr(WarmPoolRunner, 'start', lambda runner: started.append(runner))
+    monkeypatch.setattr(atexit, 'register', lambda function, *args, **kwargs: exit_handlers.append(
+        (function, args, kwargs)) or function)
+    monkeypatch.setenv('K1_DATA_DIR', str(tmp_path))
+    monkeypatch.setenv('K1_WORKERS', '1')
+    monkeypatch.delitem(sys.modules, 'server_production', raising=False)
+
+    server = importlib.import_module('server_production')
+    try:
+        assert started == [server.warm_runner]
+        functions = [function for function, _, _ in exit_handlers]
+        assert server.warm_runner.shutdown in functions
+        assert server.job_manager.shutdown in functions
+        # Jobs stop before the pool, and the pool before the database closes
+        assert functions.index(server.job_manager.shutdown) > functions.index(server.warm_runner.shutdown) \
+            > functions.index(server.job_manager.store.close)
+    finally:
+        for function, args, kwargs in reversed(exit_handlers):
+            function(*args, **kwargs)
+        sys.modules.pop('server_production', None)
@@ -0,0 +1,104 @@
+"""
+Tests for the asynchronous job API (/api/execute and /api/jobs).
+
+Jobs run on a stand-in runner that only finishes when a test releases it,
+so the tests see jobs while they are queued and running.
+"""
+
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from k1_jobs import JobManager, WorkerBudget, create_jobs_blueprint
+
+REQUEST = {'base_input': 'in', 'base_output': 'out', 'config': 'final_v2'}
+
+class BlockingRunner:
+    """Runs each job until release is set, logging like a K1 run."""
+
+    def __init__(self, return_code: int = 0):
+        self.return_code = return_code
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def requested_workers(self, job):
+        return int(job.request.get('parallel') or 1)
+
+    def run(self, job):
+        self.started.release()
+        job.add_line('2026-01-01 00:00:00 - INFO - Successfully processed: in/a/1.jpg -> out/a_final_v2/1.jpg')
+        self.release.wait(10)
+        return self.return_code
+
+def wait_for_status(client, job_id, status, timeout=5.0):
+    deadline = time.time() + timeout
+    while True:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] == status:
+            return job
+        assert time.time() < deadline, f"job still {job['status']}"
+        time.sleep(0.02)
+
+@pytest.fixture
+def jobs_app():
+    runner = BlockingRunner()
+    manager = JobManager(max_workers=1, max_pending=1, runner=runner, budget=WorkerBudget(2))
+    app = Flask(__name__)
+    app.register_blueprint(create_jobs_blueprint(manager))
+    yield app.test_client(), runner
+    runner.release.set()
+    manager.shutdown()
+
+def test_execute_returns_while_the_job_runs(jobs_app):
+    client, runner = jobs_app
+    started = time.time()
+    response = client.post('/api/execute', json=dict(REQUEST, parallel=4))
+    assert response.status_code == 202
+    assert time.time() - started < 1
+    job_id = response.get_json()['job_id']
+    assert '--parallel 4' in response.get_json()['command']
+
+    assert runner.started.acquire(timeout=5)
+    job = wait_for_status(client, job_id, 'running')
+    assert job['counters']['outputs_written'] == 1
+    # Granted what the budget has, not the requested 4
+    assert job['worker_slots'] == 2
+    assert 'Successfully processed' in job['log_tail'][0]
+
+    runner.release.set()
+    job = wait_for_status(client, job_id, 'succeeded')
+    assert job['success'] and job['return_code'] == 0
+    assert [listed['job_id'] for listed in client.get('/api/jobs').get_json()] == [job_id]
+
+def test_full_queue_and_bad_requests_are_refused(jobs_app):
+    client, runner = jobs_app
+    running = client.post('/api/execute', json=REQUEST).get_json()['job_id']
+    assert runner.started.acquire(timeout=5)
+    queued = client.post('/api/execute', json=REQUEST)
+    assert queued.status_code == 202
+    assert queued.get_json()['status'] == 'queued'
+
+    assert client.post('/api/execute', json=REQUEST).status_code == 503
+    assert client.post('/api/execute', json={'config': 'final_v2'}).status_code == 400
+    assert client.post('/api/execute', json=dict(REQUEST, priority='urgent')).status_code == 400
+    assert client.get('/api/jobs/unknown').status_code == 404
+
+    runner.release.set()
+    wait_for_status(client, running, 'succeeded')
+    wait_for_status(client, queued.get_json()['job_id'], 'succeeded')
+
+def test_failing_run_fails_the_job():
+    runner = BlockingRunner(return_code=1)
+    runner.release.set()
+    manager = JobManager(runner=runner)
+    app = Flask(__name__)
+    app.register_blueprint(create_jobs_blueprint(manager))
+    client = app.test_client()
+    try:
+        job_id = client.post('/api/execute', json=REQUEST).get_json()['job_id']
+        job = wait_for_status(client, job_id, 'failed')
+        assert not job['success'] and job['return_code'] == 1
+    finally:
+        manager.shutdown()
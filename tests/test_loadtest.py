@@ -0,0 +1,82 @@
+"""
+Tests for the web server load test (k1_loadtest.py), run against an
+in-process server with the browse and validate endpoints.
+"""
+
+import argparse
+import os
+import threading
+import time
+
+import pytest
+from flask import Flask
+from werkzeug.serving import make_server
+
+from k1_browse import create_browse_blueprint
+from k1_folder_index import create_validate_blueprint
+from k1_loadtest import LoadTest, ProcessSampler, free_port, generate_corpus, parse_mix, percentile
+
+@pytest.fixture
+def server():
+    app = Flask(__name__)
+    app.register_blueprint(create_browse_blueprint())
+    app.register_blueprint(create_validate_blueprint())
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    thread.join(timeout=5)
+
+def test_corpus_is_generated_once(tmp_path):
+    images = generate_corpus(str(tmp_path / 'corpus'), 2, 3, (64, 48))
+    assert len(images) == 6
+    assert os.path.basename(images[0]) == 'IMG_0001.jpg'
+    assert sorted({os.path.basename(os.path.dirname(path)) for path in images}) == ['set_01', 'set_02']
+    modified = os.stat(images[0]).st_mtime_ns
+    # Existing images are kept
+    assert generate_corpus(str(tmp_path / 'corpus'), 2, 3, (64, 48)) == images
+    assert os.stat(images[0]).st_mtime_ns == modified
+
+def test_percentile_and_mix():
+    assert percentile([], 50) is None
+    values = [float(value) for value in range(1, 101)]
+    assert (percentile(values, 50), percentile(values, 99), percentile(values, 100)) == (50.0, 99.0, 100.0)
+    assert parse_mix('browse=3,validate=1') == {'browse': 3.0, 'validate': 1.0, 'preview': 0.0, 'execute': 0.0}
+    for value in ('upload=1', 'browse=x', 'browse=0'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_mix(value)
+
+def test_load_test_reports_latency_and_errors_per_call(tmp_path, server):
+    images = generate_corpus(str(tmp_path / 'corpus'), 2, 2, (64, 48))
+    test = LoadTest(server, str(tmp_path / 'corpus'), images, str(tmp_path / 'outputs'),
+                    {'browse': 1, 'validate': 1, 'preview': 0, 'execute': 0}, timeout=10)
+    elapsed = test.run(rate=40, duration=1.0, clients=8)
+    report = test.report(elapsed)
+
+    assert set(report) == {'browse', 'validate'}
+    assert 10 <= sum(entry['requests'] for entry in report.values()) <= 100
+    for entry in report.values():
+        assert entry['errors'] == 0 and entry['statuses'] == {'200': entry['requests']}
+        assert 0 < entry['p50_ms'] <= entry['p90_ms'] <= entry['p99_ms'] <= entry['max_ms']
+
+    # Refused connections count as errors
+    test.url = f"http://127.0.0.1:{free_port()}"
+    test.results = {kind: [] for kind in test.kinds}
+    report = test.report(test.run(rate=40, duration=0.5, clients=8))
+    for entry in report.values():
+        assert entry['error_rate'] == 1.0 and set(entry['statuses']) == {'None'}
+
+@pytest.mark.skipif(not os.path.isdir('/proc/self'), reason="reads /proc")
+def test_sampler_measures_the_process_tree():
+    sampler = ProcessSampler(os.getpid(), interval=0.05)
+    sampler.start()
+    # Keep a core busy for a moment
+    deadline = time.perf_counter() + 0.5
+    while time.perf_counter() < deadline:
+        pass
+    sampler.stop()
+
+    summary = sampler.summary()
+    assert summary['rss_max_mb'] > 1
+    assert summary['cpu_max_percent'] > 10
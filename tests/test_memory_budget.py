@@ -0,0 +1,98 @@
+"""
+Tests for the memory budget: the footprint estimate of an image and the
+admission of images while their footprints fit.
+"""
+
+import sys
+import threading
+import time
+
+import pytest
+
+import watermark_script
+from watermark_pool import WatermarkProcessPool
+from watermark_script import MemoryBudget, WatermarkProcessor, estimate_image_memory
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.02)
+
+def test_estimate_counts_mode_and_configurations():
+    pixels = 1000 * 500
+    assert estimate_image_memory(None) == 0
+    # Decoded frame, RGBA frame, watermarked copy and JPEG copy: 4 bytes each
+    assert estimate_image_memory((1000, 500)) == 16 * pixels
+    assert estimate_image_memory((1000, 500), 'RGB') == estimate_image_memory((1000, 500), 'RGBA')
+    # Grayscale is decoded at one byte per pixel
+    assert estimate_image_memory((1000, 500), 'L') == 13 * pixels
+    assert estimate_image_memory((1000, 500), 'I;16') == 14 * pixels
+    # One watermarked copy per configuration
+    assert estimate_image_memory((1000, 500), 'RGB', configs=3) == 24 * pixels
+
+def test_work_items_carry_the_fan_out_footprint(tmp_path, k1_processor, make_images):
+    make_images(str(tmp_path / 'input' / 'set'), {'a.jpg': (400, 300)})
+    configs = ['plain', 'corner']
+
+    [item] = k1_processor.collect_work_items(str(tmp_path / 'input'), configs, fan_out=True)
+    assert item.memory == estimate_image_memory((400, 300), 'RGB', configs=2)
+
+    items = k1_processor.collect_work_items(str(tmp_path / 'input'), configs, fan_out=False)
+    assert [item.memory for item in items] == [estimate_image_memory((400, 300), 'RGB')] * 2
+
+class RecordingBudget(MemoryBudget):
+    def __init__(self, total_bytes):
+        super().__init__(total_bytes)
+        self.requests = []
+
+    def acquire(self, nbytes, name=''):
+        self.requests.append(nbytes)
+        return super().acquire(nbytes, name)
+
+def test_pool_reserves_the_footprint_of_all_outputs(tmp_path, make_images):
+    [image] = make_images(str(tmp_path / 'input'), {'a.jpg': (400, 300)})
+    processors = {'first': WatermarkProcessor(custom_text='k1'), 'second': WatermarkProcessor(custom_text='k2')}
+    budget = RecordingBudget(1024 ** 3)
+    with WatermarkProcessPool(processors, 1, memory_budget=budget) as pool:
+        outputs = {name: str(tmp_path / name / 'a.jpg') for name in processors}
+        assert pool.submit(image, outputs).result(timeout=30) == {'first': True, 'second': True}
+
+    assert budget.requests == [estimate_image_memory((400, 300), 'RGB', configs=2)]
+    assert budget.in_use == 0
+
+def test_images_wait_until_their_footprint_fits():
+    budget = MemoryBudget(100)
+    assert budget.acquire(60) == 60
+    admitted = []
+    large = threading.Thread(target=lambda: admitted.append(('large', budget.acquire(50))))
+    large.start()
+    wait_until(lambda: budget.waiting == 1)
+    small = threading.Thread(target=lambda: admitted.append(('small', budget.acquire(10))))
+    small.start()
+    wait_until(lambda: budget.waiting == 2)
+    # The small image fits but waits behind the large one
+    assert admitted == []
+
+    budget.release(60)
+    large.join(timeout=5)
+    small.join(timeout=5)
+    assert admitted == [('large', 50), ('small', 10)] and budget.peak == 60
+
+    # Larger than the whole budget: taken alone
+    budget.release(60)
+    assert budget.acquire(500) == 100 and budget.in_use == 100
+
+def test_sequential_run_rejects_a_memory_budget(tmp_path, monkeypatch, capsys):
+    (tmp_path / 'input').mkdir()
+    arguments = ['watermark_script.py', '--input-folder', str(tmp_path / 'input'),
+                 '--output-folder', str(tmp_path / 'output'), '--custom-text', 'k1', '--memory-budget', '1']
+    monkeypatch.setattr(sys, 'argv', arguments)
+    with pytest.raises(SystemExit) as exit_info:
+        watermark_script.main()
+    assert exit_info.value.code == 2
+    assert '--memory-budget needs' in capsys.readouterr().err
+
+    # Honored with worker processes
+    monkeypatch.setattr(sys, 'argv', arguments + ['--processes', '2', '--dry-run'])
+    watermark_script.main()
@@ -0,0 +1,99 @@
+"""
+Tests for the Prometheus metrics (/metrics).
+"""
+
+import io
+import time
+
+import pytest
+from flask import Flask
+from PIL import Image
+
+from k1_jobs import JobManager, WarmPoolRunner, WorkerBudget, build_k1_command
+from k1_metrics import MetricsRegistry, create_metrics_blueprint
+from k1_upload import create_upload_blueprint
+
+def scrape(client):
+    """{'name{labels}': value} of the samples of a /metrics response."""
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    samples = {}
+    for line in response.get_data(as_text=True).splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+@pytest.fixture
+def metrics_client(offline_configs):
+    app = Flask(__name__)
+    app.register_blueprint(create_metrics_blueprint())
+    app.register_blueprint(create_upload_blueprint())
+    return app.test_client()
+
+def test_text_format():
+    registry = MetricsRegistry()
+    counter = registry.counter('k1_test_total', 'Test counter', ['config'])
+    histogram = registry.histogram('k1_test_seconds', 'Test histogram', buckets=(0.1, 1.0))
+    counter.inc(config='say "hi"')
+    counter.inc(2, config='say "hi"')
+    for seconds in (0.05, 0.5, 5.0):
+        histogram.observe(seconds)
+
+    app = Flask(__name__)
+    app.register_blueprint(create_metrics_blueprint(registry))
+    samples = scrape(app.test_client())
+
+    assert samples['k1_test_total{config="say \\"hi\\""}'] == 3
+    assert samples['k1_test_seconds_bucket{le="0.1"}'] == 1
+    assert samples['k1_test_seconds_bucket{le="1"}'] == 2
+    assert samples['k1_test_seconds_bucket{le="+Inf"}'] == 3
+    assert samples['k1_test_seconds_sum'] == 5.55 and samples['k1_test_seconds_count'] == 3
+    with pytest.raises(ValueError):
+        counter.inc(source='job')
+    with pytest.raises(ValueError):
+        registry.counter('k1_test_total', 'Registered twice')
+
+def test_job_workers_report_their_images(tmp_path, make_images, metrics_client):
+    make_images(tmp_path / 'input' / 'set', {'a.jpg': (60, 40), 'b.jpg': (50, 40)})
+    budget = WorkerBudget(2)
+    runner = WarmPoolRunner(workers=2, config_names=['plain'], fallback=None, budget=budget)
+    runner.start()
+    assert runner._ready.wait(60), "warm pool did not start"
+    manager = JobManager(max_workers=2, runner=runner, budget=budget)
+    images = 'k1_images_processed_total{config="plain",source="job",result="ok"}'
+    succeeded = 'k1_jobs_finished_total{status="succeeded"}'
+    before = scrape(metrics_client)
+    try:
+        data = {'base_input': str(tmp_path / 'input'), 'base_output': str(tmp_path / 'output'), 'config': 'plain'}
+        job = manager.submit(build_k1_command(data), data)
+        deadline = time.time() + 60
+        while not job.finished:
+            assert time.time() < deadline, f"job still {job.status}"
+            time.sleep(0.05)
+        after = scrape(metrics_client)
+    finally:
+        manager.shutdown()
+        runner.shutdown()
+
+    assert job.status == 'succeeded'
+    assert after[images] - before.get(images, 0) == 2
+    assert after['k1_bytes_written_total{source="job"}'] > before.get('k1_bytes_written_total{source="job"}', 0)
+    assert after[succeeded] - before.get(succeeded, 0) == 1
+    assert after['k1_worker_budget'] == 2
+
+def test_uploads_are_recorded(metrics_client):
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), 'gray').save(buffer, 'JPEG')
+    ok = 'k1_images_processed_total{config="plain",source="upload",result="ok"}'
+    failed = 'k1_images_processed_total{config="plain",source="upload",result="failed"}'
+    before = scrape(metrics_client)
+
+    metrics_client.post('/api/watermark/plain', data=buffer.getvalue(), content_type='image/jpeg')
+    metrics_client.post('/api/watermark/plain', data=b'not an image', content_type='image/jpeg')
+    after = scrape(metrics_client)
+
+    assert after[ok] - before.get(ok, 0) == 1
+    assert after[failed] - before.get(failed, 0) == 1
+    assert after['k1_bytes_read_total{source="upload"}'] - before.get('k1_bytes_read_total{source="upload"}', 0) \
+        == len(buffer.getvalue()) + len(b'not an image')
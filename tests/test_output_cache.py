@@ -0,0 +1,100 @@
+"""
+Tests for the content-addressed output cache: repeat runs are linked from the
+cache, changed inputs or settings are processed again, and trim() evicts the
+least recently used entries.
+"""
+
+import os
+import time
+
+from PIL import Image
+
+from watermark_cache import OutputCache
+from watermark_script import PARTIAL_SUFFIX, process_image_fanout
+
+def run(input_path, output_path, processor, cache):
+    stats = {}
+    results = process_image_fanout(input_path, {'plain': output_path}, {'plain': processor}, stats, cache)
+    return results, stats
+
+def test_repeat_run_is_linked_from_the_cache(tmp_path, k1_processor, make_images):
+    [input_path] = make_images(str(tmp_path / 'input'), {'a.jpg': (400, 300)})
+    processor = k1_processor.get_watermark_processor('plain')
+    cache = OutputCache(str(tmp_path / 'cache'))
+    first_output = str(tmp_path / 'first' / 'a.jpg')
+    second_output = str(tmp_path / 'second' / 'a.jpg')
+
+    results, stats = run(input_path, first_output, processor, cache)
+    assert results == {'plain': True}
+    assert (stats['output_cache_hits'], stats['output_cache_misses']) == (0, 1)
+
+    results, stats = run(input_path, second_output, processor, cache)
+    assert results == {'plain': True}
+    assert (stats['output_cache_hits'], stats['output_cache_misses']) == (1, 0)
+    # Nothing was decoded or watermarked for the hit
+    assert stats['bytes_read'] == 0 and stats['cache_hits'] + stats['cache_misses'] == 0
+    with open(first_output, 'rb') as first, open(second_output, 'rb') as second:
+        assert first.read() == second.read()
+    # Both outputs share the cache entry's data
+    assert os.stat(first_output).st_ino == os.stat(second_output).st_ino
+    assert os.stat(second_output).st_nlink == 3
+
+def test_changed_input_or_settings_miss(tmp_path, k1_processor, make_images):
+    [input_path] = make_images(str(tmp_path / 'input'), {'a.jpg': (400, 300)})
+    plain = k1_processor.get_watermark_processor('plain')
+    corner = k1_processor.get_watermark_processor('corner')
+    cache = OutputCache(str(tmp_path / 'cache'))
+    run(input_path, str(tmp_path / 'out1' / 'a.jpg'), plain, cache)
+
+    # Other watermark settings
+    results, stats = run(input_path, str(tmp_path / 'out2' / 'a.jpg'), corner, cache)
+    assert results == {'plain': True} and stats['output_cache_misses'] == 1
+
+    # Other content under the same path
+    Image.new('RGB', (400, 300), 'white').save(input_path)
+    os.utime(input_path, (time.time() + 10, time.time() + 10))
+    results, stats = run(input_path, str(tmp_path / 'out3' / 'a.jpg'), plain, cache)
+    assert results == {'plain': True} and stats['output_cache_misses'] == 1
+
+    # Other output format
+    results, stats = run(input_path, str(tmp_path / 'out4' / 'a.png'), plain, cache)
+    assert results == {'plain': True} and stats['output_cache_misses'] == 1
+
+def add_entry(cache, key, size, age):
+    path = os.path.join(cache.directory, key[:2], key + '.jpg')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (time.time() - age, time.time() - age))
+    return path
+
+def test_trim_evicts_least_recently_used_entries(tmp_path):
+    cache = OutputCache(str(tmp_path / 'cache'), max_bytes=250)
+    oldest = add_entry(cache, 'aa01', 100, age=300)
+    older = add_entry(cache, 'bb02', 100, age=200)
+    used = add_entry(cache, 'cc03', 100, age=400)
+    newest = add_entry(cache, 'dd04', 100, age=100)
+
+    # A hit makes an entry the most recently used
+    assert cache.fetch('cc03', str(tmp_path / 'out' / 'a.jpg'))
+
+    assert cache.trim() == {'entries': 2, 'bytes': 200, 'removed': 2}
+    assert not os.path.exists(oldest) and not os.path.exists(older)
+    assert os.path.exists(used) and os.path.exists(newest)
+    # Within the limit nothing more is removed
+    assert cache.trim()['removed'] == 0
+
+def test_trim_removes_stale_partial_files(tmp_path):
+    cache = OutputCache(str(tmp_path / 'cache'))
+    entry = add_entry(cache, 'aa01', 10, age=0)
+    stale = f"{entry}.123{PARTIAL_SUFFIX}"
+    fresh = f"{entry}.456{PARTIAL_SUFFIX}"
+    for path, age in ((stale, 7200), (fresh, 0)):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        os.utime(path, (time.time() - age, time.time() - age))
+
+    cache.trim()
+    # A partial file may still be written by a running process
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh) and os.path.exists(entry)
@@ -0,0 +1,77 @@
+"""
+Tests for the watermark preview endpoint (/api/preview).
+"""
+
+import io
+
+import pytest
+from flask import Flask
+from PIL import Image, ImageChops
+
+import k1_preview
+from k1_preview import PreviewRenderer, create_preview_blueprint
+
+def watermark_box(image):
+    """Bounding box of the pixels that differ clearly from the gray sample."""
+    background = Image.new('RGB', image.size, 'gray')
+    changed = ImageChops.difference(image, background).convert('L').point(lambda value: 255 if value > 40 else 0)
+    return changed.getbbox()
+
+@pytest.fixture
+def preview_client(offline_configs):
+    app = Flask(__name__)
+    app.register_blueprint(create_preview_blueprint(lambda: PreviewRenderer(max_size=200)))
+    return app.test_client()
+
+def test_preview_matches_the_downscaled_output(tmp_path, make_images, k1_processor, preview_client):
+    sample, = make_images(tmp_path / 'set', {'photo.jpg': (800, 600)})
+
+    response = preview_client.post('/api/preview', json={'config': 'corner', 'image_path': sample})
+
+    assert response.status_code == 200 and response.mimetype == 'image/jpeg'
+    assert response.headers['X-Preview-Sample'] == sample
+    preview = Image.open(io.BytesIO(response.data)).convert('RGB')
+    assert preview.size == (200, 150)
+    # The watermark lands where the full-resolution output has it
+    output = tmp_path / 'photo.jpg'
+    assert k1_processor.get_watermark_processor('corner').process_image(sample, str(output))
+    with Image.open(output) as full:
+        expected = full.convert('RGB').resize(preview.size, Image.Resampling.BILINEAR)
+    assert watermark_box(preview) is not None
+    assert watermark_box(preview) == watermark_box(expected)
+
+def test_folder_samples_its_first_image(tmp_path, make_images, preview_client):
+    make_images(tmp_path / 'set' / 'b', {'1.jpg': (40, 30)})
+    first, = make_images(tmp_path / 'set' / 'a', {'1.jpg': (40, 30)})
+
+    response = preview_client.post('/api/preview', json={'config': 'plain', 'base_input': str(tmp_path / 'set')})
+
+    assert response.status_code == 200
+    assert response.headers['X-Preview-Sample'] == first
+
+def test_bad_requests_are_refused(tmp_path, make_images, preview_client):
+    sample, = make_images(tmp_path, {'photo.jpg': (40, 30)})
+    (tmp_path / 'empty').mkdir()
+
+    assert preview_client.post('/api/preview', json={'config': 'plain'}).status_code == 400
+    for image_path in (str(tmp_path / 'missing.jpg'), str(tmp_path / 'empty')):
+        response = preview_client.post('/api/preview', json={'config': 'plain', 'image_path': image_path})
+        assert response.status_code == 400
+    response = preview_client.post('/api/preview', json={'config': 'unknown', 'image_path': sample})
+    assert response.status_code == 400
+
+def test_moving_the_watermark_reuses_the_sample_and_overlays(tmp_path, make_images, offline_configs, monkeypatch):
+    sample, = make_images(tmp_path, {'photo.jpg': (800, 600)})
+    renderer = PreviewRenderer(max_size=200)
+    renderer.render('corner', sample)
+
+    decodes = []
+    real_open = Image.open
+    monkeypatch.setattr(k1_preview.Image, 'open', lambda *args, **kwargs: decodes.append(args) or real_open(*args, **kwargs))
+    moved = {'custom_text_position': 'bottom-right', 'margin': '40'}
+    renderer.render('corner', sample, moved)
+
+    assert decodes == []
+    # The text overlay rendered for the first preview is reused at the new place
+    hits, misses = renderer.get_processor('corner', moved).cache_counts()
+    assert hits >= 1 and misses == 0
@@ -0,0 +1,77 @@
+"""
+Tests for the completion journal and resumed K1 runs.
+"""
+
+import json
+import os
+
+from k1_multi_folder import CompletionJournal
+
+IMAGES = {'a.jpg': (60, 40), 'b.jpg': (50, 40), 'c.jpg': (40, 40)}
+
+def record_processed(k1_processor):
+    """Record the images the processor decodes from now on."""
+    processed = []
+    real_fanout = k1_processor.process_image_fanout
+    def recording_fanout(input_path, output_paths, processors, stats=None):
+        processed.append((os.path.basename(input_path), tuple(sorted(output_paths))))
+        return real_fanout(input_path, output_paths, processors, stats)
+    k1_processor.process_image_fanout = recording_fanout
+    return processed
+
+def journal_file(k1_processor, base_input, config_names, base_output):
+    fingerprint = k1_processor.job_fingerprint(str(base_input), config_names)
+    return base_output / k1_processor.journal_path(fingerprint)
+
+def test_resume_skips_the_pairs_of_the_interrupted_run(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    base_output = tmp_path / 'output'
+    make_images(base_input / 'set', IMAGES)
+    configs = ['plain', 'corner']
+
+    k1_processor.process_work_queue(str(base_input), str(base_output), configs)
+    journal = journal_file(k1_processor, base_input, configs, base_output)
+    lines = journal.read_text().splitlines()
+    assert len(lines) == 1 + len(IMAGES) * len(configs)
+
+    # Interrupted run: only the first two completions made it, the third was torn
+    journal.write_text('\n'.join(lines[:3]) + '\n' + lines[3][:10])
+    kept = {(record['image'], record['config']) for record in map(json.loads, lines[1:3])}
+
+    processed = record_processed(k1_processor)
+    results = k1_processor.process_work_queue(str(base_input), str(base_output), configs, resume=True)
+
+    assert results == {'plain': {'set': True}, 'corner': {'set': True}}
+    done = {(os.path.join('set', name), config) for name, configs_done in processed for config in configs_done}
+    assert not done & kept
+    assert done | kept == {(os.path.join('set', name), config) for name in IMAGES for config in configs}
+
+    # The journal stays readable and now lists every pair
+    fingerprint = k1_processor.job_fingerprint(str(base_input), configs)
+    assert CompletionJournal(str(journal)).load(fingerprint) == done | kept
+
+def test_run_without_resume_starts_over(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    base_output = tmp_path / 'output'
+    make_images(base_input / 'set', IMAGES)
+
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['plain'])
+    processed = record_processed(k1_processor)
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['plain'])
+
+    assert sorted(name for name, _ in processed) == sorted(IMAGES)
+
+def test_jobs_sharing_an_output_folder_keep_their_own_journal(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    base_output = tmp_path / 'output'
+    make_images(base_input / 'set', IMAGES)
+
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['plain'])
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['corner'])
+
+    # Resuming the first job still finds all of its completions
+    processed = record_processed(k1_processor)
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['plain'], resume=True)
+    assert processed == []
+    assert journal_file(k1_processor, base_input, ['plain'], base_output).exists()
+    assert journal_file(k1_processor, base_input, ['corner'], base_output).exists()
@@ -0,0 +1,87 @@
+"""
+Tests for --shard i/N partitioning in watermark_script.py and k1_multi_folder.py.
+"""
+
+import os
+import subprocess
+import sys
+
+from watermark_script import in_shard, output_collisions, shard_key, shard_of, verify_output
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'watermark_script.py')
+
+NESTED = {
+    'a/2.jpg': (40, 30), 'b/2.jpg': (50, 30),
+    'a/1.jpg': (40, 30), 'b/3.jpg': (40, 30), '4.jpg': (40, 30), '5.jpg': (40, 30),
+}
+
+def make_nested(make_images, folder):
+    for rel_path, size in NESTED.items():
+        make_images(os.path.join(folder, os.path.dirname(rel_path)), {os.path.basename(rel_path): size})
+
+def test_shard_assignment_is_stable_and_complete():
+    keys = [f'image-{i}.jpg' for i in range(200)]
+    for shard_count in (1, 3, 4):
+        owners = [[i for i in range(shard_count) if in_shard(key, (i, shard_count))] for key in keys]
+        assert all(len(owner) == 1 for owner in owners)
+    # Same hash on every host and platform
+    assert shard_of('a/b.jpg', 4) == shard_of('a' + os.sep + 'b.jpg', 4)
+    assert [shard_of(key, 4) for key in keys[:5]] == [shard_of(key, 4) for key in keys[:5]]
+
+def test_images_writing_the_same_output_share_a_shard(tmp_path, make_images):
+    input_folder = tmp_path / 'input'
+    make_nested(make_images, input_folder)
+    assert shard_key(str(input_folder / 'a' / '2.jpg')) == shard_key(str(input_folder / 'b' / '2.jpg'))
+    assert list(output_collisions([str(input_folder / name) for name in NESTED])) == ['2.jpg']
+
+    # Every shard runs on its own "host"; their outputs are merged afterwards
+    merged = tmp_path / 'merged'
+    merged.mkdir()
+    for shard in range(3):
+        output_folder = tmp_path / f'shard-{shard}'
+        subprocess.run([sys.executable, SCRIPT, '--input-folder', str(input_folder),
+                        '--output-folder', str(output_folder), '--custom-text', 'k1',
+                        '--shard', f'{shard}/3'], cwd=tmp_path, check=True, capture_output=True)
+        for name in os.listdir(output_folder):
+            assert not (merged / name).exists(), f"{name} written by two shards"
+            os.replace(output_folder / name, merged / name)
+
+    assert sorted(os.listdir(merged)) == ['1.jpg', '2.jpg', '3.jpg', '4.jpg', '5.jpg']
+    assert verify_output(str(input_folder), str(merged), 3)
+    os.remove(merged / '4.jpg')
+    assert not verify_output(str(input_folder), str(merged), 3)
+
+def test_k1_shards_cover_every_output_once(tmp_path, k1_processor, make_images):
+    base_input = tmp_path / 'input'
+    make_nested(make_images, base_input / 'set')
+    make_images(base_input / 'other', {f'{i}.jpg': (30, 20) for i in range(6)})
+
+    written = {}
+    for shard in range(3):
+        real_fanout = k1_processor.process_image_fanout
+        def recording_fanout(input_path, output_paths, processors, stats=None, shard=shard):
+            for output_path in output_paths.values():
+                written.setdefault(output_path, set()).add(shard)
+            return real_fanout(input_path, output_paths, processors, stats)
+        k1_processor.process_image_fanout = recording_fanout
+        k1_processor.process_work_queue(str(base_input), str(tmp_path / 'output'), ['plain', 'corner'],
+                                        fan_out=False, shard=(shard, 3))
+        k1_processor.process_image_fanout = real_fanout
+
+    # a/2.jpg and b/2.jpg both write set_<config>/2.jpg, from the same shard
+    assert len(written) == 2 * (5 + 6)
+    assert all(len(shards) == 1 for shards in written.values())
+
+def test_k1_verify_attributes_missing_outputs_to_their_shard(tmp_path, k1_processor, make_images, caplog):
+    base_input = tmp_path / 'input'
+    base_output = tmp_path / 'output'
+    make_images(base_input / 'set', {f'{i}.jpg': (30, 20) for i in range(8)})
+
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['plain'], shard=(0, 2))
+    caplog.clear()
+    assert not k1_processor.verify_outputs(str(base_input), str(base_output), ['plain'], shard_count=2)
+
+    missing = [record.getMessage() for record in caplog.records if record.getMessage().startswith('Missing')]
+    assert missing and all(message.endswith('(shard 1/2)') for message in missing)
+    k1_processor.process_work_queue(str(base_input), str(base_output), ['plain'], shard=(1, 2))
+    assert k1_processor.verify_outputs(str(base_input), str(base_output), ['plain'], shard_count=2)
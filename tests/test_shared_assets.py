@@ -0,0 +1,45 @@
+"""
+Tests for the WatermarkProcessPool's shared watermark assets.
+"""
+
+from multiprocessing import shared_memory
+
+import pytest
+from PIL import Image, ImageChops
+
+from watermark_pool import WatermarkProcessPool
+from watermark_script import WatermarkProcessor
+
+def test_workers_render_like_the_parent_and_release_shared_memory(tmp_path, make_images):
+    sources = make_images(tmp_path / 'input', {f'img_{i}.png': (90, 60) for i in range(4)})
+    processor = WatermarkProcessor(custom_text='k1')
+
+    # One worker generation per two images
+    with WatermarkProcessPool({'k1': processor}, 2, recycle_after=1, overlay_sizes=[(90, 60)]) as pool:
+        segments = [shm_name for _owner, _key, shm_name, _size in pool.assets.manifest]
+        assert segments, "the pre-rendered overlay is published"
+        futures = [pool.submit(source, {'k1': str(tmp_path / f'pool-{i}.png')})
+                   for i, source in enumerate(sources)]
+        assert [future.result(timeout=60) for future in futures] == [{'k1': True}] * 4
+
+    for i, source in enumerate(sources):
+        expected = tmp_path / f'parent-{i}.png'
+        assert processor.process_image(source, str(expected))
+        with Image.open(tmp_path / f'pool-{i}.png') as pooled, Image.open(expected) as alone:
+            assert ImageChops.difference(pooled, alone).getbbox() is None
+
+    for shm_name in segments:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=shm_name)
+
+def test_worker_results_carry_measurements(tmp_path, make_images):
+    source, = make_images(tmp_path, {'photo.png': (80, 60)})
+    measured = []
+
+    with WatermarkProcessPool({'k1': WatermarkProcessor(custom_text='k1')}, 1) as pool:
+        future = pool.submit(source, {'k1': str(tmp_path / 'out.png')}, on_stats=measured.append)
+        assert future.result(timeout=60) == {'k1': True}
+
+    stats, = measured
+    assert stats['bytes_written'] == (tmp_path / 'out.png').stat().st_size
+    assert 'k1' in stats['seconds']
@@ -0,0 +1,78 @@
+"""
+Tests for the upload-and-watermark endpoint (/api/watermark).
+"""
+
+import email
+import io
+
+import pytest
+from flask import Flask
+from PIL import Image
+
+from k1_upload import UploadWatermarker, create_upload_blueprint
+
+def encoded_image(size, image_format='JPEG') -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'gray').save(buffer, image_format)
+    return buffer.getvalue()
+
+def response_parts(response):
+    """(headers, body) of each part of a multipart/mixed response."""
+    message = email.message_from_bytes(
+        f'Content-Type: {response.headers["Content-Type"]}\r\n\r\n'.encode('latin-1') + response.data)
+    return [(part, part.get_payload(decode=True)) for part in message.get_payload()]
+
+@pytest.fixture
+def upload_client(offline_configs):
+    def make(**watermarker_options):
+        app = Flask(__name__)
+        app.register_blueprint(create_upload_blueprint(
+            watermarker_factory=lambda: UploadWatermarker(**watermarker_options)))
+        return app.test_client()
+    return make
+
+def test_raw_body_is_watermarked(upload_client):
+    client = upload_client()
+    source = encoded_image((400, 300), 'PNG')
+
+    response = client.post('/api/watermark/plain?format=webp&filename=IMG_0042.png', data=source,
+                           content_type='image/png')
+
+    assert response.status_code == 200 and response.mimetype == 'image/webp'
+    assert 'IMG_0042.webp' in response.headers['Content-Disposition']
+    with Image.open(io.BytesIO(response.data)) as result:
+        assert result.size == (400, 300)
+        assert result.convert('RGB').tobytes() != Image.new('RGB', (400, 300), 'gray').tobytes()
+
+def test_file_limit_applies_per_file_not_per_request(upload_client):
+    files = {f'file{index}': (io.BytesIO(encoded_image((200, 200))), f'{index}.jpg') for index in range(3)}
+    file_size = len(encoded_image((200, 200)))
+    client = upload_client(max_request_bytes=file_size + 100)
+
+    response = client.post('/api/watermark/plain', data=files, content_type='multipart/form-data')
+
+    # The body holds three files and is larger than the limit, each file is not
+    assert response.status_code == 200
+    parts = response_parts(response)
+    assert [part['X-Status'] for part, _ in parts] == ['200', '200', '200']
+    assert [part.get_filename() for part, _ in parts] == ['0.jpg', '1.jpg', '2.jpg']
+
+def test_oversized_files_are_refused(upload_client):
+    small = encoded_image((20, 20))
+    large = encoded_image((400, 400))
+    client = upload_client(max_request_bytes=len(small) + 100)
+
+    response = client.post('/api/watermark/plain', data=large, content_type='image/jpeg')
+    assert response.status_code == 413
+
+    files = {'a': (io.BytesIO(small), 'a.jpg'), 'b': (io.BytesIO(large), 'b.jpg')}
+    response = client.post('/api/watermark/plain', data=files, content_type='multipart/form-data')
+    statuses = [part['X-Status'] for part, _ in response_parts(response)]
+    assert statuses == ['200', '413']
+
+def test_unknown_config_and_unreadable_images_are_refused(upload_client):
+    client = upload_client()
+    assert client.post('/api/watermark/unknown', data=encoded_image((20, 20)),
+                       content_type='image/jpeg').status_code == 400
+    assert client.post('/api/watermark/plain', data=b'not an image',
+                       content_type='image/jpeg').status_code == 400
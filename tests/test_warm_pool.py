@@ -0,0 +1,79 @@
+"""
+Tests for jobs run on the warm worker pool behind the web server.
+"""
+
+import os
+import time
+
+import pytest
+
+from k1_jobs import JobManager, WarmPoolRunner, WorkerBudget, build_k1_command
+
+class RecordingRunner:
+    """Fallback runner that records the jobs handed to it."""
+
+    def __init__(self):
+        self.jobs = []
+
+    def requested_workers(self, job):
+        return 1
+
+    def run(self, job):
+        self.jobs.append(job.request['config'])
+        return 0
+
+    def shutdown(self):
+        pass
+
+@pytest.fixture
+def warm_jobs(offline_configs):
+    budget = WorkerBudget(2)
+    fallback = RecordingRunner()
+    runner = WarmPoolRunner(workers=2, config_names=['plain'], fallback=fallback, budget=budget)
+    runner.start()
+    assert runner._ready.wait(60), "warm pool did not start"
+    manager = JobManager(max_workers=2, runner=runner, budget=budget)
+    yield manager, fallback
+    manager.shutdown()
+    runner.shutdown()
+
+def run_job(manager, data, timeout=60.0):
+    job = manager.submit(build_k1_command(data), data)
+    deadline = time.time() + timeout
+    while not job.finished:
+        assert time.time() < deadline, f"job still {job.status}"
+        time.sleep(0.05)
+    return job
+
+def test_job_runs_on_the_warm_pool(tmp_path, make_images, warm_jobs):
+    manager, fallback = warm_jobs
+    make_images(tmp_path / 'input' / 'set', {'a.jpg': (60, 40), 'b.jpg': (50, 40)})
+    data = {'base_input': str(tmp_path / 'input'), 'base_output': str(tmp_path / 'output'), 'config': 'plain'}
+
+    job = run_job(manager, data)
+
+    assert job.status == 'succeeded', list(job.log)
+    assert fallback.jobs == []
+    assert sorted(os.listdir(tmp_path / 'output' / 'set_plain')) == ['a.jpg', 'b.jpg']
+    assert job.to_dict()['counters']['outputs_written'] == 2
+    # Workers are taken per image and all handed back
+    assert manager.budget.in_use == 0
+
+def test_job_with_a_failed_image_fails(tmp_path, make_images, warm_jobs):
+    manager, _ = warm_jobs
+    make_images(tmp_path / 'input' / 'set', {'a.jpg': (60, 40)})
+    (tmp_path / 'input' / 'set' / 'broken.jpg').write_bytes(b'not an image')
+    data = {'base_input': str(tmp_path / 'input'), 'base_output': str(tmp_path / 'output'), 'config': 'plain'}
+
+    job = run_job(manager, data)
+
+    assert job.status == 'failed' and job.return_code == 1
+
+def test_jobs_the_pool_cannot_run_go_to_the_fallback(tmp_path, warm_jobs):
+    manager, fallback = warm_jobs
+    data = {'base_input': str(tmp_path), 'base_output': str(tmp_path / 'output'), 'config': 'corner'}
+    custom = dict(data, config='plain', custom_settings={'margin': '50'})
+
+    assert run_job(manager, data).status == 'succeeded'
+    assert run_job(manager, custom).status == 'succeeded'
+    assert fallback.jobs == ['corner', 'plain']
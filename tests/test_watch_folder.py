@@ -0,0 +1,81 @@
+"""
+Tests for the watch-folder service (inotify and polling detection).
+"""
+
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from watch_folder import WatchService
+
+def wait_until(condition, timeout: float = 10.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.05)
+
+@pytest.fixture(params=[True, False], ids=['inotify', 'polling'])
+def use_inotify(request):
+    return request.param
+
+def test_new_images_are_handled_once_after_they_settle(tmp_path, use_inotify):
+    hot_folder = tmp_path / 'hot'
+    output_folder = hot_folder / 'output'
+    output_folder.mkdir(parents=True)
+    Image.new('RGB', (20, 20)).save(hot_folder / 'existing.jpg')
+    Image.new('RGB', (20, 20)).save(hot_folder / 'catch-up.jpg')
+
+    handled = []
+    lock = threading.Lock()
+    def handler(path):
+        with lock:
+            handled.append(path)
+        return True
+
+    service = WatchService(str(hot_folder), handler, workers=2, settle_seconds=0.2,
+                           poll_interval=0.1, exclude=[str(output_folder)], use_inotify=use_inotify)
+    stop = threading.Event()
+    runner = threading.Thread(target=service.run, kwargs={'initial': [str(hot_folder / 'catch-up.jpg')],
+                                                          'stop_event': stop}, daemon=True)
+    runner.start()
+    try:
+        wait_until(lambda: handled == [str(hot_folder / 'catch-up.jpg')])
+        # Give the watcher time to set up before files arrive
+        time.sleep(0.3)
+        (hot_folder / 'new').mkdir()
+        Image.new('RGB', (20, 20)).save(hot_folder / 'new' / 'arrived.png')
+        Image.new('RGB', (20, 20)).save(output_folder / 'written-by-us.jpg')
+        (hot_folder / 'notes.txt').write_text('not an image')
+
+        arrived = str(hot_folder / 'new' / 'arrived.png')
+        wait_until(lambda: arrived in handled)
+        time.sleep(0.5)
+    finally:
+        stop.set()
+        runner.join(timeout=10)
+
+    assert sorted(handled) == sorted([str(hot_folder / 'catch-up.jpg'), arrived])
+    assert service.processed == 2 and service.failed == 0
+
+def test_file_still_being_written_is_not_handled_early(tmp_path, use_inotify):
+    handled = []
+    service = WatchService(str(tmp_path), lambda path: handled.append(path) or True,
+                           settle_seconds=0.5, poll_interval=0.1, use_inotify=use_inotify)
+    stop = threading.Event()
+    runner = threading.Thread(target=service.run, kwargs={'stop_event': stop}, daemon=True)
+    runner.start()
+    try:
+        time.sleep(0.3)
+        growing = tmp_path / 'growing.jpg'
+        with open(growing, 'wb') as f:
+            for _ in range(6):
+                f.write(b'x' * 1000)
+                f.flush()
+                time.sleep(0.15)
+            assert handled == []
+        wait_until(lambda: handled == [str(growing)])
+    finally:
+        stop.set()
+        runner.join(timeout=10)
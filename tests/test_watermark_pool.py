@@ -0,0 +1,82 @@
+"""
+Tests for the per-image limits of the WatermarkProcessPool.
+
+Misbehaving images are simulated by replacing process_image_fanout before
+the workers start; the workers inherit the replacement when they are forked,
+so these tests need the fork start method.
+"""
+
+import multiprocessing
+import os
+import time
+
+import pytest
+from PIL import Image
+
+import watermark_pool
+from watermark_pool import ImageQuarantined, WatermarkProcessPool
+from watermark_script import WatermarkProcessor
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason="workers must inherit the patched module")
+
+GOOD_IMAGES = ['good-1.jpg', 'good-2.jpg', 'good-3.jpg', 'good-4.jpg']
+
+@pytest.fixture
+def misbehaving_workers(monkeypatch):
+    """Workers that hang on hang*.jpg and crash on crash*.jpg."""
+    real = watermark_pool.process_image_fanout
+
+    def process_image_fanout(input_path, output_paths, processors, stats=None, output_cache=None):
+        name = os.path.basename(input_path)
+        if name.startswith('hang'):
+            time.sleep(60)
+        if name.startswith('crash'):
+            os._exit(1)
+        return real(input_path, output_paths, processors, stats, output_cache)
+
+    monkeypatch.setattr(watermark_pool, 'process_image_fanout', process_image_fanout)
+
+def test_hanging_and_crashing_images_are_quarantined(tmp_path, misbehaving_workers):
+    input_folder = tmp_path / 'input'
+    output_folder = tmp_path / 'output'
+    input_folder.mkdir()
+    output_folder.mkdir()
+    names = ['hang.jpg', 'crash.jpg'] + GOOD_IMAGES
+    for name in names:
+        Image.new('RGB', (64, 48), 'gray').save(input_folder / name)
+
+    pool = WatermarkProcessPool({'k1': WatermarkProcessor(custom_text='k1')}, 2, image_timeout=2)
+    try:
+        futures = {name: pool.submit(str(input_folder / name), {'k1': str(output_folder / name)})
+                   for name in names}
+        for name in GOOD_IMAGES:
+            assert futures[name].result(timeout=60) == {'k1': True}
+        with pytest.raises(ImageQuarantined, match='still running after 2 seconds'):
+            futures['hang.jpg'].result(timeout=60)
+        with pytest.raises(ImageQuarantined, match='crashed the worker process'):
+            futures['crash.jpg'].result(timeout=60)
+    finally:
+        pool.shutdown()
+
+    # Only complete outputs remain, no partial files of the killed workers
+    assert sorted(os.listdir(output_folder)) == sorted(GOOD_IMAGES)
+
+def test_oversized_image_is_quarantined_without_decoding(tmp_path, monkeypatch):
+    # The pool aligns Pillow's global decompression bomb limit with max_pixels
+    monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', Image.MAX_IMAGE_PIXELS)
+    large = tmp_path / 'large.png'
+    small = tmp_path / 'small.png'
+    Image.new('L', (200, 100)).save(large)
+    Image.new('L', (50, 40)).save(small)
+
+    pool = WatermarkProcessPool({'k1': WatermarkProcessor(custom_text='k1')}, 1, max_pixels=10_000)
+    try:
+        oversized = pool.submit(str(large), {'k1': str(tmp_path / 'large-out.png')})
+        fitting = pool.submit(str(small), {'k1': str(tmp_path / 'small-out.png')})
+        with pytest.raises(ImageQuarantined, match='exceed the limit'):
+            oversized.result(timeout=60)
+        assert fitting.result(timeout=60) == {'k1': True}
+    finally:
+        pool.shutdown()
+    assert not (tmp_path / 'large-out.png').exists()
@@ -0,0 +1,84 @@
+"""
+Tests for the worker budget shared by all jobs.
+"""
+
+import threading
+import time
+
+from k1_jobs import JobManager, WorkerBudget
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condition not reached"
+        time.sleep(0.02)
+
+def test_waiting_job_gets_what_is_free_in_arrival_order():
+    budget = WorkerBudget(4)
+    assert budget.acquire(3) == 3
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(budget.acquire(4)))
+    waiter.start()
+    # One worker is free: granted at once instead of waiting for all four
+    waiter.join(timeout=5)
+    assert granted == [1] and budget.in_use == 4
+
+    second = threading.Thread(target=lambda: granted.append(budget.acquire(2)))
+    second.start()
+    wait_until(lambda: budget.waiting == 1)
+    budget.release(1)
+    # A free worker goes to the waiting job, not to an opportunistic taker
+    wait_until(lambda: budget.waiting == 0)
+    assert not budget.try_acquire()
+    second.join(timeout=5)
+    assert granted == [1, 1] and budget.in_use == 4
+
+def test_cancelled_wait_takes_no_workers():
+    budget = WorkerBudget(1)
+    budget.acquire(1)
+    cancel = threading.Event()
+    granted = []
+    waiter = threading.Thread(target=lambda: granted.append(budget.acquire(1, cancel)))
+    waiter.start()
+    wait_until(lambda: budget.waiting == 1)
+    cancel.set()
+    budget.wake()
+    waiter.join(timeout=5)
+    assert granted == [0] and budget.in_use == 1
+
+class SlotRunner:
+    """Records the workers each job was granted and how many were in use at once."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.slots = {}
+        self.peak = 0
+        self.release = threading.Event()
+
+    def requested_workers(self, job):
+        return job.request['parallel']
+
+    def run(self, job):
+        self.slots[job.request['name']] = job.worker_slots
+        self.peak = max(self.peak, self.budget.in_use)
+        self.release.wait(10)
+        return 0
+
+def test_concurrent_jobs_share_the_budget():
+    budget = WorkerBudget(4)
+    runner = SlotRunner(budget)
+    manager = JobManager(max_workers=3, runner=runner, budget=budget)
+    try:
+        jobs = [manager.submit(['k1'], {'name': name, 'parallel': 3}) for name in ('first', 'second', 'third')]
+        wait_until(lambda: len(runner.slots) == 2)
+        # The third job waits until workers come back
+        assert runner.slots == {'first': 3, 'second': 1}
+        assert jobs[2].status == 'queued' and budget.waiting == 1
+        runner.release.set()
+        wait_until(lambda: all(job.finished for job in jobs))
+    finally:
+        runner.release.set()
+        manager.shutdown()
+
+    assert runner.slots['third'] >= 1 and runner.peak <= 4
+    assert budget.in_use == 0
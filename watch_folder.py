@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Watch-Folder Service
+
+Detects new or changed image files in a hot folder and hands each one, once it is
+fully written, to a handler running on warm worker threads.
+
+- Linux: inotify (through ctypes, no extra dependency), new subfolders are
+  watched automatically
+- Other platforms, or when inotify is unavailable: polling fallback
+- A file is considered complete once its size and modification time have not
+  changed for settle_seconds
+- Bursts are absorbed by a bounded work queue; when it is full the watcher waits
+  (back-pressure) instead of growing without limit
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tiff', '.tif', '.bmp'}
+
+# inotify event masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify:
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    def __init__(self):
+        """Create an inotify instance; raises OSError if unavailable."""
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux")
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._paths = {}
+
+    def add_watch(self, path: str) -> None:
+        """Watch a directory for file events."""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self._paths[wd] = path
+
+    def read_events(self, timeout: float) -> Iterable[Tuple[str, int]]:
+        """Yield (path, mask) for events arriving within the timeout."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            directory = self._paths.get(wd)
+            if mask & IN_Q_OVERFLOW:
+                yield '', mask
+            elif directory is not None:
+                yield os.path.join(directory, os.fsdecode(name)), mask
+
+    def close(self) -> None:
+        """Close the inotify instance."""
+        os.close(self.fd)
+
+class FolderWatcher:
+    """Reports new or changed image files once they are fully written."""
+
+    def __init__(self, root: str, callback: Callable[[str, float], None],
+                 recursive: bool = True, settle_seconds: float = 1.0,
+                 poll_interval: float = 1.0, exclude: Iterable[str] = (),
+                 accept: Optional[Callable[[str], bool]] = None, use_inotify: bool = True):
+        """
+        Initialize the watcher.
+
+        Args:
+            root: Folder to watch
+            callback: Called with (path, detection time) for each completed file
+            recursive: Also watch subfolders (new ones are picked up automatically)
+            settle_seconds: Size/mtime must be unchanged this long before a file is reported
+            poll_interval: Scan interval of the polling fallback
+            exclude: Folders to ignore (e.g. an output folder inside the input)
+            accept: Optional filter; files for which it returns False are ignored
+            use_inotify: Set to False to force the polling fallback
+        """
+        self.root = os.path.abspath(root)
+        self.callback = callback
+        self.recursive = recursive
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.exclude = [os.path.abspath(path) for path in exclude]
+        self.accept = accept
+        self._stop = threading.Event()
+        # Candidate files: path -> ((size, mtime), detected, last change)
+        self._pending = {}
+        # Last reported state, so unchanged files are not reported twice
+        self._reported = {}
+        self._inotify = None
+
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError as e:
+                logger.info(f"inotify unavailable ({e}), using polling every {poll_interval}s")
+
+    @property
+    def mode(self) -> str:
+        """Detection mode in use ('inotify' or 'polling')."""
+        return 'inotify' if self._inotify else 'polling'
+
+    def _is_candidate(self, path: str) -> bool:
+        if os.path.splitext(path)[1].lower() not in IMAGE_EXTENSIONS:
+            return False
+        if any(path == folder or path.startswith(folder + os.sep) for folder in self.exclude):
+            return False
+        return self.accept is None or self.accept(path)
+
+    def _scan(self) -> Dict[str, Tuple[int, float]]:
+        """Snapshot of (size, mtime) of all image files under the root."""
+        snapshot = {}
+        stack = [self.root]
+        while stack:
+            directory = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if self.recursive and entry.path not in self.exclude:
+                                    stack.append(entry.path)
+                            elif self._is_candidate(entry.path):
+                                stat = entry.stat()
+                                snapshot[entry.path] = (stat.st_size, stat.st_mtime)
+                        except OSError:
+                            continue
+            except OSError as e:
+                logger.debug(f"Cannot scan {directory}: {e}")
+        return snapshot
+
+    def _watch_tree(self, directory: str) -> None:
+        """Add inotify watches for a folder (and its subfolders)."""
+        if any(directory == folder or directory.startswith(folder + os.sep) for folder in self.exclude):
+            return
+        try:
+            self._inotify.add_watch(directory)
+        except OSError as e:
+            logger.warning(f"Cannot watch {directory}: {e}")
+            return
+        if self.recursive:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            self._watch_tree(entry.path)
+            except OSError:
+                pass
+
+    def _touch(self, path: str, now: float) -> None:
+        """Register activity on a file; it is reported once it settles."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._pending.pop(path, None)
+            return
+        state = (stat.st_size, stat.st_mtime)
+        if self._reported.get(path) == state:
+            return
+        previous = self._pending.get(path)
+        if previous is None:
+            self._pending[path] = (state, now, now)
+        elif previous[0] != state:
+            self._pending[path] = (state, previous[1], now)
+
+    def _settle(self, now: float) -> None:
+        """Report pending files whose size and mtime stopped changing."""
+        for path, (state, detected, changed) in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            current = (stat.st_size, stat.st_mtime)
+            if current != state:
+                self._pending[path] = (current, detected, now)
+            elif now - changed >= self.settle_seconds and stat.st_size > 0:
+                del self._pending[path]
+                self._reported[path] = current
+                self.callback(path, detected)
+
+    def baseline(self) -> Dict[str, Tuple[int, float]]:
+        """Treat the current folder contents as already handled; returns the snapshot."""
+        snapshot = self._scan()
+        self._reported.update(snapshot)
+        return snapshot
+
+    def run(self) -> None:
+        """Watch until stop() is called."""
+        logger.info(f"Watching {self.root} ({self.mode})")
+        tick = min(0.25, self.settle_seconds / 2) if self.settle_seconds > 0 else 0.1
+
+        if self._inotify:
+            self._watch_tree(self.root)
+            while not self._stop.is_set():
+                for path, mask in self._inotify.read_events(tick):
+                    now = time.time()
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were lost: fall back to a full scan once
+                        logger.warning("inotify queue overflow, rescanning")
+                        for scanned in self._scan():
+                            self._touch(scanned, now)
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive:
+                            self._watch_tree(path)
+                            # Files may have landed before the watch was added
+                            for scanned in self._scan():
+                                if scanned.startswith(path + os.sep):
+                                    self._touch(scanned, now)
+                    elif self._is_candidate(path):
+                        self._touch(path, now)
+                self._settle(time.time())
+            self._inotify.close()
+        else:
+            next_scan = 0.0
+            while not self._stop.is_set():
+                now = time.time()
+                if now >= next_scan:
+                    for path in self._scan():
+                        self._touch(path, now)
+                    next_scan = now + self.poll_interval
+                self._settle(now)
+                self._stop.wait(tick)
+
+    def stop(self) -> None:
+        """Stop watching."""
+        self._stop.set()
+
+class WatchService:
+    """Watcher feeding a bounded queue served by warm worker threads."""
+
+    def __init__(self, root: str, handler: Callable[[str], bool], workers: int = 1,
+                 queue_size: int = 100, target_latency: float = 5.0, **watcher_options):
+        """
+        Initialize the service.
+
+        Args:
+            root: Folder to watch
+            handler: Processes one file, returns True on success
+            workers: Worker threads calling the handler
+            queue_size: Maximum number of files waiting for a worker
+            target_latency: Warn when detection-to-output time exceeds this (seconds)
+            watcher_options: Passed to FolderWatcher
+        """
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.target_latency = target_latency
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.watcher = FolderWatcher(root, self._enqueue, **watcher_options)
+        self.processed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def _enqueue(self, path: str, detected: float) -> None:
+        if self.queue.full():
+            logger.warning(f"Work queue full ({self.queue.maxsize}), waiting for workers")
+        # Blocks while the queue is full (back-pressure on the watcher)
+        self.queue.put((path, detected))
+
+    def _work(self) -> None:
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                return
+            path, detected = entry
+            try:
+                success = self.handler(path)
+            except Exception as e:
+                logger.error(f"Failed to process {path}: {e}")
+                success = False
+            latency = time.time() - detected
+            with self._lock:
+                if success:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+            if latency > self.target_latency:
+                logger.warning(f"Processed {path} in {latency:.2f}s (target {self.target_latency:.2f}s)")
+            else:
+                logger.info(f"Processed {path} in {latency:.2f}s")
+
+    def submit(self, path: str) -> None:
+        """Queue a file directly (e.g. catch-up work found at start)."""
+        self._enqueue(path, time.time())
+
+    def run(self, initial: Iterable[str] = (), stop_event: Optional[threading.Event] = None) -> None:
+        """
+        Run until interrupted (Ctrl+C) or until stop_event is set.
+
+        Args:
+            initial: Files to process first (e.g. images without an up-to-date output)
+            stop_event: Optional event that stops the service when set
+        """
+        # Existing files are handled through `initial`, not reported as new
+        self.watcher.baseline()
+
+        threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        watcher_thread = threading.Thread(target=self.watcher.run, daemon=True)
+        watcher_thread.start()
+        try:
+            for path in initial:
+                self.submit(path)
+            while watcher_thread.is_alive():
+                if stop_event is not None and stop_event.wait(0.5):
+                    break
+                watcher_thread.join(0.5)
+        except KeyboardInterrupt:
+            logger.info("Stopping watch mode")
+        finally:
+            self.watcher.stop()
+            watcher_thread.join()
+            for _ in threads:
+                self.queue.put(None)
+            for thread in threads:
+                thread.join()
+            logger.info(f"Watch mode stopped: {self.processed} processed, {self.failed} failed")
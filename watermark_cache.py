@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of watermarked outputs.
+
+Running the same folder with the same configuration again produces the same
+files. The cache stores every encoded output under a key made of:
+
+- the SHA-256 of the input file's content (memoized per path, size and
+  modification time, so unchanged inputs are not read again)
+- the effective watermark settings of the processor (including the content of
+  the PNG watermark)
+- the encoder profile (output format and save options)
+- the input file name (the image number is taken from it)
+
+A hit is linked into the output folder (hard link, or a copy where links are
+not possible, e.g. across file systems), so repeat runs are mostly metadata
+operations. Outputs are always renamed into place, never rewritten, so a
+linked output can not change the cache entry it shares its data with.
+
+The cache is bounded by size: trim() removes the least recently used entries
+(by modification time, which is refreshed on every hit). Several processes can
+share one cache directory.
+"""
+
+import errno
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Dict
+
+from watermark_script import PARTIAL_SUFFIX, encoder_profile
+
+logger = logging.getLogger(__name__)
+
+# Part of every key: bump when the rendering changes so old entries are not used
+CACHE_FORMAT = 1
+
+# Default cache size limit
+DEFAULT_MAX_BYTES = 20 * 1024 ** 3
+
+# Subfolder with the memoized input hashes
+INPUTS_DIR = 'inputs'
+
+# Link errors that mean "copy instead" (other file system, no link support)
+_LINK_ERRORS = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EACCES)
+
+def file_digest(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _link_or_copy(source: str, target: str) -> None:
+    """Hard link source to target, copying where links are not possible."""
+    try:
+        os.link(source, target)
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+        shutil.copyfile(source, target)
+
+class OutputCache:
+    """Size-bounded, content-addressed store of watermarked images."""
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize the cache.
+
+        Args:
+            directory: Cache folder (best on the same file system as the outputs,
+                so hits are hard links instead of copies)
+            max_bytes: Size the cache is trimmed to
+        """
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self._config_keys = {}
+        os.makedirs(os.path.join(self.directory, INPUTS_DIR), exist_ok=True)
+
+    def __getstate__(self) -> dict:
+        # Sent to worker processes without the per-process memo
+        return {'directory': self.directory, 'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state: dict) -> None:
+        self.directory = state['directory']
+        self.max_bytes = state['max_bytes']
+        self._config_keys = {}
+
+    def input_digest(self, input_path: str) -> str:
+        """Content hash of an input, read only if the file changed since it was last hashed."""
+        stat = os.stat(input_path)
+        memo_name = hashlib.sha1(os.path.abspath(input_path).encode('utf-8')).hexdigest()
+        memo_path = os.path.join(self.directory, INPUTS_DIR, memo_name[:2], memo_name)
+        stamp = f"{stat.st_size} {stat.st_mtime_ns}"
+        try:
+            with open(memo_path, encoding='utf-8') as f:
+                memo_stamp, digest = f.read().rsplit(' ', 1)
+            if memo_stamp == stamp:
+                return digest
+        except (OSError, ValueError):
+            pass
+
+        digest = file_digest(input_path)
+        try:
+            os.makedirs(os.path.dirname(memo_path), exist_ok=True)
+            partial_path = f"{memo_path}.{os.getpid()}{PARTIAL_SUFFIX}"
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                f.write(f"{stamp} {digest}")
+            os.replace(partial_path, memo_path)
+        except OSError as e:
+            logger.debug(f"Cannot memoize the hash of {input_path}: {e}")
+        return digest
+
+    def config_key(self, processor) -> str:
+        """Hash of a processor's effective watermark settings."""
+        key = self._config_keys.get(id(processor))
+        if key is None:
+            settings = processor.get_settings()
+            png_path = settings.get('png_watermark_path')
+            if png_path and os.path.isfile(png_path):
+                # The watermark file can change under the same name
+                settings['png_watermark_digest'] = file_digest(png_path)
+            payload = json.dumps([CACHE_FORMAT, settings], sort_keys=True, default=str)
+            key = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+            self._config_keys[id(processor)] = key
+        return key
+
+    def key(self, input_path: str, processor, output_path: str) -> str:
+        """Cache key of the output of an input with a processor."""
+        profile = json.dumps(encoder_profile(output_path), sort_keys=True)
+        parts = (self.input_digest(input_path), self.config_key(processor), profile, Path(input_path).name)
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def _entry_path(self, key: str, output_path: str) -> str:
+        return os.path.join(self.directory, key[:2], key + Path(output_path).suffix.lower())
+
+    def fetch(self, key: str, output_path: str) -> bool:
+        """Place the cached output at output_path; False on a miss."""
+        entry = self._entry_path(key, output_path)
+        if not os.path.exists(entry):
+            return False
+        partial_path = f"{output_path}.{os.getpid()}{PARTIAL_SUFFIX}"
+        try:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            _link_or_copy(entry, partial_path)
+            os.replace(partial_path, output_path)
+            # Most recently used (also keeps a linked output newer than its input)
+            os.utime(entry)
+        except OSError as e:
+            logger.debug(f"Output cache entry {entry} unusable: {e}")
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def store(self, key: str, output_path: str) -> None:
+        """Add a freshly written output to the cache."""
+        entry = self._entry_path(key, output_path)
+        if os.path.exists(entry):
+            return
+        partial_path = f"{entry}.{os.getpid()}{PARTIAL_SUFFIX}"
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            _link_or_copy(output_path, partial_path)
+            os.replace(partial_path, entry)
+        except OSError as e:
+            logger.warning(f"Cannot add {output_path} to the output cache: {e}")
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+
+    def trim(self) -> Dict[str, int]:
+        """
+        Remove the least recently used entries until the cache fits max_bytes.
+
+        Returns:
+            Dict[str, int]: entries and bytes left, removed entries
+        """
+        entries = []
+        total = 0
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir() or prefix.name == INPUTS_DIR:
+                continue
+            for entry in os.scandir(prefix.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith(PARTIAL_SUFFIX) and stat.st_mtime < time.time() - 3600:
+                    # Left behind by a killed process
+                    self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        removed = 0
+        if total > self.max_bytes:
+            entries.sort()
+            for _mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    total -= size
+                    removed += 1
+            logger.info(f"Output cache trimmed: {removed} entries removed, "
+                        f"{total / 1e6:.1f} MB in {len(entries) - removed} entries")
+        return {'entries': len(entries) - removed, 'bytes': total, 'removed': removed}
+
+    def _remove(self, path: str) -> bool:
+        try:
+            os.remove(path)
+            return True
+        except OSError as e:
+            logger.debug(f"Cannot remove output cache entry {path}: {e}")
+            return False
@@ -0,0 +1,827 @@
+#!/usr/bin/env python3
+"""
+Shared-Memory Watermark Process Pool
+
+Runs watermark work in a pool of worker processes. The decoded PNG watermark and
+the pre-rendered overlays are published once through multiprocessing.shared_memory;
+workers attach to them zero-copy instead of each decoding and rendering a private
+copy. Fonts are resolved once in the parent (Google Fonts are downloaded once) and
+workers load the cached font file.
+
+With a MemoryBudget, an image is only handed to the workers once its estimated
+decoded footprint fits next to the images already in flight, so several huge
+scans arriving together wait for each other instead of running out of memory.
+
+Workers can be recycled after a number of images to cap slow memory growth in
+long runs: the pool then drains the current generation of worker processes and
+starts a fresh one.
+
+A watchdog guards against images that stall or crash a worker (corrupt files,
+truncated progressive JPEGs, decompression bombs):
+
+- With max_pixels, images whose header exceeds the pixel limit are never
+  decoded
+- With image_timeout, the worker process of an image still running after the
+  timeout is killed
+- A killed or crashed worker breaks its generation of worker processes; a new
+  generation replaces it and the other images in flight are processed again
+- Images that were running when a worker crashed are retried one at a time in
+  a single probation worker, so the image that crashes it again is known
+- An image that timed out, exceeds the pixel limit or crashed the probation
+  worker fails with ImageQuarantined, which callers record in a
+  QuarantineList, so one bad file cannot stall a whole batch
+
+Cancelling an image's future stops it: a worker that has not started the
+image skips it, and the worker process running it is killed within
+WATCHDOG_INTERVAL like a timed-out one (the other images of its generation
+are processed again).
+
+A FairShareScheduler lets several jobs share one pool image by image: each
+job (or user) is a weighted flow, and free workers always take the next image
+of the flow that has received the least service for its weight, so a small job
+submitted during a large batch gets its share of the workers right away.
+"""
+
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import warnings
+from collections import Counter
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image
+
+from watermark_script import (PARTIAL_SUFFIX, MemoryBudget, WatermarkProcessor, estimate_image_memory,
+                              process_image_fanout, set_pixel_limit)
+
+logger = logging.getLogger(__name__)
+
+# Number of distinct image sizes to pre-render overlays for
+DEFAULT_OVERLAY_SIZES = 8
+
+# Seconds between the watchdog's checks of the images in progress
+WATCHDOG_INTERVAL = 0.5
+
+# Times an image is retried after losing its workers before it was started
+# (e.g. workers failing to start) before it fails
+MAX_RETRIES = 5
+
+# Signal stopping a stuck worker (TerminateProcess on Windows)
+KILL_SIGNAL = getattr(signal, 'SIGKILL', signal.SIGTERM)
+
+# Worker process state, set up by _init_worker()
+_worker_processors = {}
+_worker_segments = []
+_worker_cache = None
+_worker_started = None
+_worker_cancelled = None
+
+class ImageQuarantined(Exception):
+    """Raised for an image the pool set aside instead of processing it (see WatermarkProcessPool)."""
+    
+    def __init__(self, image: str, reason: str):
+        super().__init__(f"{image}: {reason}")
+        self.image = image
+        self.reason = reason
+
+class QuarantineList:
+    """Images set aside by the pool's limits, appended to a JSON lines file with the reason."""
+    
+    def __init__(self, path: str):
+        """
+        Initialize the list.
+        
+        Args:
+            path: JSON lines file the entries are appended to (created on the first entry)
+        """
+        self.path = path
+        self.entries = []
+        self._lock = threading.Lock()
+    
+    def add(self, image: str, reason: str, **fields) -> None:
+        """Record an image with the reason it was quarantined."""
+        entry = {'image': image, 'reason': reason, 'time': round(time.time(), 3)}
+        entry.update(fields)
+        logger.warning(f"Quarantined: {image} ({reason})")
+        with self._lock:
+            self.entries.append(entry)
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError as e:
+                logger.error(f"Cannot write quarantine list {self.path}: {e}")
+
+class _Task:
+    """An image submitted to the pool, until its future resolves."""
+    
+    __slots__ = ('input_path', 'output_paths', 'on_stats', 'future', 'reserved', 'flag',
+                 'executor', 'attempt', 'pid', 'started', 'timed_out', 'stopped', 'suspect', 'retries')
+    
+    def __init__(self, input_path: str, output_paths: Dict[str, str],
+                 on_stats: Optional[Callable[[dict], None]], future: concurrent.futures.Future):
+        self.input_path = input_path
+        self.output_paths = output_paths
+        self.on_stats = on_stats
+        self.future = future
+        self.reserved = 0
+        # Index of the task's cancel flag shared with the workers
+        self.flag = None
+        # Executor, worker future, worker process and start time of the current attempt
+        self.executor = None
+        self.attempt = None
+        self.pid = None
+        self.started = None
+        self.timed_out = False
+        # Cancelled while running: its worker process was killed
+        self.stopped = False
+        # Running when a worker crashed: retried in the probation worker
+        self.suspect = False
+        self.retries = 0
+
+class SharedAssetStore:
+    """Publishes decoded RGBA images in shared memory blocks."""
+    
+    def __init__(self):
+        """Initialize an empty asset store."""
+        self._segments = []
+        # Entries of (owner, key, shared memory name, image size)
+        self.manifest = []
+    
+    def publish(self, owner: str, key, image: Image.Image) -> None:
+        """Copy an image into a new shared memory block."""
+        if image.mode != 'RGBA':
+            image = image.convert('RGBA')
+        data = image.tobytes()
+        
+        shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+        shm.buf[:len(data)] = data
+        self._segments.append(shm)
+        self.manifest.append((owner, key, shm.name, image.size))
+    
+    @property
+    def total_bytes(self) -> int:
+        """Total size of the published shared memory blocks."""
+        return sum(shm.size for shm in self._segments)
+    
+    def close(self) -> None:
+        """Release and unlink all shared memory blocks."""
+        for shm in self._segments:
+            try:
+                shm.close()
+                shm.unlink()
+            except (BufferError, FileNotFoundError) as e:
+                logger.debug(f"Could not release shared memory {shm.name}: {e}")
+        self._segments = []
+        self.manifest = []
+
+def attach_shared_image(shm_name: str, size: Tuple[int, int]) -> Tuple[shared_memory.SharedMemory, Image.Image]:
+    """Attach to a published RGBA image without copying its pixels."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    image = Image.frombuffer('RGBA', size, shm.buf, 'raw', 'RGBA', 0, 1)
+    return shm, image
+
+def common_image_sizes(sizes: Iterable[Optional[Tuple[int, int]]],
+                       limit: int = DEFAULT_OVERLAY_SIZES) -> List[Tuple[int, int]]:
+    """Return the most frequent image sizes (to pre-render overlays for)."""
+    counts = Counter(size for size in sizes if size)
+    return [size for size, _ in counts.most_common(limit)]
+
+def _init_worker(processor_settings: Dict[str, dict], manifest: list, output_cache=None,
+                 started=None, max_pixels: Optional[int] = None, cancelled=None) -> None:
+    """Build the worker's processors on top of the shared assets."""
+    global _worker_cache, _worker_started, _worker_cancelled
+    # Workers must stop when the pool terminates them, not run a stop handler of the parent
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    _worker_cache = output_cache
+    _worker_started = started
+    _worker_cancelled = cancelled
+    set_pixel_limit(max_pixels)
+    images = {}
+    for owner, key, shm_name, size in manifest:
+        shm, image = attach_shared_image(shm_name, size)
+        _worker_segments.append(shm)
+        images[(owner, key)] = image
+    
+    for name, settings in processor_settings.items():
+        processor = WatermarkProcessor(png_watermark_image=images.get((name, 'watermark')), **settings)
+        processor.seed_overlays({
+            key: image for (owner, key), image in images.items()
+            if owner == name and key != 'watermark'
+        })
+        _worker_processors[name] = processor
+
+def _worker_ready() -> bool:
+    """No-op task used to start worker processes ahead of the first image."""
+    return True
+
+def _process_in_worker(input_path: str, output_paths: Dict[str, str],
+                       dispatch_id: Optional[int] = None, flag: Optional[int] = None) -> Tuple[Dict[str, bool], dict]:
+    """Process one image with the worker's processors; returns the results and the worker's measurements."""
+    if _worker_cancelled is not None and flag is not None and _worker_cancelled[flag]:
+        raise concurrent.futures.CancelledError(input_path)
+    if _worker_started is not None:
+        # Tells the pool which process works on the image since when; written
+        # synchronously so the report survives a crash of the worker
+        _worker_started.send((dispatch_id, os.getpid(), time.time()))
+    stats = {}
+    results = process_image_fanout(input_path, output_paths, _worker_processors, stats, _worker_cache)
+    return results, stats
+
+class WatermarkProcessPool:
+    """Process pool whose workers share the decoded watermark assets."""
+    
+    def __init__(self, processors: Dict[str, WatermarkProcessor], workers: int,
+                 recycle_after: Optional[int] = None,
+                 overlay_sizes: Iterable[Tuple[int, int]] = (), output_cache=None,
+                 memory_budget: Optional[MemoryBudget] = None,
+                 image_timeout: Optional[float] = None, max_pixels: Optional[int] = None):
+        """
+        Initialize the process pool.
+        
+        Args:
+            processors: WatermarkProcessor per name, configured in the parent
+            workers: Number of worker processes
+            recycle_after: Replace a worker after it processed this many images
+            overlay_sizes: Image sizes to pre-render overlays for
+            output_cache: watermark_cache.OutputCache the workers take finished
+                outputs from and add new ones to
+            memory_budget: Memory the images in flight (queued in the workers
+                included) may take together; None for no limit
+            image_timeout: Seconds an image may run in a worker before the
+                worker is killed and the image quarantined (None: no limit)
+            max_pixels: Images with more pixels (from the header) are
+                quarantined without being decoded; also becomes Pillow's
+                decompression bomb limit (None: Pillow's own limit)
+        """
+        # Render the overlays once here so workers never render them privately
+        for size in overlay_sizes:
+            for processor in processors.values():
+                processor.prerender_overlays(size)
+        
+        settings = {name: processor.get_settings() for name, processor in processors.items()}
+        
+        self.assets = SharedAssetStore()
+        try:
+            for name, processor in processors.items():
+                if processor.png_watermark is not None:
+                    self.assets.publish(name, 'watermark', processor.png_watermark)
+                for key, overlay in processor.get_overlays().items():
+                    self.assets.publish(name, key, overlay)
+        except Exception:
+            self.assets.close()
+            raise
+        
+        logger.info(f"Published {len(self.assets.manifest)} watermark assets "
+                    f"({self.assets.total_bytes / 1e6:.1f} MB) in shared memory")
+        
+        self.workers = max(1, workers)
+        self.recycle_after = recycle_after
+        self._settings = settings
+        self.output_cache = output_cache
+        self.memory_budget = memory_budget
+        self.image_timeout = image_timeout
+        self.max_pixels = max_pixels
+        set_pixel_limit(max_pixels)
+        self._submitted = 0
+        # Bounded in-flight work so worker generations can be swapped as we go
+        self._slots = threading.BoundedSemaphore(self.workers * 2)
+        # Cancel flags the workers check before starting an image, one per slot
+        self._cancel_flags = multiprocessing.RawArray('b', self.workers * 2)
+        self._free_flags = list(range(self.workers * 2))
+        self._retired = []
+        self._lock = threading.Lock()
+        self._dispatch_ids = itertools.count()
+        # Attempts in the workers by dispatch ID, and executors the watchdog killed a worker of
+        self._running = {}
+        self._killed = set()
+        # Workers report on this pipe which image they start (small messages: atomic writes)
+        self._starts, self._starts_writer = multiprocessing.Pipe(duplex=False)
+        self._starts_lock = threading.Lock()
+        self.executor = self._start_executor()
+        # Single worker for images suspected of crashing a worker (started on demand)
+        self._probation = None
+        self._closed = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name='watermark-watchdog', daemon=True)
+        self._watchdog.start()
+    
+    def _start_executor(self, workers: Optional[int] = None) -> concurrent.futures.ProcessPoolExecutor:
+        """Start a new generation of worker processes."""
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers or self.workers,
+            initializer=_init_worker,
+            initargs=(self._settings, self.assets.manifest, self.output_cache,
+                      self._starts_writer, self.max_pixels, self._cancel_flags)
+        )
+    
+    def warm_up(self) -> None:
+        """Start all worker processes now instead of on the first submitted image."""
+        futures = [self.executor.submit(_worker_ready) for _ in range(self.workers)]
+        concurrent.futures.wait(futures)
+    
+    def submit(self, input_path: str, output_paths: Dict[str, str],
+               on_stats: Optional[Callable[[dict], None]] = None,
+               memory: Optional[int] = None) -> concurrent.futures.Future:
+        """
+        Queue an image; the future resolves to the success per processor name.
+        
+        Blocks while the pool already has enough work in flight, or while the
+        image does not fit the memory budget. The future fails with
+        ImageQuarantined if the image exceeds the pool's limits.
+        
+        The future stays pending until the image is done, so it can be
+        cancelled: a worker that has not started the image skips it, and a
+        worker process already running it is killed within WATCHDOG_INTERVAL
+        (its generation is replaced and the other images in it are processed
+        again). Outputs of a stopped image are never left half written.
+        
+        Args:
+            input_path: Image to process
+            output_paths: Output path per processor name
+            on_stats: Called with the worker's measurements of the image
+                (see process_image_fanout) before the future resolves
+            memory: Estimated footprint of the image (default: read from its
+                header when the pool has a memory budget, for all output_paths)
+        """
+        future = concurrent.futures.Future()
+        
+        info = None
+        if self.max_pixels or (self.memory_budget is not None and memory is None):
+            try:
+                # Images over the limit are quarantined below, without Pillow's warning
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                    with Image.open(input_path) as img:
+                        info = img.size, img.mode
+            except Image.DecompressionBombError as e:
+                future.set_exception(ImageQuarantined(input_path, str(e)))
+                return future
+            except Exception:
+                # Unreadable: the worker reports why
+                pass
+        if self.max_pixels and info and info[0][0] * info[0][1] > self.max_pixels:
+            (width, height), _mode = info
+            future.set_exception(ImageQuarantined(
+                input_path, f"{width}x{height} pixels exceed the limit of {self.max_pixels / 1e6:g} MP"))
+            return future
+        
+        # Workers are recycled by generation: once a generation has been handed
+        # recycle_after images per worker, it drains and a fresh one takes over
+        with self._lock:
+            if self.recycle_after and self._submitted >= self.recycle_after * self.workers:
+                logger.debug("Recycling watermark worker processes")
+                self.executor.shutdown(wait=False)
+                self._retired.append(self.executor)
+                self.executor = self._start_executor()
+                self._submitted = 0
+        
+        task = _Task(input_path, output_paths, on_stats, future)
+        if self.memory_budget is not None:
+            if memory is None:
+                memory = estimate_image_memory(*info, configs=len(output_paths)) if info else 0
+            task.reserved = self.memory_budget.acquire(memory, input_path)
+        self._slots.acquire()
+        with self._lock:
+            task.flag = self._free_flags.pop()
+            self._cancel_flags[task.flag] = 0
+        try:
+            self._dispatch(task)
+        except Exception:
+            self._release(task)
+            raise
+        future.add_done_callback(lambda done: self._cancel(task) if done.cancelled() else None)
+        return future
+    
+    def _dispatch(self, task: _Task) -> None:
+        """Hand an image to the current generation of workers (suspects to the probation worker)."""
+        with self._lock:
+            if task.suspect and self._probation is None:
+                self._probation = self._start_executor(1)
+            executor = self._probation if task.suspect else self.executor
+            dispatch_id = next(self._dispatch_ids)
+            arguments = (task.input_path, task.output_paths, dispatch_id, task.flag)
+            try:
+                worker_future = executor.submit(_process_in_worker, *arguments)
+            except BrokenProcessPool:
+                executor = self._replace_executor_locked(executor)
+                worker_future = executor.submit(_process_in_worker, *arguments)
+            if executor is self.executor:
+                self._submitted += 1
+            task.executor, task.attempt, task.pid, task.started = executor, worker_future, None, None
+            self._running[dispatch_id] = task
+        worker_future.add_done_callback(lambda done: self._relay(task, dispatch_id, done))
+    
+    def _relay(self, task: _Task, dispatch_id: int, done: concurrent.futures.Future) -> None:
+        """Resolve a task from its attempt in the workers, retrying it if its generation broke."""
+        try:
+            results, stats = done.result()
+        except BrokenProcessPool as e:
+            # The start report of a crashed worker may not have been read yet
+            self._read_starts()
+            with self._lock:
+                self._running.pop(dispatch_id, None)
+                self._replace_executor_locked(task.executor)
+            if task.pid is not None:
+                # A killed worker cannot clean up after itself
+                for output_path in task.output_paths.values():
+                    with contextlib.suppress(OSError):
+                        os.remove(f"{output_path}.{task.pid}{PARTIAL_SUFFIX}")
+            if task.future.cancelled():
+                self._release(task)
+                return
+            if task.timed_out:
+                self._resolve(task, exception=ImageQuarantined(
+                    task.input_path, f"still running after {self.image_timeout:g} seconds"))
+                return
+            # Images lost to a worker the watchdog killed are not to blame
+            if task.executor not in self._killed:
+                if task.started is None:
+                    task.retries += 1
+                elif task.suspect:
+                    self._resolve(task, exception=ImageQuarantined(
+                        task.input_path, "crashed the worker process, also when processed alone"))
+                    return
+                else:
+                    task.suspect = True
+            if task.retries > MAX_RETRIES:
+                self._resolve(task, exception=e)
+                return
+            try:
+                self._dispatch(task)
+            except BaseException as dispatch_error:
+                self._resolve(task, exception=dispatch_error)
+            return
+        except BaseException as e:
+            with self._lock:
+                self._running.pop(dispatch_id, None)
+            self._resolve(task, exception=e)
+            return
+        with self._lock:
+            self._running.pop(dispatch_id, None)
+        if task.on_stats is not None:
+            try:
+                task.on_stats(stats)
+            except Exception as e:
+                logger.debug(f"Image statistics callback failed: {e}")
+        self._resolve(task, results)
+    
+    def _release(self, task: _Task) -> None:
+        if task.flag is not None:
+            with self._lock:
+                self._free_flags.append(task.flag)
+            task.flag = None
+        self._slots.release()
+        if task.reserved:
+            self.memory_budget.release(task.reserved)
+            task.reserved = 0
+    
+    def _resolve(self, task: _Task, results: Optional[Dict[str, bool]] = None,
+                 exception: Optional[BaseException] = None) -> None:
+        self._release(task)
+        # A cancelled future stays cancelled
+        with contextlib.suppress(concurrent.futures.InvalidStateError):
+            if exception is not None:
+                task.future.set_exception(exception)
+            else:
+                task.future.set_result(results)
+    
+    def _cancel(self, task: _Task) -> None:
+        """Stop a cancelled image: no worker starts it any more, a worker running it is killed."""
+        with self._lock:
+            if task.flag is not None:
+                self._cancel_flags[task.flag] = 1
+            attempt = task.attempt
+        # Still waiting in the executor: dropped before it reaches a worker
+        if attempt is not None and attempt.cancel():
+            return
+        self._read_starts()
+        self._stop_cancelled()
+    
+    def _stop_cancelled(self) -> None:
+        """Kill the worker processes running cancelled images."""
+        with self._lock:
+            cancelled = [task for task in self._running.values()
+                         if task.started is not None and task.future.cancelled()
+                         and not task.stopped and not task.timed_out]
+            for task in cancelled:
+                task.stopped = True
+                self._killed.add(task.executor)
+        for task in cancelled:
+            logger.info(f"{task.input_path} cancelled, killing worker process {task.pid}")
+            try:
+                os.kill(task.pid, KILL_SIGNAL)
+            except OSError as e:
+                logger.debug(f"Cannot kill worker process {task.pid}: {e}")
+    
+    def _replace_executor_locked(self, broken: concurrent.futures.ProcessPoolExecutor
+                                 ) -> concurrent.futures.ProcessPoolExecutor:
+        """Replace `broken` if it is the current generation or probation worker (lock held); returns its successor."""
+        if broken is self._probation:
+            self._retired.append(broken)
+            self._probation = self._start_executor(1)
+            return self._probation
+        if broken is self.executor:
+            logger.warning("Watermark worker process lost, starting new worker processes")
+            self._retired.append(broken)
+            self.executor = self._start_executor()
+            self._submitted = 0
+        return self.executor
+    
+    def _read_starts(self) -> None:
+        """Record the workers' start reports: which process runs which image since when."""
+        with self._starts_lock:
+            try:
+                while self._starts.poll():
+                    dispatch_id, pid, started = self._starts.recv()
+                    with self._lock:
+                        task = self._running.get(dispatch_id)
+                        if task is not None:
+                            task.pid, task.started = pid, started
+            except (OSError, EOFError) as e:
+                logger.debug(f"Cannot read worker start reports: {e}")
+    
+    def _watch(self) -> None:
+        """Kill the worker processes of cancelled images and of images running longer than the image timeout."""
+        while not self._closed.wait(WATCHDOG_INTERVAL):
+            self._read_starts()
+            # Images cancelled before their start report was read
+            self._stop_cancelled()
+            if not self.image_timeout:
+                continue
+            
+            now = time.time()
+            with self._lock:
+                overdue = [task for task in self._running.values()
+                           if task.started is not None and not task.timed_out and not task.stopped
+                           and now - task.started > self.image_timeout]
+                for task in overdue:
+                    task.timed_out = True
+                    self._killed.add(task.executor)
+            for task in overdue:
+                logger.warning(f"{task.input_path} still running after {self.image_timeout:g} seconds, "
+                               f"killing worker process {task.pid}")
+                try:
+                    os.kill(task.pid, KILL_SIGNAL)
+                except OSError as e:
+                    logger.debug(f"Cannot kill worker process {task.pid}: {e}")
+    
+    def shutdown(self) -> None:
+        """Wait for the workers and release the shared memory."""
+        # Images retried after a worker was lost run on new executors: wait for those too
+        while True:
+            with self._lock:
+                executors = [self.executor, self._probation]
+            for executor in executors:
+                if executor is not None:
+                    executor.shutdown(wait=True)
+            with self._lock:
+                if [self.executor, self._probation] == executors:
+                    break
+        for executor in self._retired:
+            executor.shutdown(wait=True)
+        self._retired = []
+        self._closed.set()
+        self._watchdog.join()
+        self._starts.close()
+        self._starts_writer.close()
+        self.assets.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+        return False
+
+class FairShareClient:
+    """One job's view of a FairShareScheduler, usable wherever a pool's submit() is."""
+    
+    def __init__(self, scheduler: 'FairShareScheduler', key: str, weight: float,
+                 context: Optional[Callable[[], contextlib.AbstractContextManager]] = None):
+        self.scheduler = scheduler
+        self.key = key
+        self.weight = weight
+        self.context = context or contextlib.nullcontext
+    
+    def submit(self, input_path: str, output_paths: Dict[str, str],
+               on_stats: Optional[Callable[[dict], None]] = None,
+               memory: Optional[int] = None) -> concurrent.futures.Future:
+        """
+        Queue an image in this client's flow; the future resolves to the success per processor name.
+        
+        Cancelling the future drops the image if it has not been dispatched
+        yet and stops it in the pool otherwise (see WatermarkProcessPool.submit).
+        """
+        future = concurrent.futures.Future()
+        self.scheduler._enqueue(self, (input_path, output_paths, on_stats, future, memory))
+        return future
+    
+    def close(self) -> None:
+        """Leave the scheduler (queued images are still processed)."""
+        self.scheduler._detach(self)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+class _Flow:
+    """Queued images of one job or user."""
+    
+    __slots__ = ('key', 'weight', 'queue', 'pass_value', 'clients')
+    
+    def __init__(self, key: str, weight: float):
+        self.key = key
+        self.weight = weight
+        self.queue = collections.deque()
+        self.pass_value = 0.0
+        self.clients = 0
+
+class FairShareScheduler:
+    """
+    Weighted fair queueing of images from several jobs onto one process pool.
+    
+    Each flow's pass value grows by 1 / weight per dispatched image and a free
+    worker takes the next image of the flow with the lowest pass value; flows
+    that become active start at the current virtual time, so idle time earns
+    no credit. At most one image per worker is dispatched, so a newly arrived
+    flow waits for one image to finish, not for a backlog in the pool.
+    
+    With a budget (k1_jobs.WorkerBudget), workers are taken from it one image
+    at a time and handed back when the flows run dry or another job waits for
+    workers.
+    """
+    
+    def __init__(self, pool: WatermarkProcessPool, budget=None, poll_interval: float = 0.05):
+        """
+        Initialize the scheduler.
+        
+        Args:
+            pool: Process pool the images run on
+            budget: Optional shared worker budget (try_acquire/release/waiting)
+            poll_interval: Seconds between budget checks while the budget is used up
+        """
+        self.pool = pool
+        self.budget = budget
+        self.poll_interval = poll_interval
+        self._flows = {}
+        self._virtual_time = 0.0
+        self._busy = 0
+        self._held = 0
+        self._closed = False
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name='fair-share-dispatcher', daemon=True)
+        self._thread.start()
+    
+    def client(self, key: str, weight: float = 1.0,
+               context: Optional[Callable[[], contextlib.AbstractContextManager]] = None) -> FairShareClient:
+        """
+        Join the scheduler.
+        
+        Args:
+            key: Flow of the client; clients with the same key (e.g. one user's
+                jobs) share one fair share
+            weight: Relative share of the workers (e.g. higher for priority jobs)
+            context: Entered while the client's futures are resolved (their
+                callbacks run on the scheduler's threads)
+        """
+        client = FairShareClient(self, key, max(weight, 0.01), context)
+        with self._changed:
+            flow = self._flows.get(key)
+            if flow is None:
+                flow = self._flows[key] = _Flow(key, client.weight)
+            else:
+                flow.weight = max(flow.weight, client.weight)
+            flow.clients += 1
+        return client
+    
+    def _detach(self, client: FairShareClient) -> None:
+        with self._changed:
+            flow = self._flows.get(client.key)
+            if flow is None:
+                return
+            flow.clients -= 1
+            if flow.clients <= 0 and not flow.queue:
+                del self._flows[client.key]
+    
+    def _enqueue(self, client: FairShareClient, task: tuple) -> None:
+        with self._changed:
+            if self._closed:
+                raise RuntimeError("Scheduler is shut down")
+            flow = self._flows[client.key]
+            if not flow.queue:
+                flow.pass_value = max(flow.pass_value, self._virtual_time)
+            flow.queue.append((client, task))
+            self._changed.notify_all()
+    
+    def _next_flow(self) -> Optional[_Flow]:
+        active = [flow for flow in self._flows.values() if flow.queue]
+        return min(active, key=lambda flow: flow.pass_value) if active else None
+    
+    def _reserve_worker(self) -> bool:
+        """Make sure a worker is available for one more image (lock held)."""
+        if self._busy < self._held:
+            return True
+        if self._held >= self.pool.workers:
+            return False
+        if self.budget is not None and not self.budget.try_acquire(1):
+            return False
+        self._held += 1
+        return True
+    
+    def _return_workers(self, queued: bool) -> None:
+        """Give idle budget workers back (lock held)."""
+        if self.budget is None:
+            return
+        spare = self._held - self._busy
+        if spare > 0 and (not queued or self.budget.waiting):
+            self._held -= spare
+            self.budget.release(spare)
+    
+    @property
+    def stats(self) -> Dict[str, object]:
+        """Images in flight and queued per flow."""
+        with self._changed:
+            return {'busy': self._busy, 'workers': self._held,
+                    'queued': {key: len(flow.queue) for key, flow in self._flows.items()}}
+    
+    def _run(self) -> None:
+        while True:
+            with self._changed:
+                while True:
+                    if self._closed:
+                        return
+                    flow = self._next_flow()
+                    if flow is not None and self._reserve_worker():
+                        break
+                    self._return_workers(flow is not None)
+                    self._changed.wait(self.poll_interval if flow is not None else None)
+                client, task = flow.queue.popleft()
+                if not flow.queue and flow.clients <= 0:
+                    del self._flows[flow.key]
+                # Images cancelled while queued are dropped
+                if task[3].cancelled():
+                    continue
+                self._virtual_time = flow.pass_value
+                flow.pass_value += 1.0 / flow.weight
+                self._busy += 1
+            self._dispatch(client, task)
+    
+    def _dispatch(self, client: FairShareClient, task: tuple) -> None:
+        input_path, output_paths, on_stats, future, memory = task
+        try:
+            worker_future = self.pool.submit(input_path, output_paths, on_stats, memory=memory)
+        except BaseException as e:
+            self._finished()
+            with client.context(), contextlib.suppress(concurrent.futures.InvalidStateError):
+                future.set_exception(e)
+            return
+        
+        def resolve(done: concurrent.futures.Future) -> None:
+            self._finished()
+            # The client's future may have been cancelled meanwhile
+            with client.context(), contextlib.suppress(concurrent.futures.InvalidStateError):
+                try:
+                    future.set_result(done.result())
+                except BaseException as e:
+                    future.set_exception(e)
+        
+        # The client's future stays pending while the image runs: cancelling it stops the image
+        future.add_done_callback(lambda client_future: worker_future.cancel() if client_future.cancelled() else None)
+        worker_future.add_done_callback(resolve)
+    
+    def _finished(self) -> None:
+        with self._changed:
+            self._busy -= 1
+            # Let a job waiting for the budget in before taking the next image
+            if self.budget is not None and self.budget.waiting and self._held > self._busy:
+                self._held -= 1
+                self.budget.release(1)
+            self._changed.notify_all()
+    
+    def shutdown(self) -> None:
+        """Stop dispatching; images already in the pool finish, queued ones are cancelled."""
+        with self._changed:
+            self._closed = True
+            flows = list(self._flows.values())
+            self._flows = {}
+            if self.budget is not None and self._held:
+                self.budget.release(self._held)
+            self._held = 0
+            self._changed.notify_all()
+        for flow in flows:
+            for client, task in flow.queue:
+                if task[3].set_running_or_notify_cancel():
+                    with client.context():
+                        task[3].set_exception(RuntimeError("Scheduler is shut down"))
@@ -5,14 +5,22 @@ Adds custom PNG watermark and auto-generated number watermark to images in batch
 """
 
 import argparse
+import collections
+import contextlib
+import hashlib
+import inspect
+import io
 import os
 import re
 import logging
 import requests
 import tempfile
+import threading
+import time
+import warnings
 from pathlib import Path
-from typing import Optional, Tuple
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageMode, ImageOps
 import sys
 
 # Configure logging
@@ -26,6 +34,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Maximum number of pre-rendered overlays kept per processor
+OVERLAY_CACHE_SIZE = 32
+
+# Anything the library API accepts as an image: encoded bytes, a binary file-like
+# object or an already decoded image
+ImageSource = Union[bytes, bytearray, memoryview, BinaryIO, Image.Image]
+
+# Default encoder options (maximum quality, no optimization) per Pillow format
+ENCODER_DEFAULTS = {
+    'JPEG': {'quality': 100, 'optimize': False},
+    'PNG': {'optimize': False},
+    'WEBP': {'quality': 100},
+    'TIFF': {},
+    'BMP': {},
+}
+
+# Output directories already known to exist
+_created_dirs = set()
+
+# Suffix of images being written (renamed to the output name when complete)
+PARTIAL_SUFFIX = '.part'
+
 class WatermarkProcessor:
     """Handles watermark processing for images."""
     
@@ -41,7 +71,8 @@ class WatermarkProcessor:
                  custom_text_shadow_offset: int = 3, custom_text_shadow_blur: int = 1,
                  custom_text_shadow_opacity: float = 0.8, custom_text_size_ratio: float = 0.04, custom_text_opacity: float = 0.8,
                  png_position: str = 'center-bottom', png_x_offset: int = 0, png_y_offset: int = 0,
-                 number_x_offset: int = 0, number_y_offset: int = 0):
+                 number_x_offset: int = 0, number_y_offset: int = 0,
+                 png_watermark_image: Image.Image = None):
         """
         Initialize watermark processor.
         
@@ -74,6 +105,7 @@ class WatermarkProcessor:
             png_y_offset: Y offset for PNG watermark position (can be negative)
             number_x_offset: X offset for number watermark position (can be negative)
             number_y_offset: Y offset for number watermark position (can be negative)
+            png_watermark_image: Already decoded RGBA watermark (skips loading png_watermark_path)
         """
         self.png_watermark_path = png_watermark_path
         self.enable_numbering = enable_numbering
@@ -105,10 +137,125 @@ class WatermarkProcessor:
         self.number_y_offset = number_y_offset
         
         # Load PNG watermark (if provided)
-        self.png_watermark = self._load_png_watermark() if png_watermark_path else None
+        if png_watermark_image is not None:
+            self.png_watermark = png_watermark_image
+        else:
+            self.png_watermark = self._load_png_watermark() if png_watermark_path else None
         
         # Initialize font
         self.font = self._initialize_font()
+        
+        # Pre-rendered overlays (resized PNG, custom text) shared by same-sized images;
+        # threads share the processor, so the cache and its counters are locked
+        self._overlay_cache = {}
+        self._cache_lock = threading.Lock()
+        self._thread_counts = threading.local()
+        self.cache_hits = 0
+        self.cache_misses = 0
+    
+    def get_settings(self) -> dict:
+        """
+        Return constructor arguments to rebuild an equivalent processor.
+        
+        Downloaded Google Fonts are passed as the resolved font file so other
+        processes can reuse the download.
+        """
+        parameters = inspect.signature(WatermarkProcessor.__init__).parameters
+        settings = {
+            name: getattr(self, name, parameter.default)
+            for name, parameter in parameters.items()
+            if name not in ('self', 'png_watermark_image')
+        }
+        font_path = getattr(self.font, 'path', None)
+        if font_path and not settings['custom_font_path']:
+            settings['custom_font_path'] = font_path
+            settings['google_font_name'] = None
+        return settings
+    
+    def _count_cache(self, hit: bool) -> None:
+        """Count a cache lookup in the totals and in the current thread's counts (lock held)."""
+        counts = self._thread_counts
+        if hit:
+            self.cache_hits += 1
+            counts.hits = getattr(counts, 'hits', 0) + 1
+        else:
+            self.cache_misses += 1
+            counts.misses = getattr(counts, 'misses', 0) + 1
+    
+    def cache_counts(self) -> Tuple[int, int]:
+        """
+        Return the overlay cache hits and misses of the current thread.
+        
+        Differences of these counts measure one image even while other
+        threads use the same processor.
+        """
+        counts = self._thread_counts
+        return getattr(counts, 'hits', 0), getattr(counts, 'misses', 0)
+    
+    def _get_overlay(self, key: tuple, render) -> Image.Image:
+        """Return a cached overlay, rendering it on first use."""
+        with self._cache_lock:
+            overlay = self._overlay_cache.get(key)
+            self._count_cache(overlay is not None)
+        if overlay is not None:
+            return overlay
+        
+        # Rendered outside the lock: threads missing the same key render it twice
+        overlay = render()
+        with self._cache_lock:
+            if key not in self._overlay_cache and len(self._overlay_cache) >= OVERLAY_CACHE_SIZE:
+                # Evict the oldest entry
+                self._overlay_cache.pop(next(iter(self._overlay_cache)), None)
+            self._overlay_cache[key] = overlay
+        return overlay
+    
+    def get_overlays(self) -> dict:
+        """Return the pre-rendered overlays keyed by their cache key."""
+        with self._cache_lock:
+            return dict(self._overlay_cache)
+    
+    def seed_overlays(self, overlays: dict) -> None:
+        """Install pre-rendered overlays (e.g. attached from shared memory)."""
+        with self._cache_lock:
+            self._overlay_cache.update(overlays)
+    
+    def prerender_overlays(self, image_size: Tuple[int, int]) -> None:
+        """Render the image-independent overlays for images of the given size."""
+        width, height = image_size
+        if self.png_watermark:
+            self._get_png_overlay(width, height)
+        elif self.custom_text:
+            self._get_custom_text_overlay(height)
+    
+    def _get_png_overlay(self, img_width: int, img_height: int) -> Image.Image:
+        """Return the resized PNG watermark with opacity applied for an image size."""
+        def render() -> Image.Image:
+            resized_png = self._resize_png_watermark((img_width, img_height))
+            
+            # Create a copy of PNG watermark with proper alpha handling
+            # Instead of overwriting alpha with putalpha(), we'll blend the alpha properly
+            png_with_opacity = resized_png.copy()
+            
+            # Get the original alpha channel
+            original_alpha = png_with_opacity.split()[-1]  # Get alpha channel
+            
+            # Apply opacity to the alpha channel while preserving transparency
+            if self.png_opacity != 1.0:
+                # Create new alpha channel with adjusted opacity
+                new_alpha = original_alpha.point(lambda x: int(x * self.png_opacity))
+                png_with_opacity.putalpha(new_alpha)
+            
+            return png_with_opacity
+        
+        return self._get_overlay(('png', img_width, img_height), render)
+    
+    def _get_custom_text_overlay(self, img_height: int) -> Image.Image:
+        """Return the custom text watermark for an image height."""
+        font_size = max(16, int(img_height * self.custom_text_size_ratio))
+        return self._get_overlay(
+            ('text', font_size),
+            lambda: self._create_custom_text_watermark(self.custom_text, img_height)
+        )
     
     def _load_png_watermark(self) -> Optional[Image.Image]:
         """Load and validate PNG watermark."""
@@ -214,19 +361,19 @@ class WatermarkProcessor:
         logger.warning(f"No numbers found in filename: {filename}")
         return None
     
-    def _calculate_watermark_positions(self, image: Image.Image) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    def _calculate_watermark_positions(self, image_size: Tuple[int, int]) -> Tuple[Tuple[int, int], Tuple[int, int]]:
         """Calculate positions for both watermarks."""
-        img_width, img_height = image.size
+        img_width, img_height = image_size
         
         # PNG watermark position (center-bottom) or custom text position
         if self.png_watermark:
             png_width, png_height = self.png_watermark.size
-            png_x, png_y = self._calculate_png_position(image, img_width, img_height, png_width, png_height)
+            png_x, png_y = self._calculate_png_position(img_width, img_height, png_width, png_height)
         elif self.custom_text:
-            # Create temporary text watermark to get dimensions
-            temp_text_watermark = self._create_custom_text_watermark(self.custom_text, image)
+            # Use the (cached) text watermark to get dimensions
+            temp_text_watermark = self._get_custom_text_overlay(img_height)
             png_width, png_height = temp_text_watermark.size
-            png_x, png_y = self._calculate_custom_text_position(image, img_width, img_height, png_width, png_height)
+            png_x, png_y = self._calculate_custom_text_position(img_width, img_height, png_width, png_height)
         else:
             # No watermark
             png_x, png_y = 0, 0
@@ -237,7 +384,7 @@ class WatermarkProcessor:
         
         return (png_x, png_y), (number_x, number_y)
     
-    def _calculate_number_position(self, image: Image.Image, img_width: int, img_height: int, number_width: int = None, number_height: int = None) -> Tuple[int, int]:
+    def _calculate_number_position(self, img_width: int, img_height: int, number_width: int = None, number_height: int = None) -> Tuple[int, int]:
         """Calculate number watermark position based on configuration."""
         # Add extra safety margin for shadow effects to prevent cutting (same as custom text)
         # The watermark canvas now properly accounts for shadows, but we need safety margins for positioning
@@ -276,7 +423,7 @@ class WatermarkProcessor:
             y_pos = img_height - number_height - self.margin - safety_margin + self.number_y_offset
             return (x_pos, y_pos)
     
-    def _calculate_custom_text_position(self, image: Image.Image, img_width: int, img_height: int, text_width: int, text_height: int) -> Tuple[int, int]:
+    def _calculate_custom_text_position(self, img_width: int, img_height: int, text_width: int, text_height: int) -> Tuple[int, int]:
         """Calculate custom text watermark position based on configuration."""
         # IMPORTANT: text_width and text_height are actually the CANVAS dimensions (including shadows)
         # This is passed from _calculate_watermark_positions after creating the watermark
@@ -299,7 +446,7 @@ class WatermarkProcessor:
         else:  # center-bottom (default)
             return ((img_width - text_width) // 2, img_height - text_height - self.margin - safety_margin)
     
-    def _calculate_png_position(self, image: Image.Image, img_width: int, img_height: int, png_width: int, png_height: int) -> Tuple[int, int]:
+    def _calculate_png_position(self, img_width: int, img_height: int, png_width: int, png_height: int) -> Tuple[int, int]:
         """Calculate PNG watermark position based on configuration."""
         if self.png_position == 'top-left':
             x_pos = self.margin + self.png_x_offset
@@ -332,9 +479,9 @@ class WatermarkProcessor:
             y_pos = img_height - png_height - self.margin + self.png_y_offset
             return (x_pos, y_pos)
     
-    def _resize_png_watermark(self, image: Image.Image) -> Image.Image:
+    def _resize_png_watermark(self, image_size: Tuple[int, int]) -> Image.Image:
         """Resize PNG watermark proportionally based on image size."""
-        img_width, img_height = image.size
+        img_width, img_height = image_size
         
         # Calculate target size (increased from 20% to 30% of image width for bigger watermark)
         max_width = int(img_width * 0.3)  # Increased from 0.2 to 0.3
@@ -355,10 +502,10 @@ class WatermarkProcessor:
         
         return self.png_watermark
     
-    def _create_number_watermark(self, number: str, image: Image.Image) -> Image.Image:
+    def _create_number_watermark(self, number: str, img_height: int) -> Image.Image:
         """Create number watermark with customizable drop shadow effect."""
         # Calculate font size based on image dimensions
-        font_size = max(12, int(image.height * self.font_size_ratio))
+        font_size = max(12, int(img_height * self.font_size_ratio))
         
         try:
             # Try to load font with calculated size
@@ -463,10 +610,10 @@ class WatermarkProcessor:
             logger.warning(f"Invalid color '{color}', using black: {e}")
             return (0, 0, 0, int(255 * opacity))
     
-    def _create_custom_text_watermark(self, text: str, image: Image.Image) -> Image.Image:
+    def _create_custom_text_watermark(self, text: str, img_height: int) -> Image.Image:
         """Create custom text watermark with customizable drop shadow effect."""
         # Calculate font size based on image dimensions
-        font_size = max(16, int(image.height * self.custom_text_size_ratio))
+        font_size = max(16, int(img_height * self.custom_text_size_ratio))
         
         try:
             # Try to load font with calculated size
@@ -531,6 +678,113 @@ class WatermarkProcessor:
         
         return text_img
     
+    def watermark_layers(self, image_size: Tuple[int, int], filename: str) -> List[Tuple[Image.Image, Tuple[int, int]]]:
+        """
+        Compute the watermark overlays and their positions for an image.
+        
+        Args:
+            image_size: Size (width, height) of the image to watermark
+            filename: File name used for number extraction
+            
+        Returns:
+            List[Tuple[Image.Image, Tuple[int, int]]]: RGBA overlays with their
+                paste positions, in the order they are applied
+        """
+        img_width, img_height = image_size
+        layers = []
+        
+        # Extract number from filename
+        number = self._extract_number_from_filename(filename)
+        
+        # Calculate watermark positions
+        png_pos, number_pos = self._calculate_watermark_positions(image_size)
+        
+        # Apply PNG watermark or custom text watermark
+        if self.png_watermark:
+            layers.append((self._get_png_overlay(img_width, img_height), png_pos))
+        elif self.custom_text:
+            # Apply the (cached) custom text watermark
+            layers.append((self._get_custom_text_overlay(img_height), png_pos))
+        
+        # Apply number watermark
+        if number and self.enable_numbering:
+            number_watermark = self._create_number_watermark(number, img_height)
+            
+            # Get the dimensions of the number watermark
+            bbox = number_watermark.getbbox()
+            number_width = bbox[2] - bbox[0]
+            number_height = bbox[3] - bbox[1]
+            
+            # Calculate the position for the number watermark
+            # The number_pos was calculated earlier and includes the number_x_offset and number_y_offset
+            number_x, number_y = self._calculate_number_position(img_width, img_height, number_width, number_height)
+            
+            layers.append((number_watermark, (number_x, number_y)))
+        
+        return layers
+    
+    def apply_watermarks(self, image: Image.Image, filename: str) -> Image.Image:
+        """
+        Apply the configured watermarks to an already decoded image.
+        
+        The input image is left untouched so the same decoded frame can be
+        watermarked with several configurations.
+        
+        Args:
+            image: Decoded source image (any mode)
+            filename: File name used for number extraction
+            
+        Returns:
+            Image.Image: Watermarked RGBA copy of the image
+        """
+        # Convert to RGBA if not already, otherwise work on a copy
+        if image.mode != 'RGBA':
+            watermarked = image.convert('RGBA')
+        else:
+            watermarked = image.copy()
+        
+        for overlay, position in self.watermark_layers(watermarked.size, filename):
+            watermarked.paste(overlay, position, overlay)
+        
+        return watermarked
+    
+    def watermark_image(self, source: ImageSource, filename: Optional[str] = None) -> Image.Image:
+        """
+        Watermark an image given as bytes, a file-like object or a decoded Image.
+        
+        Nothing is written to disk.
+        
+        Args:
+            source: Encoded image bytes, binary file-like object or PIL Image
+            filename: File name used for number extraction (defaults to the
+                file-like object's name or the Image's filename, if any)
+            
+        Returns:
+            Image.Image: Watermarked RGBA image
+        """
+        if isinstance(source, Image.Image):
+            return self.apply_watermarks(source, filename or _source_name(source))
+        
+        with open_image_source(source) as img:
+            return self.apply_watermarks(img, filename or _source_name(source))
+    
+    def watermark_bytes(self, source: ImageSource, output_format: str,
+                        filename: Optional[str] = None, **encoder_options) -> bytes:
+        """
+        Watermark an image and return it encoded, without intermediate files.
+        
+        Args:
+            source: Encoded image bytes, binary file-like object or PIL Image
+            output_format: Pillow format name of the result (e.g. 'JPEG', 'PNG', 'WEBP')
+            filename: File name used for number extraction
+            encoder_options: Pillow save() options overriding ENCODER_DEFAULTS
+                (e.g. quality=90, progressive=True)
+            
+        Returns:
+            bytes: Encoded watermarked image
+        """
+        return encode_image(self.watermark_image(source, filename), output_format, **encoder_options)
+    
     def process_image(self, input_path: str, output_path: str) -> bool:
         """
         Process a single image with watermarks.
@@ -543,80 +797,9 @@ class WatermarkProcessor:
             bool: True if successful, False otherwise
         """
         try:
-            # Open and convert image to RGBA
             with Image.open(input_path) as img:
-                # Convert to RGBA if not already
-                if img.mode != 'RGBA':
-                    img = img.convert('RGBA')
-                
-                # Create a copy for watermarking
-                watermarked = img.copy()
-                
-                # Extract number from filename
-                number = self._extract_number_from_filename(Path(input_path).name)
-                
-                # Calculate watermark positions
-                png_pos, number_pos = self._calculate_watermark_positions(watermarked)
-                
-                # Apply PNG watermark or custom text watermark
-                if self.png_watermark:
-                    resized_png = self._resize_png_watermark(watermarked)
-                    
-                    # Create a copy of PNG watermark with proper alpha handling
-                    # Instead of overwriting alpha with putalpha(), we'll blend the alpha properly
-                    png_with_opacity = resized_png.copy()
-                    
-                    # Get the original alpha channel
-                    original_alpha = png_with_opacity.split()[-1]  # Get alpha channel
-                    
-                    # Apply opacity to the alpha channel while preserving transparency
-                    if self.png_opacity != 1.0:
-                        # Create new alpha channel with adjusted opacity
-                        new_alpha = original_alpha.point(lambda x: int(x * self.png_opacity))
-                        png_with_opacity.putalpha(new_alpha)
-                    
-                    # Paste PNG watermark
-                    watermarked.paste(png_with_opacity, png_pos, png_with_opacity)
-                elif self.custom_text:
-                    # Create and apply custom text watermark
-                    custom_text_watermark = self._create_custom_text_watermark(self.custom_text, watermarked)
-                    
-                    # Paste custom text watermark
-                    watermarked.paste(custom_text_watermark, png_pos, custom_text_watermark)
-                
-                # Apply number watermark
-                if number and self.enable_numbering:
-                    number_watermark = self._create_number_watermark(number, watermarked)
-                    
-                    # Get the dimensions of the number watermark
-                    bbox = number_watermark.getbbox()
-                    number_width = bbox[2] - bbox[0]
-                    number_height = bbox[3] - bbox[1]
-                    
-                    # Calculate the position for the number watermark
-                    # The number_pos was calculated earlier and includes the number_x_offset and number_y_offset
-                    number_x, number_y = self._calculate_number_position(watermarked, watermarked.width, watermarked.height, number_width, number_height)
-                    
-                    watermarked.paste(number_watermark, (number_x, number_y), number_watermark)
-                
-                # Save watermarked image
-                # Ensure output directory exists
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                
-                # Convert back to original mode for saving
-                if img.mode != 'RGBA':
-                    watermarked = watermarked.convert(img.mode)
-                
-                # Save with original quality - no optimization or quality reduction
-                if output_path.lower().endswith('.jpg') or output_path.lower().endswith('.jpeg'):
-                    # For JPEG, ensure we're in RGB mode
-                    if watermarked.mode == 'RGBA':
-                        watermarked = watermarked.convert('RGB')
-                    # Save with maximum quality, no optimization to preserve original quality
-                    watermarked.save(output_path, 'JPEG', quality=100, optimize=False)
-                else:
-                    # For other formats, save as is with no optimization
-                    watermarked.save(output_path, optimize=False)
+                watermarked = self.apply_watermarks(img, Path(input_path).name)
+                save_watermarked_image(watermarked, output_path)
                 
                 logger.info(f"Successfully processed: {input_path} -> {output_path}")
                 return True
@@ -625,6 +808,222 @@ class WatermarkProcessor:
             logger.error(f"Failed to process {input_path}: {e}")
             return False
 
+def _source_name(source: ImageSource) -> str:
+    """File name of an image source, if it has one."""
+    name = getattr(source, 'filename', None) or getattr(source, 'name', None)
+    return os.path.basename(name) if isinstance(name, str) else ''
+
+def open_image_source(source: ImageSource) -> Image.Image:
+    """
+    Open an image from bytes or a binary file-like object (lazily decoded).
+    
+    Raises:
+        ValueError: If the source type is not supported
+        PIL.UnidentifiedImageError: If the data is not a supported image
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    if hasattr(source, 'read'):
+        return Image.open(source)
+    raise ValueError(f"Unsupported image source: {type(source).__name__}")
+
+def encode_image(image: Image.Image, output_format: str, **encoder_options) -> bytes:
+    """
+    Encode an image to bytes in an explicit format.
+    
+    Args:
+        image: Image to encode (RGBA is converted to RGB for JPEG)
+        output_format: Pillow format name (e.g. 'JPEG', 'PNG', 'WEBP')
+        encoder_options: Pillow save() options overriding ENCODER_DEFAULTS
+        
+    Returns:
+        bytes: Encoded image
+    """
+    output_format = output_format.upper()
+    if output_format == 'JPG':
+        output_format = 'JPEG'
+    if output_format == 'JPEG' and image.mode == 'RGBA':
+        image = image.convert('RGB')
+    
+    options = dict(ENCODER_DEFAULTS.get(output_format, {}))
+    options.update(encoder_options)
+    buffer = io.BytesIO()
+    image.save(buffer, output_format, **options)
+    return buffer.getvalue()
+
+def encoder_profile(output_path: str) -> dict:
+    """Pillow save() options (format included) an output path is written with."""
+    # Save with original quality - no optimization or quality reduction
+    if output_path.lower().endswith('.jpg') or output_path.lower().endswith('.jpeg'):
+        # Save with maximum quality, no optimization to preserve original quality
+        return {'format': 'JPEG', 'quality': 100, 'optimize': False}
+    # For other formats, save as is with no optimization; the format cannot be
+    # inferred from the partial file's name
+    return {'format': Image.registered_extensions().get(Path(output_path).suffix.lower()), 'optimize': False}
+
+def save_watermarked_image(watermarked: Image.Image, output_path: str) -> None:
+    """
+    Save a watermarked image with original quality.
+    
+    Args:
+        watermarked: Watermarked RGBA image
+        output_path: Path to save watermarked image
+    """
+    save_options = encoder_profile(output_path)
+    # For JPEG, ensure we're in RGB mode
+    if save_options['format'] == 'JPEG' and watermarked.mode == 'RGBA':
+        watermarked = watermarked.convert('RGB')
+    
+    # Ensure output directory exists (created once per directory, not per image)
+    output_dir = os.path.dirname(output_path) or '.'
+    if output_dir not in _created_dirs:
+        os.makedirs(output_dir, exist_ok=True)
+        _created_dirs.add(output_dir)
+    
+    # Written under a temporary name and renamed when complete, so a cancelled
+    # or killed run never leaves a truncated image behind
+    partial_path = f"{output_path}.{os.getpid()}{PARTIAL_SUFFIX}"
+    try:
+        try:
+            watermarked.save(partial_path, **save_options)
+        except FileNotFoundError:
+            # The directory was removed since it was created
+            os.makedirs(output_dir, exist_ok=True)
+            watermarked.save(partial_path, **save_options)
+        os.replace(partial_path, output_path)
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+
+def remove_partial_outputs(directory: str, pid: Union[int, Iterable[int], None] = None) -> int:
+    """
+    Delete the partial files of interrupted saves below a directory.
+    
+    Args:
+        directory: Output folder to clean
+        pid: Only remove the partial files written by this process (or these processes)
+        
+    Returns:
+        int: Number of files removed
+    """
+    if pid is None:
+        suffix = PARTIAL_SUFFIX
+    else:
+        pids = [pid] if isinstance(pid, int) else list(pid)
+        suffix = tuple(f".{process_id}{PARTIAL_SUFFIX}" for process_id in pids)
+        if not suffix:
+            return 0
+    removed = 0
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            if name.endswith(suffix):
+                try:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+                except OSError as e:
+                    logger.warning(f"Cannot remove partial output {name}: {e}")
+    return removed
+
+def _file_size(path: str) -> int:
+    """Size of a file in bytes, 0 if it cannot be read."""
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def process_image_fanout(input_path: str, output_paths: Dict[str, str],
+                         processors: Dict[str, WatermarkProcessor],
+                         stats: Optional[dict] = None, cache=None) -> Dict[str, bool]:
+    """
+    Decode an image once and apply several processors to the in-memory frame.
+    
+    Args:
+        input_path: Path to input image
+        output_paths: Output path per processor name
+        processors: WatermarkProcessor per name
+        stats: Optional dict filled with measurements of this image: seconds
+            per processor name (shared decode included), busy_seconds,
+            bytes_read, bytes_written, cache_hits and cache_misses (overlays),
+            output_cache_hits and output_cache_misses
+        cache: Optional watermark_cache.OutputCache; outputs found in it are
+            linked into place, the image is only decoded for the others
+        
+    Returns:
+        Dict[str, bool]: Success per processor name
+    """
+    results = {name: False for name in output_paths}
+    filename = Path(input_path).name
+    started = time.perf_counter()
+    if stats is not None:
+        stats.update(seconds={}, busy_seconds=0.0, bytes_read=0, bytes_written=0,
+                     cache_hits=0, cache_misses=0, output_cache_hits=0, output_cache_misses=0)
+    
+    cache_keys = {}
+    if cache is not None:
+        for name, output_path in output_paths.items():
+            if name not in processors:
+                continue
+            fetch_started = time.perf_counter()
+            try:
+                cache_keys[name] = cache.key(input_path, processors[name], output_path)
+            except OSError as e:
+                logger.warning(f"Output cache unavailable for {input_path}: {e}")
+                break
+            results[name] = cache.fetch(cache_keys[name], output_path)
+            if results[name]:
+                logger.info(f"Successfully processed: {input_path} -> {output_path} (output cache)")
+            if stats is not None:
+                stats['output_cache_hits' if results[name] else 'output_cache_misses'] += 1
+                if results[name]:
+                    stats['seconds'][name] = time.perf_counter() - fetch_started
+        output_paths = {name: path for name, path in output_paths.items() if not results[name]}
+        if not output_paths:
+            if stats is not None:
+                stats['busy_seconds'] = time.perf_counter() - started
+            return results
+    
+    try:
+        with Image.open(input_path) as img:
+            frame = img.convert('RGBA') if img.mode != 'RGBA' else img.copy()
+    except Exception as e:
+        logger.error(f"Failed to decode {input_path}: {e}")
+        if stats is not None:
+            stats['busy_seconds'] = time.perf_counter() - started
+        return results
+    decode_seconds = time.perf_counter() - started
+    
+    for name, output_path in output_paths.items():
+        config_started = time.perf_counter()
+        processor = processors.get(name)
+        hits, misses = processor.cache_counts() if processor else (0, 0)
+        try:
+            watermarked = processors[name].apply_watermarks(frame, filename)
+            save_watermarked_image(watermarked, output_path)
+            results[name] = True
+            logger.info(f"Successfully processed: {input_path} -> {output_path}")
+            if name in cache_keys:
+                cache.store(cache_keys[name], output_path)
+        except Exception as e:
+            logger.error(f"Failed to process {input_path} with {name}: {e}")
+        
+        if stats is not None:
+            stats['seconds'][name] = decode_seconds + time.perf_counter() - config_started
+            if processor:
+                now_hits, now_misses = processor.cache_counts()
+                stats['cache_hits'] += now_hits - hits
+                stats['cache_misses'] += now_misses - misses
+            if results[name]:
+                stats['bytes_written'] += _file_size(output_path)
+    
+    if stats is not None:
+        stats['busy_seconds'] = time.perf_counter() - started
+        stats['bytes_read'] = _file_size(input_path)
+    
+    return results
+
 def validate_inputs(input_folder: str, output_folder: str, png_watermark: str = None, custom_text: str = None) -> bool:
     """Validate input parameters."""
     # Check input folder
@@ -669,6 +1068,250 @@ def get_image_files(input_folder: str) -> list:
     
     return sorted(image_files)
 
+def read_image_info(image_path: str) -> Optional[Tuple[Tuple[int, int], str]]:
+    """Read image dimensions and mode from the file header without decoding pixel data."""
+    try:
+        # Only the header is read: large images warn when they are decoded
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(image_path) as img:
+                return img.size, img.mode
+    except Exception:
+        return None
+
+def read_image_size(image_path: str) -> Optional[Tuple[int, int]]:
+    """Read image dimensions from the file header without decoding pixel data."""
+    info = read_image_info(image_path)
+    return info[0] if info else None
+
+def set_pixel_limit(max_pixels: Optional[int]) -> None:
+    """
+    Set the pixel count from which Pillow treats an image as a decompression bomb.
+    
+    Pillow warns above the limit and refuses to open images above twice the
+    limit. Executors with a pixel limit quarantine larger images before they
+    are decoded, so images up to the limit open without a warning.
+    """
+    if max_pixels:
+        Image.MAX_IMAGE_PIXELS = int(max_pixels)
+
+def decoded_pixel_bytes(mode: str) -> int:
+    """Bytes per pixel of a decoded image (Pillow stores multi-band modes in 4 bytes)."""
+    try:
+        if Image.getmodebands(mode) > 1:
+            return 4
+        return int(ImageMode.getmode(mode).typestr[-1])
+    except (KeyError, ValueError):
+        return 4
+
+def estimate_image_memory(size: Optional[Tuple[int, int]], mode: Optional[str] = None,
+                          configs: int = 1) -> int:
+    """
+    Estimate the peak memory of watermarking an image from its header.
+    
+    Counts width x height x bytes per pixel of every copy of the image: the
+    decoded frame (in its mode), its RGBA conversion, one watermarked RGBA
+    copy per configuration and the RGB copy the JPEG encoder needs. Not all of
+    them are referenced at the same moment, but freed image buffers are not
+    always returned to the system before the next one is allocated, so the
+    budget counts them all.
+    
+    Args:
+        size: Image size (width, height) from the header
+        mode: Pillow mode from the header (default: RGB)
+        configs: Configurations applied to the decoded frame (fan-out)
+        
+    Returns:
+        int: Estimated bytes, 0 if the size is unknown
+    """
+    if not size:
+        return 0
+    pixels = size[0] * size[1]
+    rgba = decoded_pixel_bytes('RGBA')
+    # Pillow stores RGB in 4 bytes per pixel as well
+    jpeg_copy = decoded_pixel_bytes('RGB')
+    return pixels * (decoded_pixel_bytes(mode or 'RGB') + rgba + rgba * max(1, configs) + jpeg_copy)
+
+def image_memory(image_path: str) -> int:
+    """Estimated peak memory of watermarking an image file (see estimate_image_memory)."""
+    info = read_image_info(image_path)
+    return estimate_image_memory(*info) if info else 0
+
+class MemoryBudget:
+    """
+    Memory shared by the images being processed at the same time.
+    
+    Images are admitted in arrival order while their estimated footprints (see
+    estimate_image_memory) fit the budget. An image that does not fit waits for
+    images in progress to finish, and images after it wait behind it, so large
+    images are delayed, never starved. An image larger than the whole budget
+    is processed alone.
+    """
+    
+    def __init__(self, total_bytes: int):
+        """
+        Initialize the budget.
+        
+        Args:
+            total_bytes: Memory for the decoded images of all workers together
+        """
+        self.total = max(1, int(total_bytes))
+        self.in_use = 0
+        self.peak = 0
+        self._waiting = collections.deque()
+        self._changed = threading.Condition()
+    
+    def acquire(self, nbytes: int, name: str = '') -> int:
+        """
+        Wait until an image's footprint fits the budget and take it.
+        
+        Returns:
+            int: Bytes taken, to be passed to release()
+        """
+        nbytes = max(0, int(nbytes))
+        if nbytes > self.total:
+            logger.warning(f"{name or 'Image'} needs about {nbytes / 1e6:.0f} MB, more than the memory budget "
+                           f"of {self.total / 1e6:.0f} MB: processing it alone")
+            nbytes = self.total
+        ticket = object()
+        with self._changed:
+            self._waiting.append(ticket)
+            try:
+                if self.in_use + nbytes > self.total:
+                    logger.debug(f"Waiting for {nbytes / 1e6:.0f} MB of memory budget: {name}")
+                self._changed.wait_for(lambda: self._waiting[0] is ticket and self.in_use + nbytes <= self.total)
+                self.in_use += nbytes
+                self.peak = max(self.peak, self.in_use)
+                return nbytes
+            finally:
+                self._waiting.remove(ticket)
+                self._changed.notify_all()
+    
+    def release(self, nbytes: int) -> None:
+        """Return memory taken with acquire()."""
+        with self._changed:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._changed.notify_all()
+    
+    @contextlib.contextmanager
+    def reserve(self, nbytes: int, name: str = '') -> Iterator[int]:
+        """Hold an image's footprint while the block runs."""
+        taken = self.acquire(nbytes, name)
+        try:
+            yield taken
+        finally:
+            self.release(taken)
+    
+    @property
+    def waiting(self) -> int:
+        """Number of images waiting for memory."""
+        with self._changed:
+            return len(self._waiting)
+
+def output_is_current(input_path: str, output_path: str) -> bool:
+    """Check whether an output exists and is newer than its input."""
+    try:
+        return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+    except OSError:
+        return False
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a shard specification "i/N" (0 <= i < N) for argparse."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', value or '')
+    if not match or int(match.group(2)) < 1 or int(match.group(1)) >= int(match.group(2)):
+        raise argparse.ArgumentTypeError(f"Invalid shard '{value}', expected i/N with 0 <= i < N")
+    return int(match.group(1)), int(match.group(2))
+
+def shard_of(key: str, shard_count: int) -> int:
+    """Assign a key (e.g. a relative image path) to one of shard_count shards."""
+    # Stable across hosts, platforms and Python runs (unlike hash())
+    digest = hashlib.sha1(key.replace(os.sep, '/').encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % shard_count
+
+def in_shard(key: str, shard: Optional[Tuple[int, int]]) -> bool:
+    """Return True if the key belongs to the shard (always True without sharding)."""
+    return shard is None or shard_of(key, shard[1]) == shard[0]
+
+def shard_key(img_file: str) -> str:
+    """
+    Shard key of an input image: the name of its output file.
+    
+    Outputs are written flat into the output folder, so images of different
+    subfolders with the same file name write the same output; keying on that
+    name keeps them in one shard instead of two hosts overwriting each other.
+    """
+    return Path(img_file).name
+
+def output_collisions(image_files: list) -> Dict[str, List[str]]:
+    """Input images per output file name, for the names written by more than one image."""
+    by_name = collections.defaultdict(list)
+    for img_file in image_files:
+        by_name[Path(img_file).name].append(img_file)
+    return {name: files for name, files in by_name.items() if len(files) > 1}
+
+def verify_output(input_folder: str, output_folder: str,
+                  shard_count: Optional[int] = None) -> bool:
+    """
+    Check that every input image has its output (e.g. the union of all shards).
+    
+    Args:
+        input_folder: Source directory containing images
+        output_folder: Destination directory shared by all shards
+        shard_count: Report missing outputs per shard of this many shards
+        
+    Returns:
+        bool: True if no output is missing
+    """
+    image_files = get_image_files(input_folder)
+    missing = [
+        img_file for img_file in image_files
+        if not os.path.isfile(os.path.join(output_folder, Path(img_file).name))
+    ]
+    
+    logger.info(f"Verified {len(image_files)} images: {len(image_files) - len(missing)} outputs present, "
+                f"{len(missing)} missing")
+    for img_file in missing:
+        rel_path = os.path.relpath(img_file, input_folder)
+        shard_info = f" (shard {shard_of(shard_key(img_file), shard_count)}/{shard_count})" if shard_count else ""
+        logger.warning(f"Missing output for {rel_path}{shard_info}")
+    return not missing
+
+def run_watch_mode(processor: WatermarkProcessor, image_files: list, args,
+                   memory_budget: Optional[MemoryBudget] = None) -> None:
+    """Process images without an up-to-date output, then keep watching the input folder."""
+    # Imported lazily: only needed for the long-running mode
+    from watch_folder import WatchService
+    
+    def accept(img_file: str) -> bool:
+        return not args.shard or in_shard(shard_key(img_file), args.shard)
+    
+    def handle(img_file: str) -> bool:
+        output_file = os.path.join(args.output_folder, Path(img_file).name)
+        if args.dry_run:
+            logger.info(f"Would process: {img_file} -> {output_file}")
+            return True
+        if memory_budget is None:
+            return processor.process_image(img_file, output_file)
+        with memory_budget.reserve(image_memory(img_file), img_file):
+            return processor.process_image(img_file, output_file)
+    
+    pending = [
+        img_file for img_file in image_files
+        if accept(img_file) and not output_is_current(img_file, os.path.join(args.output_folder, Path(img_file).name))
+    ]
+    logger.info(f"Watch mode: {len(pending)} of {len(image_files)} existing images need processing")
+    
+    service = WatchService(
+        args.input_folder, handle,
+        workers=args.watch_workers,
+        queue_size=args.watch_queue_size,
+        settle_seconds=args.watch_settle,
+        poll_interval=args.watch_poll_interval,
+        exclude=[args.output_folder],
+        accept=accept
+    )
+    service.run(initial=pending)
+
 def main():
     """Main function."""
     parser = argparse.ArgumentParser(
@@ -687,6 +1330,13 @@ def main():
    
    # PNG watermark with custom settings
    %(prog)s --input-folder "./photos" --output-folder "./watermarked" --png-watermark "./logo.png" --enable-numbering --png-opacity 0.5 --font-size-ratio 0.04 --margin 30
+   
+   # Split a job over 4 hosts (run 0/4 ... 3/4), then check the merged output
+   %(prog)s --input-folder "./photos" --output-folder "./watermarked" --custom-text "mypage.com" --shard 1/4
+   %(prog)s --input-folder "./photos" --output-folder "./watermarked" --verify-output --shard 0/4
+   
+   # Keep running and watermark new or changed images as they arrive
+   %(prog)s --input-folder "./hotfolder" --output-folder "./watermarked" --custom-text "mypage.com" --watch
         """
     )
     
@@ -755,11 +1405,54 @@ def main():
                        help='X offset for number watermark position (can be negative, default: 0)')
     parser.add_argument('--number-y-offset', type=int, default=0,
                        help='Y offset for number watermark position (can be negative, default: 0)')
+    parser.add_argument('--processes', type=int, default=1,
+                       help='Number of worker processes sharing the watermark assets (default: 1)')
+    parser.add_argument('--recycle-after', type=int, default=None,
+                       help='Replace a worker process after this many images (default: never)')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                       help='Memory in GB for the images decoded by all workers together (requires --processes '
+                            'greater than 1 or --watch); images whose estimated footprint does not fit wait for '
+                            'images in progress to finish (default: no limit)')
+    parser.add_argument('--image-timeout', type=float, default=None,
+                       help='Seconds an image may take: the worker process of a slower image is replaced and the '
+                            'image quarantined (uses worker processes, default: no limit)')
+    parser.add_argument('--max-pixels', type=float, default=None,
+                       help='Largest image in megapixels (from the header); larger images are quarantined without '
+                            'being decoded (uses worker processes, default: Pillow\'s decompression bomb limit)')
+    parser.add_argument('--quarantine-list', default='watermark_quarantine.jsonl',
+                       help='File the quarantined images are listed in with the reason '
+                            '(default: watermark_quarantine.jsonl)')
+    parser.add_argument('--shard', type=parse_shard, default=None,
+                       help='Process only shard i of N (e.g. "0/4"); images are assigned by a stable hash '
+                            'of their output file name')
+    parser.add_argument('--verify-output', action='store_true',
+                       help='Check that the output folder holds an output for every input image '
+                            '(e.g. after all shards ran) and exit')
+    parser.add_argument('--watch', action='store_true',
+                       help='Keep running and process new or changed images as they arrive '
+                            '(images without an up-to-date output are processed first)')
+    parser.add_argument('--watch-settle', type=float, default=1.0,
+                       help='Seconds a file must stay unchanged before it is processed (default: 1.0)')
+    parser.add_argument('--watch-workers', type=int, default=1,
+                       help='Worker threads in watch mode (default: 1)')
+    parser.add_argument('--watch-queue-size', type=int, default=100,
+                       help='Maximum images waiting for a worker in watch mode (default: 100)')
+    parser.add_argument('--watch-poll-interval', type=float, default=1.0,
+                       help='Scan interval when inotify is unavailable (default: 1.0)')
     parser.add_argument('--dry-run', action='store_true',
                        help='Show what would be processed without actually processing')
     
     args = parser.parse_args()
     
+    # The budget is shared by concurrent images; one image at a time has nothing to share
+    if args.memory_budget and not (args.processes > 1 or args.watch or args.image_timeout or args.max_pixels):
+        parser.error("--memory-budget needs --processes greater than 1 or --watch")
+    
+    if args.verify_output:
+        complete = verify_output(args.input_folder, args.output_folder,
+                                 args.shard[1] if args.shard else None)
+        sys.exit(0 if complete else 1)
+    
     # Validate inputs
     if not validate_inputs(args.input_folder, args.output_folder, args.png_watermark, args.custom_text):
         sys.exit(1)
@@ -800,10 +1493,27 @@ def main():
     # Get list of image files
     image_files = get_image_files(args.input_folder)
     
+    memory_budget = MemoryBudget(int(args.memory_budget * 1024 ** 3)) if args.memory_budget else None
+    max_pixels = int(args.max_pixels * 1e6) if args.max_pixels else None
+    set_pixel_limit(max_pixels)
+    
+    if args.watch:
+        run_watch_mode(processor, image_files, args, memory_budget)
+        return
+    
     if not image_files:
         logger.warning(f"No image files found in: {args.input_folder}")
         return
     
+    collisions = output_collisions(image_files)
+    if collisions:
+        logger.warning(f"{len(collisions)} output names are written by several input images, only the last "
+                       f"one processed is kept: {', '.join(sorted(collisions)[:5])}")
+    
+    if args.shard:
+        image_files = [img_file for img_file in image_files if in_shard(shard_key(img_file), args.shard)]
+        logger.info(f"Shard {args.shard[0]}/{args.shard[1]}: {len(image_files)} images assigned")
+    
     logger.info(f"Found {len(image_files)} image files to process")
     
     if args.dry_run:
@@ -817,17 +1527,50 @@ def main():
     successful = 0
     failed = 0
     
-    for i, img_file in enumerate(image_files, 1):
-        logger.info(f"Processing {i}/{len(image_files)}: {Path(img_file).name}")
+    # Per-image limits are enforced by replacing worker processes
+    if args.processes > 1 or args.image_timeout or max_pixels:
+        # Imported lazily: watermark_pool builds on this module
+        from watermark_pool import ImageQuarantined, QuarantineList, WatermarkProcessPool, common_image_sizes
         
-        # Create output path
-        output_file = os.path.join(args.output_folder, Path(img_file).name)
+        overlay_sizes = common_image_sizes(read_image_size(img_file) for img_file in image_files)
+        logger.info(f"Processing with {args.processes} worker processes")
+        quarantine = QuarantineList(args.quarantine_list)
         
-        # Process image
-        if processor.process_image(img_file, output_file):
-            successful += 1
-        else:
-            failed += 1
+        with WatermarkProcessPool({'default': processor}, args.processes,
+                                  args.recycle_after, overlay_sizes,
+                                  memory_budget=memory_budget, image_timeout=args.image_timeout,
+                                  max_pixels=max_pixels) as pool:
+            futures = [
+                pool.submit(img_file, {'default': os.path.join(args.output_folder, Path(img_file).name)})
+                for img_file in image_files
+            ]
+            for img_file, future in zip(image_files, futures):
+                try:
+                    success = future.result()['default']
+                except ImageQuarantined as e:
+                    quarantine.add(img_file, e.reason)
+                    success = False
+                except Exception as e:
+                    logger.error(f"Worker failed: {e}")
+                    success = False
+                if success:
+                    successful += 1
+                else:
+                    failed += 1
+        if quarantine.entries:
+            logger.warning(f"{len(quarantine.entries)} images quarantined, listed in {quarantine.path}")
+    else:
+        for i, img_file in enumerate(image_files, 1):
+            logger.info(f"Processing {i}/{len(image_files)}: {Path(img_file).name}")
+            
+            # Create output path
+            output_file = os.path.join(args.output_folder, Path(img_file).name)
+            
+            # Process image
+            if processor.process_image(img_file, output_file):
+                successful += 1
+            else:
+                failed += 1
     
     # Summary
     logger.info(f"Processing complete!")